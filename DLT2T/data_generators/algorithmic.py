@@ -13,11 +13,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-"""Algorithmic data generators."""
+"""Algorithmic data generators.
+
+The generators produce batches of cases as int64 arrays [batch_size, length],
+every row a case padded with -1 (see batch_generator), and
+AlgorithmicProblem.generate_data writes the shards in a pool of processes.
+"""
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import multiprocessing
+
 # Dependency imports
 
 import numpy as np
@@ -29,17 +36,152 @@ from DLT2T.data_generators import problem
 from DLT2T.data_generators import text_encoder
 from DLT2T.utils import registry
 
+import tensorflow as tf
+
+# Padding of the rows of batches, which are not all of the same length.
+_PAD = -1
+_BATCH_SIZE = 1000
+
+
+def sequence_lengths(ids):
+  """Helper function: the lengths of the rows of a batch."""
+  return (ids != _PAD).sum(axis=1)
+
+
+def pad_sequences(values, lengths):
+  """Helper function: split values into rows of the given lengths.
+
+  Args:
+    values: array of lengths.sum() symbols, the rows one after the other.
+    lengths: int array [batch_size] of the lengths of the rows.
+
+  Returns:
+    int64 array [batch_size, max(lengths)] padded with -1.
+  """
+  lengths = np.asarray(lengths)
+  ids = np.full([len(lengths), lengths.max() if len(lengths) else 0], _PAD,
+                dtype=np.int64)
+  ids[np.arange(ids.shape[1]) < lengths[:, None]] = values
+  return ids
+
+
+def reverse_sequences(ids):
+  """Helper function: reverse the rows of a batch, keeping the padding last."""
+  lengths = sequence_lengths(ids)
+  positions = lengths[:, None] - 1 - np.arange(ids.shape[1])
+  reversed_ids = ids[np.arange(len(ids))[:, None], np.maximum(positions, 0)]
+  reversed_ids[positions < 0] = _PAD
+  return reversed_ids
+
+
+def concat_sequences(ids1, ids2):
+  """Helper function: append the rows of ids2 to the rows of ids1."""
+  lengths1 = sequence_lengths(ids1)
+  ids = np.full([len(ids1), ids1.shape[1] + ids2.shape[1]], _PAD,
+                dtype=np.int64)
+  ids[:, :ids1.shape[1]] = ids1
+  rows, columns = np.nonzero(ids2 != _PAD)
+  ids[rows, lengths1[rows] + columns] = ids2[rows, columns]
+  return ids
+
+
+def batch_cases(cases, batch_size=_BATCH_SIZE):
+  """Helper function: group {feature: symbol list} cases into batches."""
+  batch = []
+  for case in cases:
+    batch.append(case)
+    if len(batch) == batch_size:
+      yield _pad_batch(batch)
+      batch = []
+  if batch:
+    yield _pad_batch(batch)
+
+
+def _pad_batch(cases):
+  batch = {}
+  for feature in cases[0]:
+    sequences = [np.asarray(case[feature], dtype=np.int64) for case in cases]
+    batch[feature] = pad_sequences(
+        np.concatenate(sequences), [len(s) for s in sequences])
+  return batch
+
+
+def unbatch_cases(batches):
+  """Helper function: the {feature: symbol list} cases of batches."""
+  for batch in batches:
+    rows = {feature: [row[:length].tolist() for row, length in zip(
+        ids, sequence_lengths(ids))] for feature, ids in batch.items()}
+    for i in xrange(len(next(iter(rows.values())))):
+      yield {feature: rows[feature][i] for feature in rows}
+
+
+def _batch_sizes(nbr_cases, batch_size):
+  for start in xrange(0, nbr_cases, batch_size):
+    yield min(batch_size, nbr_cases - start)
+
+
+def random_sequences(nbr_symbols, lengths):
+  """Helper function: rows of symbols drawn uniformly from [0, nbr_symbols)."""
+  return pad_sequences(np.random.randint(nbr_symbols, size=lengths.sum()),
+                       lengths)
+
+
+def _shift_and_append_eos(ids):
+  """Shift by NUM_RESERVED_IDS and append EOS token."""
+  lengths = sequence_lengths(ids)
+  shifted = np.full([len(ids), ids.shape[1] + 1], _PAD, dtype=np.int64)
+  shifted[:, :-1] = np.where(
+      ids != _PAD, ids + text_encoder.NUM_RESERVED_TOKENS, _PAD)
+  shifted[np.arange(len(ids)), lengths] = text_encoder.EOS_ID
+  return shifted
+
+
+def _generate_shard(args):
+  """Writes the cases of a shard, generated from the given random seed."""
+  problem, nbr_symbols, max_length, nbr_cases, filename, seed = args
+  np.random.seed(seed)
+  writer = tf.python_io.TFRecordWriter(filename)
+  for batch in problem.batch_generator(nbr_symbols, max_length, nbr_cases):
+    batch = {feature: _shift_and_append_eos(ids)
+             for feature, ids in batch.items()}
+    for case in unbatch_cases([batch]):
+      writer.write(utils.to_example(case).SerializeToString())
+  writer.close()
+  return filename
+
 
 class AlgorithmicProblem(problem.Problem):
-  """Base class for algorithmic problems."""
+  """Base class for algorithmic problems.
+
+  Subclasses implement generator, or batch_generator if they can generate
+  whole batches with numpy.
+  """
 
   @property
   def num_symbols(self):
     raise NotImplementedError()
 
   def generator(self, nbr_symbols, max_length, nbr_cases):
-    """Generates the data."""
-    raise NotImplementedError()
+    """Generates the data, one {feature: symbol list} case at a time."""
+    return unbatch_cases(
+        self.batch_generator(nbr_symbols, max_length, nbr_cases))
+
+  def batch_generator(self, nbr_symbols, max_length, nbr_cases,
+                      batch_size=_BATCH_SIZE):
+    """Generates the data in batches.
+
+    Args:
+      nbr_symbols: number of symbols, or base of the numbers.
+      max_length: integer, maximum length of sequences to generate.
+      nbr_cases: the number of cases to generate.
+      batch_size: maximum number of cases of a batch.
+
+    Yields:
+      A dictionary {feature: int64 array [cases, length]}, where the rows
+      of the arrays are the cases, padded with -1.
+    """
+    return batch_cases(self.generator(nbr_symbols, max_length, nbr_cases),
+                       batch_size)
 
   @property
   def train_length(self):
@@ -61,24 +203,46 @@ class AlgorithmicProblem(problem.Problem):
   def num_shards(self):
     return 10
 
-  def generate_data(self, data_dir, _, task_id=-1):
-
-    def generator_eos(nbr_symbols, max_length, nbr_cases):
-      """Shift by NUM_RESERVED_IDS and append EOS token."""
-      for case in self.generator(nbr_symbols, max_length, nbr_cases):
-        new_case = {}
-        for feature in case:
-          new_case[feature] = [
-              i + text_encoder.NUM_RESERVED_TOKENS for i in case[feature]
-          ] + [text_encoder.EOS_ID]
-        yield new_case
-
-    utils.generate_dataset_and_shuffle(
-        generator_eos(self.num_symbols, self.train_length, self.train_size),
-        self.training_filepaths(data_dir, self.num_shards, shuffled=True),
-        generator_eos(self.num_symbols, self.dev_length, self.dev_size),
-        self.dev_filepaths(data_dir, 1, shuffled=True),
-        shuffle=False)
+  def generate_data(self, data_dir, _, task_id=-1, num_workers=None):
+    """Generates the training and dev shards, in parallel.
+
+    Every shard is generated from its own random seed, drawn from np.random,
+    so the data does not depend on num_workers.
+
+    Args:
+      data_dir: directory of the shards.
+      _: unused temporary directory.
+      task_id: unused.
+      num_workers: number of processes generating shards, by default one per
+        CPU. With 1, the shards are generated in this process.
+    """
+    shards = []
+    for filenames, max_length, size in [
+        (self.training_filepaths(data_dir, self.num_shards, shuffled=True),
+         self.train_length, self.train_size),
+        (self.dev_filepaths(data_dir, 1, shuffled=True),
+         self.dev_length, self.dev_size)]:
+      for i, filename in enumerate(filenames):
+        nbr_cases = size // len(filenames) + int(i < size % len(filenames))
+        shards.append((self, self.num_symbols, max_length, nbr_cases,
+                       filename, np.random.randint(2**31 - 1)))
+    num_workers = min(num_workers or multiprocessing.cpu_count(), len(shards))
+    if num_workers <= 1:
+      random_state = np.random.get_state()
+      for shard in shards:
+        tf.logging.info("Wrote %s.", _generate_shard(shard))
+      np.random.set_state(random_state)
+      return
+    pool = multiprocessing.Pool(num_workers)
+    try:
+      for filename in pool.imap_unordered(_generate_shard, shards):
+        tf.logging.info("Wrote %s.", filename)
+      pool.close()
+    except:
+      pool.terminate()
+      raise
+    finally:
+      pool.join()
 
   def hparams(self, defaults, unused_model_hparams):
     p = defaults
@@ -97,7 +261,8 @@ class AlgorithmicIdentityBinary40(AlgorithmicProblem):
   def num_symbols(self):
     return 2
 
-  def generator(self, nbr_symbols, max_length, nbr_cases):
+  def batch_generator(self, nbr_symbols, max_length, nbr_cases,
+                      batch_size=_BATCH_SIZE):
     """Generator for the identity (copy) task on sequences of symbols.
 
     The length of the sequence is drawn uniformly at random from [1, max_length]
@@ -108,14 +273,15 @@ class AlgorithmicIdentityBinary40(AlgorithmicProblem):
       nbr_symbols: number of symbols to use in each sequence.
       max_length: integer, maximum length of sequences to generate.
       nbr_cases: the number of cases to generate.
+      batch_size: maximum number of cases of a batch.
 
     Yields:
-      A dictionary {"inputs": input-list, "targets": target-list} where
-      input-list and target-list are the same.
+      A dictionary {"inputs": input-array, "targets": target-array} where
+      input-array and target-array are the same.
     """
-    for _ in xrange(nbr_cases):
-      l = np.random.randint(max_length) + 1
-      inputs = [np.random.randint(nbr_symbols) for _ in xrange(l)]
+    for size in _batch_sizes(nbr_cases, batch_size):
+      lengths = np.random.randint(max_length, size=size) + 1
+      inputs = random_sequences(nbr_symbols, lengths)
       yield {"inputs": inputs, "targets": inputs}
 
 
@@ -136,7 +302,8 @@ class AlgorithmicShiftDecimal40(AlgorithmicProblem):
   def num_symbols(self):
     return 20
 
-  def generator(self, nbr_symbols, max_length, nbr_cases):
+  def batch_generator(self, nbr_symbols, max_length, nbr_cases,
+                      batch_size=_BATCH_SIZE):
     """Generator for the shift task on sequences of symbols.
 
     The length of the sequence is drawn uniformly at random from [1, max_length]
@@ -147,16 +314,18 @@ class AlgorithmicShiftDecimal40(AlgorithmicProblem):
       nbr_symbols: number of symbols to use in each sequence (input + output).
       max_length: integer, maximum length of sequences to generate.
       nbr_cases: the number of cases to generate.
+      batch_size: maximum number of cases of a batch.
 
     Yields:
-      A dictionary {"inputs": input-list, "targets": target-list} where
-      target-list[i] = input-list[i] + shift.
+      A dictionary {"inputs": input-array, "targets": target-array} where
+      target-array[i] = input-array[i] + shift.
     """
     shift = 10
-    for _ in xrange(nbr_cases):
-      l = np.random.randint(max_length) + 1
-      inputs = [np.random.randint(nbr_symbols - shift) for _ in xrange(l)]
-      yield {"inputs": inputs, "targets": [i + shift for i in inputs]}
+    for size in _batch_sizes(nbr_cases, batch_size):
+      lengths = np.random.randint(max_length, size=size) + 1
+      inputs = random_sequences(nbr_symbols - shift, lengths)
+      yield {"inputs": inputs,
+             "targets": np.where(inputs != _PAD, inputs + shift, _PAD)}
 
   @property
   def dev_length(self):
@@ -171,7 +340,8 @@ class AlgorithmicReverseBinary40(AlgorithmicProblem):
   def num_symbols(self):
     return 2
 
-  def generator(self, nbr_symbols, max_length, nbr_cases):
+  def batch_generator(self, nbr_symbols, max_length, nbr_cases,
+                      batch_size=_BATCH_SIZE):
     """Generator for the reversing task on sequences of symbols.
 
     The length of the sequence is drawn uniformly at random from [1, max_length]
@@ -182,15 +352,16 @@ class AlgorithmicReverseBinary40(AlgorithmicProblem):
       nbr_symbols: number of symbols to use in each sequence.
       max_length: integer, maximum length of sequences to generate.
       nbr_cases: the number of cases to generate.
+      batch_size: maximum number of cases of a batch.
 
     Yields:
-      A dictionary {"inputs": input-list, "targets": target-list} where
-      target-list is input-list reversed.
+      A dictionary {"inputs": input-array, "targets": target-array} where
+      the rows of target-array are the rows of input-array reversed.
     """
-    for _ in xrange(nbr_cases):
-      l = np.random.randint(max_length) + 1
-      inputs = [np.random.randint(nbr_symbols) for _ in xrange(l)]
-      yield {"inputs": inputs, "targets": list(reversed(inputs))}
+    for size in _batch_sizes(nbr_cases, batch_size):
+      lengths = np.random.randint(max_length, size=size) + 1
+      inputs = random_sequences(nbr_symbols, lengths)
+      yield {"inputs": inputs, "targets": reverse_sequences(inputs)}
 
 
 @registry.register_problem
@@ -212,29 +383,32 @@ def zipf_distribution(nbr_symbols, alpha):
       the range [1.1-1.6].
 
   Returns:
-    distr_map: list of float, Zipf's distribution over nbr_symbols.
+    distr_map: array of nbr_symbols + 1 floats, the cumulative Zipf's
+      distribution over nbr_symbols, starting with 0.
 
   """
   tmp = np.power(np.arange(1, nbr_symbols + 1), -alpha)
   zeta = np.r_[0.0, np.cumsum(tmp)]
-  return [x / zeta[-1] for x in zeta]
+  return zeta / zeta[-1]
 
 
 def zipf_random_sample(distr_map, sample_len):
   """Helper function: Generate a random Zipf sample of given length.
 
   Args:
-    distr_map: list of float, Zipf's distribution over nbr_symbols.
-    sample_len: integer, length of sequence to generate.
+    distr_map: array of float, cumulative Zipf's distribution over
+      nbr_symbols, see zipf_distribution.
+    sample_len: integer or shape of the sample to generate.
 
   Returns:
-    sample: list of integer, Zipf's random sample over nbr_symbols.
+    sample: int64 array of shape sample_len, Zipf's random sample over
+      [0, nbr_symbols).
 
   """
   u = np.random.random(sample_len)
-  # Random produces values in range [0.0,1.0); even if it is almost
-  # improbable(but possible) that it can generate a clear 0.000..0.
-  return list(np.searchsorted(distr_map, u))
+  # Random produces values in range [0.0,1.0), so symbol i is drawn when
+  # distr_map[i] <= u < distr_map[i + 1].
+  return np.searchsorted(distr_map, u, side="right").astype(np.int64) - 1
 
 
 def reverse_generator_nlplike(nbr_symbols,
@@ -242,7 +416,23 @@ def reverse_generator_nlplike(nbr_symbols,
                               nbr_cases,
                               scale_std_dev=100,
                               alpha=1.5):
-  """Generator for the reversing nlp-like task on sequences of symbols.
+  """Generator for the reversing nlp-like task, see reverse_batches_nlplike.
+
+  Yields:
+    A dictionary {"inputs": input-list, "targets": target-list} where
+    target-list is input-list reversed.
+  """
+  return unbatch_cases(reverse_batches_nlplike(
+      nbr_symbols, max_length, nbr_cases, scale_std_dev, alpha))
+
+
+def reverse_batches_nlplike(nbr_symbols,
+                            max_length,
+                            nbr_cases,
+                            scale_std_dev=100,
+                            alpha=1.5,
+                            batch_size=_BATCH_SIZE):
+  """Batch generator for the reversing nlp-like task on sequences of symbols.
 
   The length of the sequence is drawn from a Gaussian(Normal) distribution
   at random from [1, max_length] and with std deviation of 1%,
@@ -258,17 +448,20 @@ def reverse_generator_nlplike(nbr_symbols,
     alpha: float, Zipf's Law Distribution parameter. Default = 1.5.
       Usually for modelling natural text distribution is in
       the range [1.1-1.6].
+    batch_size: maximum number of cases of a batch.
 
   Yields:
-    A dictionary {"inputs": input-list, "targets": target-list} where
-    target-list is input-list reversed.
+    A dictionary {"inputs": input-array, "targets": target-array} where
+    the rows of target-array are the rows of input-array reversed.
   """
   std_dev = max_length / scale_std_dev
   distr_map = zipf_distribution(nbr_symbols, alpha)
-  for _ in xrange(nbr_cases):
-    l = int(abs(np.random.normal(loc=max_length / 2, scale=std_dev)) + 1)
-    inputs = zipf_random_sample(distr_map, l)
-    yield {"inputs": inputs, "targets": list(reversed(inputs))}
+  for size in _batch_sizes(nbr_cases, batch_size):
+    lengths = (np.abs(np.random.normal(
+        loc=max_length / 2, scale=std_dev, size=size)) + 1).astype(np.int64)
+    inputs = pad_sequences(zipf_random_sample(distr_map, lengths.sum()),
+                           lengths)
+    yield {"inputs": inputs, "targets": reverse_sequences(inputs)}
 
 
 @registry.register_problem
@@ -279,9 +472,10 @@ class AlgorithmicReverseNlplike8k(AlgorithmicProblem):
   def num_symbols(self):
     return 8000
 
-  def generator(self, nbr_symbols, max_length, nbr_cases):
-    return reverse_generator_nlplike(nbr_symbols, max_length, nbr_cases, 10,
-                                     1.300)
+  def batch_generator(self, nbr_symbols, max_length, nbr_cases,
+                      batch_size=_BATCH_SIZE):
+    return reverse_batches_nlplike(nbr_symbols, max_length, nbr_cases, 10,
+                                   1.300, batch_size)
 
   @property
   def train_length(self):
@@ -300,9 +494,10 @@ class AlgorithmicReverseNlplike32k(AlgorithmicReverseNlplike8k):
   def num_symbols(self):
     return 32000
 
-  def generator(self, nbr_symbols, max_length, nbr_cases):
-    return reverse_generator_nlplike(nbr_symbols, max_length, nbr_cases, 10,
-                                     1.050)
+  def batch_generator(self, nbr_symbols, max_length, nbr_cases,
+                      batch_size=_BATCH_SIZE):
+    return reverse_batches_nlplike(nbr_symbols, max_length, nbr_cases, 10,
+                                   1.050, batch_size)
 
 
 def lower_endian_to_number(l, base):
@@ -325,6 +520,89 @@ def random_number_lower_endian(length, base):
   return prefix + [np.random.randint(base - 1) + 1]  # Last digit is not 0.
 
 
+def random_numbers_lower_endian(lengths, base):
+  """Helper function: generate rows of random lower-endian digits."""
+  digits = random_sequences(base, lengths)
+  # Last digit can be 0 only if length is 1.
+  long_rows = np.nonzero(lengths > 1)[0]
+  digits[long_rows, lengths[long_rows] - 1] = np.random.randint(
+      base - 1, size=len(long_rows)) + 1
+  return digits
+
+
+def carry_lower_endian(values, base):
+  """Helper function: convert rows of positional values to digits in base.
+
+  This is the base conversion of numbers without Python integers: row i
+  stands for sum_k values[i, k] * base**k and the values are carried over to
+  the next positions until they are digits.
+
+  Args:
+    values: array [batch_size, width] of non-negative integers, lower-endian.
+    base: the base of the digits.
+
+  Returns:
+    int64 array [batch_size, length] of lower-endian digits without leading
+    zeros, padded with -1.
+  """
+  digits = np.array(values, dtype=np.int64)
+  k = 0
+  while k < digits.shape[1]:
+    carry = digits[:, k] // base
+    if carry.any():
+      if k + 1 == digits.shape[1]:
+        digits = np.pad(digits, [(0, 0), (0, 1)], "constant")
+      digits[:, k] -= carry * base
+      digits[:, k + 1] += carry
+    k += 1
+  nonzero = digits != 0
+  lengths = np.where(nonzero.any(axis=1),
+                     digits.shape[1] - nonzero[:, ::-1].argmax(axis=1), 1)
+  digits[np.arange(digits.shape[1]) >= lengths[:, None]] = _PAD
+  return digits[:, :lengths.max()]
+
+
+def numbers_to_lower_endian(numbers, base):
+  """Helper function: convert an array of numbers to rows of digits in base."""
+  return carry_lower_endian(np.asarray(numbers)[:, None], base)
+
+
+def _zero_padded(digits):
+  return np.where(digits != _PAD, digits, 0)
+
+
+def add_lower_endian(digits1, digits2, base):
+  """Helper function: add two batches of lower-endian numbers."""
+  width = max(digits1.shape[1], digits2.shape[1])
+  values = np.zeros([len(digits1), width], dtype=np.int64)
+  values[:, :digits1.shape[1]] += _zero_padded(digits1)
+  values[:, :digits2.shape[1]] += _zero_padded(digits2)
+  return carry_lower_endian(values, base)
+
+
+def multiply_lower_endian(digits1, digits2, base):
+  """Helper function: multiply two batches of lower-endian numbers."""
+  digits1, digits2 = _zero_padded(digits1), _zero_padded(digits2)
+  values = np.zeros([len(digits1), digits1.shape[1] + digits2.shape[1]],
+                    dtype=np.int64)
+  for k in xrange(digits1.shape[1]):
+    values[:, k:k + digits2.shape[1]] += digits1[:, k:k + 1] * digits2
+  return carry_lower_endian(values, base)
+
+
+def _random_operands(base, max_length, size):
+  """Returns the inputs of size cases of an operation and their operands."""
+  lengths1 = np.random.randint(max_length // 2, size=size) + 1
+  # np.random.randint only takes an array as high from numpy 1.17 on.
+  lengths2 = (np.random.random_sample(size) *
+              (max_length - lengths1 - 1)).astype(np.int64) + 1
+  n1 = random_numbers_lower_endian(lengths1, base)
+  n2 = random_numbers_lower_endian(lengths2, base)
+  inputs = concat_sequences(concat_sequences(
+      n1, np.full([size, 1], base, dtype=np.int64)), n2)
+  return inputs, n1, n2
+
+
 @registry.register_problem
 class AlgorithmicAdditionBinary40(AlgorithmicProblem):
   """Problem spec for algorithmic binary addition task."""
@@ -333,7 +611,8 @@ class AlgorithmicAdditionBinary40(AlgorithmicProblem):
   def num_symbols(self):
     return 2
 
-  def generator(self, base, max_length, nbr_cases):
+  def batch_generator(self, base, max_length, nbr_cases,
+                      batch_size=_BATCH_SIZE):
     """Generator for the addition task.
 
     The length of each number is drawn uniformly at random in [1, max_length/2]
@@ -344,26 +623,21 @@ class AlgorithmicAdditionBinary40(AlgorithmicProblem):
       base: in which base are the numbers.
       max_length: integer, maximum length of sequences to generate.
       nbr_cases: the number of cases to generate.
+      batch_size: maximum number of cases of a batch.
 
     Yields:
-      A dictionary {"inputs": input-list, "targets": target-list} where
-      input-list are the 2 numbers and target-list is the result of adding them.
+      A dictionary {"inputs": input-array, "targets": target-array} where
+      input-array are the 2 numbers and target-array is the result of adding
+      them.
 
     Raises:
       ValueError: if max_length is lower than 3.
     """
     if max_length < 3:
       raise ValueError("Maximum length must be at least 3.")
-    for _ in xrange(nbr_cases):
-      l1 = np.random.randint(max_length // 2) + 1
-      l2 = np.random.randint(max_length - l1 - 1) + 1
-      n1 = random_number_lower_endian(l1, base)
-      n2 = random_number_lower_endian(l2, base)
-      result = lower_endian_to_number(n1, base) + lower_endian_to_number(
-          n2, base)
-      inputs = n1 + [base] + n2
-      targets = number_to_lower_endian(result, base)
-      yield {"inputs": inputs, "targets": targets}
+    for size in _batch_sizes(nbr_cases, batch_size):
+      inputs, n1, n2 = _random_operands(base, max_length, size)
+      yield {"inputs": inputs, "targets": add_lower_endian(n1, n2, base)}
 
 
 @registry.register_problem
@@ -383,7 +657,8 @@ class AlgorithmicMultiplicationBinary40(AlgorithmicProblem):
   def num_symbols(self):
     return 2
 
-  def generator(self, base, max_length, nbr_cases):
+  def batch_generator(self, base, max_length, nbr_cases,
+                      batch_size=_BATCH_SIZE):
     """Generator for the multiplication task.
 
     The length of each number is drawn uniformly at random in [1, max_length/2]
@@ -394,27 +669,21 @@ class AlgorithmicMultiplicationBinary40(AlgorithmicProblem):
       base: in which base are the numbers.
       max_length: integer, maximum length of sequences to generate.
       nbr_cases: the number of cases to generate.
+      batch_size: maximum number of cases of a batch.
 
     Yields:
-      A dictionary {"inputs": input-list, "targets": target-list} where
-      input-list are the 2 numbers and target-list is the result of multiplying
-      them.
+      A dictionary {"inputs": input-array, "targets": target-array} where
+      input-array are the 2 numbers and target-array is the result of
+      multiplying them.
 
     Raises:
       ValueError: if max_length is lower than 3.
     """
     if max_length < 3:
       raise ValueError("Maximum length must be at least 3.")
-    for _ in xrange(nbr_cases):
-      l1 = np.random.randint(max_length // 2) + 1
-      l2 = np.random.randint(max_length - l1 - 1) + 1
-      n1 = random_number_lower_endian(l1, base)
-      n2 = random_number_lower_endian(l2, base)
-      result = lower_endian_to_number(n1, base) * lower_endian_to_number(
-          n2, base)
-      inputs = n1 + [base] + n2
-      targets = number_to_lower_endian(result, base)
-      yield {"inputs": inputs, "targets": targets}
+    for size in _batch_sizes(nbr_cases, batch_size):
+      inputs, n1, n2 = _random_operands(base, max_length, size)
+      yield {"inputs": inputs, "targets": multiply_lower_endian(n1, n2, base)}
 
 
 @registry.register_problem
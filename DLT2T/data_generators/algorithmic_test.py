@@ -19,8 +19,11 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import os
+
 # Dependency imports
 
+import numpy as np
 from six.moves import xrange  # pylint: disable=redefined-builtin
 
 from DLT2T.data_generators import algorithmic
@@ -54,6 +57,13 @@ class AlgorithmicTest(tf.test.TestCase):
     for i in xrange(len(d[1:])-1):
       self.assertEqual("%.4f" % (abs(d[i+1]-d[i+2])*(i+2)), "%.4f" % d[1])
 
+  def testZipfRandomSample(self):
+    d = algorithmic.zipf_distribution(10, 1.5)
+    sample = algorithmic.zipf_random_sample(d, [100, 20])
+    self.assertEqual((100, 20), sample.shape)
+    self.assertEqual(0, sample.min())
+    self.assertLess(sample.max(), 10)
+
   def testReverseGeneratorNlpLike(self):
     counter = 0
     for d in algorithmic.reverse_generator_nlplike(3, 8, 10):
@@ -79,6 +89,48 @@ class AlgorithmicTest(tf.test.TestCase):
     self.assertEqual(algorithmic.number_to_lower_endian(6, 2), [0, 1, 1])
     self.assertEqual(algorithmic.number_to_lower_endian(2137, 10), [7, 3, 1, 2])
 
+  def testNumbersToLowerEndian(self):
+    numbers = [0, 1, 2, 6, 2137, 2**62]
+    for base in [2, 7, 10]:
+      digits = algorithmic.numbers_to_lower_endian(numbers, base)
+      for n, row in zip(numbers, digits):
+        self.assertEqual(algorithmic.number_to_lower_endian(n, base),
+                         row[row >= 0].tolist())
+
+  def testAdditionAndMultiplicationBatches(self):
+    for problem, operation in [
+        (algorithmic.AlgorithmicAdditionDecimal40(), lambda a, b: a + b),
+        (algorithmic.AlgorithmicMultiplicationDecimal40(), lambda a, b: a * b)]:
+      counter = 0
+      for batch in problem.batch_generator(10, 40, 25, batch_size=10):
+        self.assertLessEqual(len(batch["inputs"]), 10)
+        for d in algorithmic.unbatch_cases([batch]):
+          counter += 1
+          separator = d["inputs"].index(10)
+          n1, n2 = [algorithmic.lower_endian_to_number(n, 10) for n in
+                    [d["inputs"][:separator], d["inputs"][separator + 1:]]]
+          self.assertEqual(algorithmic.number_to_lower_endian(
+              operation(n1, n2), 10), d["targets"])
+      self.assertEqual(counter, 25)
+
+  def testGenerateData(self):
+    problem = algorithmic.AlgorithmicReverseBinary40Test()
+    records = []
+    for num_workers in [1, 2]:
+      data_dir = os.path.join(self.get_temp_dir(), str(num_workers))
+      os.mkdir(data_dir)
+      np.random.seed(42)
+      problem.generate_data(data_dir, None, num_workers=num_workers)
+      filenames = (problem.training_filepaths(data_dir, 1, shuffled=True) +
+                   problem.dev_filepaths(data_dir, 1, shuffled=True))
+      # The maps of the protos may serialize in a different order in the
+      # worker processes, so the examples are compared parsed.
+      records.append([[tf.train.Example.FromString(record)
+                       for record in tf.python_io.tf_record_iterator(filename)]
+                      for filename in filenames])
+    self.assertEqual([1000, 100], [len(r) for r in records[0]])
+    self.assertEqual(records[0], records[1])
+
   def testAdditionGenerator(self):
     addition_problem = algorithmic.AlgorithmicAdditionBinary40()
     counter = 0
@@ -13,18 +13,28 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-"""TIMIT data generator."""
+"""TIMIT data generator.
+
+Utterances are NIST SPHERE (TIMIT) or RIFF WAV files, whose headers are parsed
+here and whose samples are read with np.frombuffer. They are processed by a
+pool of processes, which can also compute their spectral features for
+AudioSpectralModality and cache them.
+"""
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import hashlib
+import io
+import multiprocessing as mp
 import os
-from subprocess import call
 import tarfile
 import wave
 
 # Dependency imports
 
+import numpy as np
+
 from DLT2T.data_generators import generator_utils
 
 import tensorflow as tf
@@ -77,16 +87,120 @@ def _collect_data(directory, input_ext, target_ext):
   return data_files
 
 
+_SPHERE_MAGIC = b"NIST_1A"
+
+
+def _sample_dtype(sample_width, big_endian=False):
+  """The numpy dtype of signed PCM samples of sample_width bytes."""
+  if sample_width not in (1, 2, 4):
+    raise ValueError("Unsupported sample width %d." % sample_width)
+  return np.dtype("%si%d" % (">" if big_endian else "<", sample_width))
+
+
+def _read_sphere(data):
+  """Reads the samples of a NIST SPHERE file.
+
+  Args:
+    data: the bytes of the file.
+
+  Returns:
+    samples: int array [sample_count * channel_count] of interleaved samples.
+    sample_width: bytes per sample.
+    num_channels: number of channels.
+    sample_rate: samples per second.
+
+  Raises:
+    ValueError: if the samples are not uncompressed PCM.
+  """
+  header_size = int(data[8:16].strip())
+  fields = {}
+  for line in data[16:header_size].decode("ascii").splitlines():
+    parts = line.split(None, 2)
+    if parts and parts[0] == "end_head":
+      break
+    if len(parts) == 3:
+      fields[parts[0]] = int(parts[2]) if parts[1] == "-i" else parts[2]
+  coding = fields.get("sample_coding", "pcm")
+  if coding != "pcm":
+    raise ValueError("Unsupported SPHERE sample coding %s." % coding)
+  sample_width = fields.get("sample_n_bytes", 2)
+  num_channels = fields.get("channel_count", 1)
+  count = fields.get("sample_count", (len(data) - header_size) //
+                     (sample_width * num_channels)) * num_channels
+  dtype = _sample_dtype(sample_width,
+                        fields.get("sample_byte_format") == "10")
+  samples = np.frombuffer(data, dtype=dtype, count=count, offset=header_size)
+  return (samples, sample_width, num_channels,
+          fields.get("sample_rate", 16000))
+
+
+def _read_wav(data):
+  """Reads the samples of a RIFF WAV file, see _read_sphere."""
+  wav_file = wave.open(io.BytesIO(data))
+  sample_width = wav_file.getsampwidth()
+  frames = wav_file.readframes(wav_file.getnframes())
+  if sample_width == 1:
+    # 8-bit WAV samples are unsigned.
+    samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.int16) -
+               128).astype(np.int8)
+  else:
+    samples = np.frombuffer(frames, dtype=_sample_dtype(sample_width))
+  return (samples, sample_width, wav_file.getnchannels(),
+          wav_file.getframerate())
+
+
 def _get_audio_data(filepath):
-  # Construct a true .wav file.
-  out_filepath = filepath.strip(".WAV") + ".wav"
-  # Assumes sox is installed on system. Sox converts from NIST SPHERE to WAV.
-  call(["sox", filepath, out_filepath])
-  wav_file = wave.open(open(out_filepath))
-  frame_count = wav_file.getnframes()
-  byte_array = wav_file.readframes(frame_count)
-  data = [int(b.encode("hex"), base=16) for b in byte_array]
-  return data, frame_count, wav_file.getsampwidth(), wav_file.getnchannels()
+  """Reads the samples of a NIST SPHERE or WAV file.
+
+  Returns:
+    samples: int array [sample_count * channel_count] of interleaved samples.
+    sample_count: number of samples per channel.
+    sample_width: bytes per sample.
+    num_channels: number of channels.
+    sample_rate: samples per second.
+  """
+  with tf.gfile.Open(filepath, "rb") as f:
+    data = f.read()
+  if data.startswith(_SPHERE_MAGIC):
+    samples, sample_width, num_channels, sample_rate = _read_sphere(data)
+  else:
+    samples, sample_width, num_channels, sample_rate = _read_wav(data)
+  return (samples, len(samples) // num_channels, sample_width, num_channels,
+          sample_rate)
+
+
+def spectral_features(samples, sample_width, num_channels, sample_rate,
+                      frame_secs=0.025, step_secs=0.01):
+  """Log power spectrogram of audio, the inputs of AudioSpectralModality.
+
+  Channels are averaged, and Hann-windowed frames of frame_secs, every
+  step_secs, are transformed with an FFT of the next power of 2.
+
+  Args:
+    samples: int array of interleaved samples.
+    sample_width: bytes per sample.
+    num_channels: number of channels.
+    sample_rate: samples per second.
+    frame_secs: length of a frame.
+    step_secs: step between frames.
+
+  Returns:
+    float32 array [num_frames, num_bins].
+  """
+  audio = samples.reshape([-1, num_channels]).mean(axis=1)
+  audio /= 2.0**(8 * sample_width - 1)
+  frame_length = int(round(frame_secs * sample_rate))
+  frame_step = int(round(step_secs * sample_rate))
+  fft_length = 1 << (frame_length - 1).bit_length()
+  num_frames = 1 + max(len(audio) - frame_length, 0) // frame_step
+  audio = np.pad(audio, [0, max(
+      (num_frames - 1) * frame_step + frame_length - len(audio), 0)],
+                 "constant")
+  indices = (np.arange(num_frames)[:, None] * frame_step +
+             np.arange(frame_length)[None, :])
+  frames = audio[indices] * np.hanning(frame_length)
+  power = np.abs(np.fft.rfft(frames, fft_length)) ** 2
+  return np.log(power + 1e-6).astype(np.float32)
 
 
 def _get_text_data(filepath):
@@ -98,6 +212,45 @@ def _get_text_data(filepath):
     return " ".join(words)
 
 
+def _process_utterance(args):
+  """Reads an utterance, in a timit_generator worker.
+
+  Args:
+    args: tuple of the audio and transcription paths, whether to compute the
+      spectral features and their cache directory or None.
+
+  Returns:
+    dict of the example features, but the targets, and the transcription.
+  """
+  input_file, target_file, spectral, cache_dir = args
+  samples, sample_count, sample_width, num_channels, sample_rate = (
+      _get_audio_data(input_file))
+  example = {
+      "audio/channel_count": [num_channels],
+      "audio/sample_count": [sample_count],
+      "audio/sample_width": [sample_width],
+  }
+  if spectral:
+    cache_file = None
+    if cache_dir:
+      key = hashlib.md5(os.path.abspath(input_file).encode("utf-8"))
+      cache_file = os.path.join(cache_dir, key.hexdigest() + ".npy")
+    if cache_file and os.path.exists(cache_file):
+      features = np.load(cache_file)
+    else:
+      features = spectral_features(samples, sample_width, num_channels,
+                                   sample_rate)
+      if cache_file:
+        np.save(cache_file, features)
+    # AudioSpectralModality bitcasts its int32 inputs back to float32.
+    example["inputs"] = features.view(np.int32).ravel().tolist()
+    example["audio/frame_count"] = [features.shape[0]]
+    example["audio/bin_count"] = [features.shape[1]]
+  else:
+    example["inputs"] = samples.tolist()
+  return example, _get_text_data(target_file)
+
+
 def timit_generator(data_dir,
                     tmp_dir,
                     training,
@@ -105,7 +258,10 @@ def timit_generator(data_dir,
                     start_from=0,
                     eos_list=None,
                     vocab_filename=None,
-                    vocab_size=0):
+                    vocab_size=0,
+                    num_workers=1,
+                    spectral=False,
+                    feature_cache_dir=None):
   """Data generator for TIMIT transcription problem.
 
   Args:
@@ -119,13 +275,21 @@ def timit_generator(data_dir,
     vocab_filename: file within `tmp_dir` to read vocabulary from. If this is
       not provided then the target sentence will be encoded by character.
     vocab_size: integer target to generate vocabulary size to.
+    num_workers: number of processes reading the utterances.
+    spectral: whether the inputs are the spectral features of the audio
+      instead of its samples.
+    feature_cache_dir: optional directory where spectral features are cached
+      and read back from.
 
   Yields:
     A dictionary representing the images with the following fields:
-    * inputs: a float sequence containing the audio data
+    * inputs: an integer sequence containing the audio samples, interleaved,
+      or the float32 spectral features [frame_count, bin_count] bitcast to
+      int32 and flattened
     * audio/channel_count: an integer
     * audio/sample_count: an integer
     * audio/sample_width: an integer
+    * audio/frame_count, audio/bin_count: integers, with spectral features
     * targets: an integer sequence representing the encoded sentence
   """
   eos_list = [1] if eos_list is None else eos_list
@@ -133,27 +297,32 @@ def timit_generator(data_dir,
     vocab_symbolizer = generator_utils.get_or_generate_vocab(
         data_dir, tmp_dir, vocab_filename, vocab_size)
   _get_timit(tmp_dir)
+  if feature_cache_dir:
+    tf.gfile.MakeDirs(feature_cache_dir)
   datasets = (_TIMIT_TRAIN_DATASETS if training else _TIMIT_TEST_DATASETS)
-  i = 0
+  utterances = []
   for data_dir, (audio_ext, transcription_ext) in datasets:
     data_dir = os.path.join(tmp_dir, data_dir)
     data_files = _collect_data(data_dir, audio_ext, transcription_ext)
     data_pairs = data_files.values()
-    for input_file, target_file in sorted(data_pairs)[start_from:]:
-      if i == how_many:
-        return
-      i += 1
-      audio_data, sample_count, sample_width, num_channels = _get_audio_data(
-          input_file)
-      text_data = _get_text_data(target_file)
+    utterances.extend(sorted(data_pairs)[start_from:])
+  utterances = [(input_file, target_file, spectral, feature_cache_dir)
+                for input_file, target_file in utterances[:how_many]]
+
+  pool = mp.Pool(num_workers) if num_workers > 1 else None
+  try:
+    if pool is None:
+      results = (_process_utterance(args) for args in utterances)
+    else:
+      results = pool.imap(_process_utterance, utterances, chunksize=16)
+    for example, text_data in results:
       if vocab_filename is None:
         label = [ord(c) for c in text_data] + eos_list
       else:
         label = vocab_symbolizer.encode(text_data) + eos_list
-      yield {
-          "inputs": audio_data,
-          "audio/channel_count": [num_channels],
-          "audio/sample_count": [sample_count],
-          "audio/sample_width": [sample_width],
-          "targets": label
-      }
+      example["targets"] = label
+      yield example
+  finally:
+    if pool is not None:
+      pool.terminate()
+      pool.join()
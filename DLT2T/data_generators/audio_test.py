@@ -21,10 +21,16 @@ from __future__ import print_function
 
 import io
 import os
+import wave
 
 # Dependency imports
 
+import numpy as np
+
 from DLT2T.data_generators import audio
+from DLT2T.data_generators import generator_utils
+from DLT2T.data_generators import problem
+from DLT2T.data_generators import problem_hparams
 
 import tensorflow as tf
 
@@ -58,6 +64,96 @@ class AudioTest(tf.test.TestCase):
       os.remove(os.path.join(tmp_dir, "%s.WAV" % filename))
       os.remove(os.path.join(tmp_dir, "%s.WRD" % filename))
 
+  def _write_sphere(self, filename, samples, byte_format="01"):
+    header = ("NIST_1A\n   1024\n"
+              "sample_count -i %d\n"
+              "sample_n_bytes -i 2\n"
+              "channel_count -i 1\n"
+              "sample_byte_format -s2 %s\n"
+              "sample_rate -i 16000\n"
+              "end_head\n" % (len(samples), byte_format)).encode("ascii")
+    dtype = "<i2" if byte_format == "01" else ">i2"
+    with io.open(filename, "wb") as f:
+      f.write(header + b" " * (1024 - len(header)))
+      f.write(np.array(samples, dtype=dtype).tobytes())
+
+  def testGetAudioData(self):
+    samples = [0, 1, -1, 300, -32768, 32767]
+    tmp_dir = self.get_temp_dir()
+    for byte_format in ["01", "10"]:
+      filename = os.path.join(tmp_dir, "sphere_%s.WAV" % byte_format)
+      self._write_sphere(filename, samples, byte_format)
+      data, sample_count, sample_width, num_channels, sample_rate = (
+          audio._get_audio_data(filename))
+      self.assertEqual(samples, data.tolist())
+      self.assertEqual((6, 2, 1, 16000),
+                       (sample_count, sample_width, num_channels, sample_rate))
+
+    filename = os.path.join(tmp_dir, "stereo.wav")
+    wav_file = wave.open(filename, "wb")
+    wav_file.setnchannels(2)
+    wav_file.setsampwidth(2)
+    wav_file.setframerate(8000)
+    wav_file.writeframes(np.array(samples, dtype="<i2").tobytes())
+    wav_file.close()
+    data, sample_count, sample_width, num_channels, sample_rate = (
+        audio._get_audio_data(filename))
+    self.assertEqual(samples, data.tolist())
+    self.assertEqual((3, 2, 2, 8000),
+                     (sample_count, sample_width, num_channels, sample_rate))
+
+  def testTimitGeneratorSpectralFeatures(self):
+    tmp_dir = os.path.join(self.get_temp_dir(), "timit_spectral")
+    data_dir = os.path.join(tmp_dir, "timit/TIMIT/TRAIN/DR1/SPK1")
+    os.makedirs(data_dir)
+    for i in range(3):
+      basename = os.path.join(data_dir, "SX%d" % i)
+      self._write_sphere(basename + ".WAV",
+                         np.random.randint(-1000, 1000, size=800 * (i + 1)))
+      with io.open(basename + ".WRD", "w") as f:
+        f.write(u"0 100 she\n100 200 had\n")
+    cache_dir = os.path.join(tmp_dir, "cache")
+
+    for _ in range(2):  # Compute, then read the cached features.
+      examples = list(audio.timit_generator(
+          tmp_dir, tmp_dir, True, 2, start_from=1, num_workers=2,
+          spectral=True, feature_cache_dir=cache_dir))
+      self.assertEqual(2, len(examples))
+      self.assertEqual(2, len(os.listdir(cache_dir)))
+      # 100ms and 150ms of audio, in 25ms frames every 10ms.
+      self.assertEqual([[8], [13]],
+                       [example["audio/frame_count"] for example in examples])
+      self.assertEqual([257], examples[0]["audio/bin_count"])
+      self.assertEqual(13 * 257, len(examples[1]["inputs"]))
+      self.assertEqual([ord(c) for c in "she had"] + [1],
+                       examples[0]["targets"])
+
+  def testSpectralFeaturesRoundTrip(self):
+    tmp_dir = os.path.join(self.get_temp_dir(), "timit_round_trip")
+    data_dir = os.path.join(tmp_dir, "timit/TIMIT/TRAIN/DR1/SPK1")
+    os.makedirs(data_dir)
+    samples = np.random.randint(-1000, 1000, size=2400)
+    self._write_sphere(os.path.join(data_dir, "SX0.WAV"), samples)
+    with io.open(os.path.join(data_dir, "SX0.WRD"), "w") as f:
+      f.write(u"0 100 she\n")
+    example, = audio.timit_generator(tmp_dir, tmp_dir, True, 1, spectral=True)
+
+    timit_problem = problem_hparams.AudioTimitCharactersSpectralTune()
+    data_fields, _ = timit_problem.example_reading_spec()
+    features = tf.parse_single_example(
+        generator_utils.to_example(example).SerializeToString(), data_fields)
+    features = {
+        name: (tf.sparse_tensor_to_dense(feature)
+               if isinstance(feature, tf.SparseTensor) else feature)
+        for name, feature in features.items()}
+    features = timit_problem.preprocess_example(
+        features, tf.estimator.ModeKeys.TRAIN, problem.default_model_hparams())
+    with self.test_session() as session:
+      inputs = session.run(tf.bitcast(features["inputs"], tf.float32))
+    self.assertAllEqual(
+        audio.spectral_features(samples, 2, 1, 16000)[:, :, np.newaxis],
+        inputs)
+
 
 if __name__ == "__main__":
   tf.test.main()
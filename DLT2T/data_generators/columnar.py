@@ -0,0 +1,281 @@
+# coding=utf-8
+# Copyright 2017 The DLT2T Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Columnar shards of variable-length examples.
+
+A columnar shard stores every feature of its examples as one array of the
+concatenated values of the examples, int32 or float32, and one int64 array of
+offsets: the values of example i are values[offsets[i]:offsets[i + 1]]. The
+shard starts with a magic string, the length of a JSON header and the header,
+which records the number of examples and where the arrays of every feature
+are. Arrays are aligned to _ALIGNMENT bytes.
+
+Shards are memory-mapped, so they must be on a local file system, and
+columnar_dataset reads blocks of examples as dense padded arrays, without
+parsing any tf.Example proto. The columnar shards of TFRecord files live in a
+"columnar" subdirectory under the same names, see columnar_path.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+import random
+import struct
+
+# Dependency imports
+
+import numpy as np
+import six
+from six.moves import xrange  # pylint: disable=redefined-builtin
+
+import tensorflow as tf
+
+_MAGIC = b"DLT2TCOL"
+_ALIGNMENT = 64
+_COLUMNAR_DIR = "columnar"
+
+
+def columnar_path(path):
+  """The columnar counterpart of a TFRecord file path or filepattern."""
+  return os.path.join(os.path.dirname(path), _COLUMNAR_DIR,
+                      os.path.basename(path))
+
+
+class ColumnarWriter(object):
+  """Writes examples, dicts of feature name to list of ints or floats."""
+
+  def __init__(self, filename):
+    self._filename = filename
+    self._values = {}
+    self._lengths = {}
+    self._num_examples = 0
+
+  def write(self, example):
+    if not self._values:
+      for feature in example:
+        self._values[feature] = []
+        self._lengths[feature] = []
+    elif set(example) != set(self._values):
+      raise ValueError("Example features %s differ from %s." %
+                       (sorted(example), sorted(self._values)))
+    for feature, values in six.iteritems(example):
+      self._values[feature].extend(values)
+      self._lengths[feature].append(len(values))
+    self._num_examples += 1
+
+  def close(self):
+    """Writes the shard."""
+    fields = {}
+    arrays = []
+    position = 0
+    for feature in sorted(self._values):
+      values = self._values[feature]
+      is_float = any(isinstance(v, float) for v in values)
+      values = np.array(values, dtype=np.float32 if is_float else np.int32)
+      offsets = np.zeros(self._num_examples + 1, dtype=np.int64)
+      np.cumsum(self._lengths[feature], out=offsets[1:])
+      fields[feature] = {"dtype": values.dtype.name}
+      for name, array in [("values", values), ("offsets", offsets)]:
+        fields[feature][name] = [position, len(array)]
+        arrays.append(array)
+        position += _aligned(array.nbytes)
+
+    header = json.dumps({"num_examples": self._num_examples,
+                         "fields": fields}).encode("utf-8")
+    data_start = _aligned(len(_MAGIC) + 8 + len(header))
+    with tf.gfile.Open(self._filename, "wb") as f:
+      f.write(_MAGIC)
+      f.write(struct.pack("<Q", len(header)))
+      f.write(header)
+      f.write(b"\0" * (data_start - len(_MAGIC) - 8 - len(header)))
+      for array in arrays:
+        f.write(array.tobytes())
+        f.write(b"\0" * (_aligned(array.nbytes) - array.nbytes))
+
+
+class ColumnarShard(object):
+  """A memory-mapped columnar shard."""
+
+  def __init__(self, filename):
+    with open(filename, "rb") as f:
+      if f.read(len(_MAGIC)) != _MAGIC:
+        raise ValueError("%s is not a columnar shard." % filename)
+      header_length, = struct.unpack("<Q", f.read(8))
+      header = json.loads(f.read(header_length).decode("utf-8"))
+    data_start = _aligned(len(_MAGIC) + 8 + header_length)
+    self.num_examples = header["num_examples"]
+    self._fields = header["fields"]
+    buf = np.memmap(filename, dtype=np.uint8, mode="r")
+    self._arrays = {}
+    for feature, field in six.iteritems(self._fields):
+      for name, dtype in [("values", field["dtype"]), ("offsets", "int64")]:
+        position, size = field[name]
+        self._arrays[feature, name] = np.frombuffer(
+            buf, dtype=dtype, count=size, offset=data_start + position)
+
+  @property
+  def features(self):
+    return sorted(self._fields)
+
+  def ragged(self, feature):
+    """Returns the values and offsets arrays of feature."""
+    return self._arrays[feature, "values"], self._arrays[feature, "offsets"]
+
+  def padded_block(self, feature, start, end):
+    """Returns examples [start, end) of feature, padded with 0s.
+
+    Returns:
+      values: array [end - start, max length], the padded values.
+      lengths: int32 array [end - start], the lengths of the examples.
+    """
+    values, offsets = self.ragged(feature)
+    block_offsets = offsets[start:end + 1]
+    lengths = np.diff(block_offsets).astype(np.int32)
+    length = lengths.max() if len(lengths) else 0
+    positions = np.arange(length)
+    mask = positions < lengths[:, None]
+    block = np.zeros([len(lengths), length], dtype=values.dtype)
+    block[mask] = values[(block_offsets[:-1, None] + positions)[mask]]
+    return block, lengths
+
+
+def write_columnar_shards(tfrecord_filenames):
+  """Writes the columnar shard of every TFRecord file, see columnar_path."""
+  for filename in tfrecord_filenames:
+    out_filename = columnar_path(filename)
+    tf.gfile.MakeDirs(os.path.dirname(out_filename))
+    writer = ColumnarWriter(out_filename)
+    for record in tf.python_io.tf_record_iterator(filename):
+      example = tf.train.Example.FromString(record)
+      features = {}
+      for feature, value in six.iteritems(example.features.feature):
+        if value.HasField("int64_list"):
+          features[feature] = list(value.int64_list.value)
+        elif value.HasField("float_list"):
+          features[feature] = [float(v) for v in value.float_list.value]
+        else:
+          raise ValueError("Feature %s of %s is neither int64 nor float." %
+                           (feature, filename))
+      writer.write(features)
+    writer.close()
+    tf.logging.info("Wrote columnar shard %s." % out_filename)
+
+
+def columnar_dataset(data_files, data_fields, block_size=1024,
+                     filepattern_fn=None):
+  """A Dataset of the examples of columnar shards.
+
+  Blocks of block_size examples are read as padded arrays, and sliced back
+  into examples of dense int32 or float32 Tensors.
+
+  Args:
+    data_files: list of columnar shard paths, read in order.
+    data_fields: dict of feature name to tf.VarLenFeature, as returned by
+      Problem.example_reading_spec. int64 features are read as int32.
+    block_size: number of examples read at a time.
+    filepattern_fn: optional function returning the current filepattern of the
+      TFRecord files. If given, data_files is ignored and the Dataset is
+      endless: shards are read one at a time in shuffled passes, and a new pass
+      over the columnar shards of the filepattern starts as soon as it changes,
+      like problem._reloading_record_dataset.
+
+  Returns:
+    Dataset of dict<feature name, Tensor>.
+  """
+  features = sorted(data_fields)
+  dtypes = []
+  for feature in features:
+    if not isinstance(data_fields[feature], tf.VarLenFeature):
+      raise ValueError("Columnar shards only hold VarLenFeatures, %s is %s." %
+                       (feature, data_fields[feature]))
+    dtypes.append(tf.float32 if data_fields[feature].dtype == tf.float32
+                  else tf.int32)
+  shards = {}
+
+  def get_shard(filename):
+    if filename not in shards:
+      shards[filename] = ColumnarShard(filename)
+    return shards[filename]
+
+  def read_block(filename, start):
+    shard = get_shard(tf.compat.as_str(filename))
+    end = min(start + block_size, shard.num_examples)
+    block = []
+    for feature, dtype in zip(features, dtypes):
+      values, lengths = shard.padded_block(feature, start, end)
+      block.extend([values.astype(dtype.as_numpy_dtype), lengths])
+    return block
+
+  def next_block():
+    filepattern = filepattern_fn()
+    if filepattern != state["filepattern"] or not state["blocks"]:
+      if filepattern != state["filepattern"]:
+        tf.logging.info("Reading columnar shards of %s", filepattern)
+      filenames = tf.gfile.Glob(columnar_path(filepattern))
+      random.shuffle(filenames)
+      shards.clear()
+      state["filepattern"] = filepattern
+      state["blocks"] = _blocks(filenames, block_size, get_shard)[::-1]
+    filename, start = state["blocks"].pop()
+    return [tf.compat.as_bytes(filename), np.int64(start)]
+
+  if filepattern_fn is None:
+    blocks = _blocks(data_files, block_size, get_shard)
+    dataset = tf.contrib.data.Dataset.from_tensor_slices((
+        tf.constant([filename for filename, _ in blocks], dtype=tf.string),
+        tf.constant([start for _, start in blocks], dtype=tf.int64)))
+  else:
+    state = {"filepattern": None, "blocks": []}
+    dataset = tf.contrib.data.Dataset.from_tensors(tf.constant(0)).repeat()
+    dataset = dataset.map(
+        lambda _: tuple(tf.py_func(next_block, [], [tf.string, tf.int64])))
+
+  def block_to_examples(filename, start):
+    tensors = tf.py_func(read_block, [filename, start],
+                         [t for dtype in dtypes for t in (dtype, tf.int32)])
+    for i in xrange(len(features)):
+      tensors[2 * i].set_shape([None, None])
+      tensors[2 * i + 1].set_shape([None])
+    return tf.contrib.data.Dataset.from_tensor_slices(tuple(tensors))
+
+  def trim_example(*tensors):
+    return {feature: tensors[2 * i][:tensors[2 * i + 1]]
+            for i, feature in enumerate(features)}
+
+  return dataset.flat_map(block_to_examples).map(trim_example)
+
+
+def _blocks(filenames, block_size, get_shard):
+  """The (filename, start) blocks of the shards, in order."""
+  return [(filename, start)
+          for filename in filenames
+          for start in xrange(0, get_shard(filename).num_examples,
+                              block_size)]
+
+
+def _aligned(num_bytes):
+  return -(-num_bytes // _ALIGNMENT) * _ALIGNMENT
+
+
+def read_columnar_examples(filename):
+  """Yields the examples of a columnar shard as dicts of lists."""
+  shard = ColumnarShard(filename)
+  ragged = {feature: shard.ragged(feature) for feature in shard.features}
+  for i in xrange(shard.num_examples):
+    yield {feature: values[offsets[i]:offsets[i + 1]].tolist()
+           for feature, (values, offsets) in six.iteritems(ragged)}
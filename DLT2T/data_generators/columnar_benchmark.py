@@ -0,0 +1,136 @@
+# coding=utf-8
+# Copyright 2017 The DLT2T Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+r"""Benchmark for reading dual learning data from columnar shards.
+
+Compares the examples/sec of DuallearningEnde.dataset reading the training
+TFRecords, parsed as tf.Examples, with reading their columnar shards
+(--dual_columnar_data). Examples are read in padded batches, as training
+does, without preprocessing.
+
+Example usage:
+
+python data_generators/columnar_benchmark.py \
+    --data_dir=$DATA_DIR --logtostderr
+
+The data_dir must hold the TFRecords, their columnar shards and the
+vocabulary. By default, random examples are generated in a temporary
+directory.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import os
+import tempfile
+import timeit
+
+# Dependency imports
+
+import numpy as np
+from six.moves import xrange  # pylint: disable=redefined-builtin
+from DLT2T.data_generators import columnar
+from DLT2T.data_generators import dual_learning
+from DLT2T.data_generators import generator_utils
+from DLT2T.data_generators import text_encoder
+
+import tensorflow as tf
+
+tf.flags.DEFINE_string('data_dir', '',
+                       'Directory of the data. If empty, random examples are '
+                       'generated in a temporary directory.')
+tf.flags.DEFINE_integer('num_examples', 20000,
+                        'Number of random examples to generate, if no '
+                        '--data_dir.')
+tf.flags.DEFINE_integer('max_length', 64,
+                        'Maximum length of the random sentences.')
+tf.flags.DEFINE_integer('num_batches', 100, 'Number of batches to read.')
+tf.flags.DEFINE_integer('benchmark_batch_size', 64,
+                        'Number of examples of a batch.')
+tf.flags.DEFINE_integer('num_threads', 4, 'Threads of the Dataset.map calls.')
+tf.flags.DEFINE_integer('num_repeats', 3,
+                        'Timings are the best of this many runs.')
+FLAGS = tf.flags.FLAGS
+
+
+def generate_random_data(data_dir, problem):
+  """Writes random dual learning examples and their columnar shards."""
+  rng = np.random.RandomState(0)
+  vocab_size = 1000
+  token_counts = collections.Counter(
+      {'w%d' % i: vocab_size - i for i in xrange(vocab_size)})
+  vocab = text_encoder.SubwordTextEncoder()
+  vocab.build_from_token_counts(token_counts, 1)
+  vocab.store_to_file(os.path.join(data_dir, problem.vocab_file))
+
+  def random_examples():
+    for _ in xrange(FLAGS.num_examples):
+      example = {
+          field: rng.randint(2, vocab.vocab_size,
+                             size=rng.randint(1, FLAGS.max_length)).tolist()
+          for field in ['A', 'B', 'A_m', 'B_m', 'A_hat', 'B_hat']
+      }
+      example['A_score'] = [float(rng.uniform(0, 10))]
+      example['B_score'] = [float(rng.uniform(0, 10))]
+      yield example
+
+  train_paths = problem.training_filepaths(data_dir, 10, shuffled=True)
+  generator_utils.generate_files(random_examples(), train_paths)
+  columnar.write_columnar_shards(train_paths)
+
+
+def read_batches(problem, data_dir, columnar_data):
+  """Returns a function reading FLAGS.num_batches batches of examples."""
+  FLAGS.dual_columnar_data = columnar_data
+  graph = tf.Graph()
+  with graph.as_default():
+    dataset = problem.dataset(tf.estimator.ModeKeys.TRAIN, data_dir,
+                              num_threads=FLAGS.num_threads,
+                              shuffle_files=False, preprocess=False)
+    dataset = dataset.repeat().padded_batch(
+        FLAGS.benchmark_batch_size,
+        {field: [None] for field in dataset.output_shapes})
+    batch = dataset.make_one_shot_iterator().get_next()
+  sess = tf.Session(graph=graph)
+
+  def read():
+    for _ in xrange(FLAGS.num_batches):
+      sess.run(batch)
+
+  return read
+
+
+def main(unused_argv):
+  problem = dual_learning.DuallearningEnde()
+  data_dir = FLAGS.data_dir
+  if not data_dir:
+    data_dir = tempfile.mkdtemp()
+    generate_random_data(data_dir, problem)
+
+  num_examples = FLAGS.num_batches * FLAGS.benchmark_batch_size
+  examples_per_sec = {}
+  for name, columnar_data in [('tfrecord', False), ('columnar', True)]:
+    read = read_batches(problem, data_dir, columnar_data)
+    read()  # Warm up.
+    secs = min(timeit.repeat(read, number=1, repeat=FLAGS.num_repeats))
+    examples_per_sec[name] = num_examples / secs
+    tf.logging.info('%s: %.0f examples/sec.', name, examples_per_sec[name])
+  tf.logging.info('columnar speedup: %.2fx',
+                  examples_per_sec['columnar'] / examples_per_sec['tfrecord'])
+
+
+if __name__ == '__main__':
+  tf.app.run()
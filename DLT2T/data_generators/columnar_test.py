@@ -0,0 +1,121 @@
+# coding=utf-8
+# Copyright 2017 The DLT2T Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Columnar shards test."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import tempfile
+
+# Dependency imports
+
+from DLT2T.data_generators import columnar
+from DLT2T.data_generators import generator_utils
+from DLT2T.data_generators import problem
+from DLT2T.utils import registry
+
+import tensorflow as tf
+
+
+_EXAMPLES = [
+    {"A": [4, 5, 1], "B": [6, 1], "A_score": [-1.5]},
+    {"A": [1], "B": [7, 8, 9, 10, 1], "A_score": [-0.25]},
+    {"A": [3], "B": [2, 1], "A_score": [2.0]},
+]
+
+
+class ColumnarProblem(problem.Problem):
+  """Reads inputs and targets from columnar shards."""
+
+  def dataset_filename(self):
+    return "columnar_problem"
+
+  def columnar_data_files(self):
+    return True
+
+  def hparams(self, defaults, unused_model_hparams):
+    defaults.input_modality = {"inputs": (registry.Modalities.SYMBOL, 16)}
+    defaults.target_modality = (registry.Modalities.SYMBOL, 16)
+
+
+class ColumnarTest(tf.test.TestCase):
+
+  def _write_shard(self):
+    filename = os.path.join(self.get_temp_dir(), "shard")
+    writer = columnar.ColumnarWriter(filename)
+    for example in _EXAMPLES:
+      writer.write(example)
+    writer.close()
+    return filename
+
+  def testWriteAndRead(self):
+    shard_filename = self._write_shard()
+    self.assertEqual(_EXAMPLES,
+                     list(columnar.read_columnar_examples(shard_filename)))
+
+  def testPaddedBlock(self):
+    shard = columnar.ColumnarShard(self._write_shard())
+    self.assertEqual(3, shard.num_examples)
+    self.assertEqual(["A", "A_score", "B"], shard.features)
+    values, lengths = shard.padded_block("B", 1, 3)
+    self.assertAllEqual([[7, 8, 9, 10, 1], [2, 1, 0, 0, 0]], values)
+    self.assertAllEqual([5, 2], lengths)
+
+  def testColumnarPath(self):
+    self.assertEqual("/data/columnar/dual-train*",
+                     columnar.columnar_path("/data/dual-train*"))
+
+  def testColumnarDatasetMatchesTFRecords(self):
+    tfrecord_filename = os.path.join(self.get_temp_dir(), "dual-train-00000")
+    generator_utils.generate_files(iter(_EXAMPLES), [tfrecord_filename])
+    columnar.write_columnar_shards([tfrecord_filename])
+
+    data_fields = {"A": tf.VarLenFeature(tf.int64),
+                   "B": tf.VarLenFeature(tf.int64),
+                   "A_score": tf.VarLenFeature(tf.float32)}
+    dataset = columnar.columnar_dataset(
+        [columnar.columnar_path(tfrecord_filename)], data_fields,
+        block_size=2)
+    example = dataset.make_one_shot_iterator().get_next()
+    with self.test_session() as session:
+      for expected in _EXAMPLES:
+        features = session.run(example)
+        self.assertEqual(tf.int32, example["A"].dtype)
+        for feature, values in expected.items():
+          self.assertAllClose(values, features[feature])
+      with self.assertRaises(tf.errors.OutOfRangeError):
+        session.run(example)
+
+  def testProblemDatasetCopiesColumnarFeatures(self):
+    data_dir = tempfile.mkdtemp(dir=self.get_temp_dir())
+    copy_problem = ColumnarProblem(was_copy=True)
+    filenames = copy_problem.training_filepaths(data_dir, 1, shuffled=True)
+    generator_utils.generate_files(
+        iter([{"inputs": [3, 4, 1], "targets": [5, 1]}]), filenames)
+    columnar.write_columnar_shards(filenames)
+    example = copy_problem.dataset(
+        tf.estimator.ModeKeys.TRAIN, data_dir).make_one_shot_iterator(
+        ).get_next()
+    with self.test_session() as session:
+      features = session.run(example)
+    self.assertAllEqual([3, 4, 1], features["inputs"])
+    self.assertAllEqual([3, 4, 1], features["targets"])
+
+
+if __name__ == "__main__":
+  tf.test.main()
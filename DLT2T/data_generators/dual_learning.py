@@ -19,11 +19,16 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
 import os
+import re
 import tarfile
 
 # Dependency imports
 
+from six.moves import xrange  # pylint: disable=redefined-builtin
+
+from DLT2T.data_generators import columnar
 from DLT2T.data_generators import generator_utils
 from DLT2T.data_generators import problem
 from DLT2T.data_generators import text_encoder
@@ -34,7 +39,50 @@ import tensorflow as tf
 # End-of-sentence marker.
 EOS = text_encoder.EOS_ID
 
-FLAGS = tf.flags.FLAGS
+flags = tf.flags
+FLAGS = flags.FLAGS
+
+flags.DEFINE_integer("dual_datagen_workers", 0,
+                     "If > 1, encode the dual-learning corpora with this many "
+                     "processes.")
+flags.DEFINE_integer("dual_shuffle_memory_mb", 1024,
+                     "Approximate memory, in MB, used to shuffle the generated "
+                     "examples; larger datasets are shuffled through "
+                     "temporary bucket files.")
+flags.DEFINE_bool("dual_shuffle_across_shards", False,
+                  "If True, shuffle examples across shards, not only within "
+                  "each shard.")
+flags.DEFINE_bool("dual_reload_data_files", False,
+                  "If True, training switches to every new generation of "
+                  "back-translated data written by dual-t2t-backtranslate "
+                  "without a restart.")
+flags.DEFINE_bool("dual_columnar_data", False,
+                  "If True, datagen also writes columnar shards of the "
+                  "data, which training reads instead of the TFRecords.")
+flags.DEFINE_bool("dual_mono_streams", False,
+                  "If True, the dual mode generates the parallel and each "
+                  "monolingual corpus once, into separate shards, and "
+                  "training reads them as separate streams.")
+flags.DEFINE_float("dual_mono_batch_ratio", 1.0,
+                   "With --dual_mono_streams, the size of the batches of "
+                   "each monolingual stream, relative to hparams.batch_size.")
+
+# Fields read with read_mono_sentence, i.e. rewound when exhausted.
+_REWOUND_FIELDS = frozenset(['A_m', 'B_m', 'A_hat', 'B_hat'])
+# Fields of the monolingual streams: a monolingual corpus and its
+# back-translation.
+_MONO_STREAM_FIELDS = collections.OrderedDict([
+    ('mono_A', ('A_m', 'B_hat')),
+    ('mono_B', ('B_m', 'A_hat')),
+])
+# Fields holding one float per line rather than text.
+_SCORE_FIELDS = frozenset(['A_score', 'B_score'])
+# Number of aligned lines per parallel encoding task.
+_ENCODE_CHUNK_LINES = 1000
+# Directory of data_dir holding the generations of back-translated data, and
+# the file in it naming the latest generation.
+_BACKTRANSLATION_DIR = "backtranslation"
+_LATEST_GENERATION_FILENAME = "latest"
 
 @registry.register_problem
 class DuallearningEnde(problem.Text2TextProblem):
@@ -68,47 +116,242 @@ class DuallearningEnde(problem.Text2TextProblem):
     return True
 
   def generate_data(self, data_dir, tmp_dir, train_mode, task_id=-1):
+    if FLAGS.dual_mono_streams and train_mode == "dual":
+      self.generate_stream_data(data_dir, tmp_dir)
+      return
     train_paths = self.training_filepaths(
         data_dir, self.num_shards, shuffled=False)
     dev_paths = self.dev_filepaths(
         data_dir, self.num_dev_shards, shuffled=False)
-    if self.use_train_shards_for_dev:
+    if FLAGS.dual_datagen_workers > 1:
+      self.parallel_generate_data(data_dir, tmp_dir, train_mode, train_paths,
+                                  dev_paths, FLAGS.dual_datagen_workers)
+    elif self.use_train_shards_for_dev:
       all_paths = train_paths + dev_paths
       generator_utils.generate_files(
           self.generator(data_dir, tmp_dir, True, train_mode), all_paths)
-      generator_utils.shuffle_dataset(all_paths)
+      self.shuffle_dataset(all_paths)
     else:
       generator_utils.generate_dataset_and_shuffle(
           self.generator(data_dir, tmp_dir, True, train_mode), train_paths,
-          self.generator(data_dir, tmp_dir, False, train_mode), dev_paths)
+          self.generator(data_dir, tmp_dir, False, train_mode), dev_paths,
+          memory_budget=FLAGS.dual_shuffle_memory_mb * 2**20,
+          across_shards=FLAGS.dual_shuffle_across_shards)
+    if self.columnar_data_files():
+      columnar.write_columnar_shards(
+          self.training_filepaths(data_dir, self.num_shards, shuffled=True) +
+          self.dev_filepaths(data_dir, self.num_dev_shards, shuffled=True))
+
+  def generate_stream_data(self, data_dir, tmp_dir):
+    """Generates the data of the dual mode as separate streams.
+
+    The parallel corpus and its scores are written once into the training
+    shards, and each monolingual corpus and its back-translation once into the
+    shards of its stream, see data_streams. Nothing is rewound.
+
+    Args:
+      data_dir: data directory, holding the corpora.
+      tmp_dir: temporary directory, for the vocabulary generation.
+    """
+    # Make sure the vocab file exists before the workers load it.
+    generator_utils.get_or_generate_vocab(
+        data_dir, tmp_dir, self.vocab_file, self.targeted_vocab_size)
+    vocab_filepath = os.path.join(data_dir, self.vocab_file)
+    stream_field_paths = dual_stream_field_paths(
+        **self.dataset_paths(data_dir, True))
+    for stream, field_paths in stream_field_paths.items():
+      self._generate_stream_files(
+          field_paths, vocab_filepath,
+          self.training_filepaths(data_dir, self.num_shards, shuffled=False,
+                                  stream=stream),
+          FLAGS.dual_datagen_workers)
+    self._generate_stream_files(
+        dual_field_paths(False, None, **self.dataset_paths(data_dir, False)),
+        vocab_filepath,
+        self.dev_filepaths(data_dir, self.num_dev_shards, shuffled=False),
+        FLAGS.dual_datagen_workers)
+
+  def _generate_stream_files(self, field_paths, vocab_filepath,
+                             output_filenames, num_workers):
+    """Encodes aligned files, without rewinding, into shuffled shards."""
+    if num_workers > 1:
+      parallel_generate_files(field_paths, vocab_filepath, output_filenames,
+                              num_workers, EOS, rewound_fields=frozenset())
+    else:
+      generator_utils.generate_files(
+          encoded_example_generator(
+              field_paths, text_encoder.SubwordTextEncoder(vocab_filepath),
+              EOS, rewound_fields=frozenset()), output_filenames)
+    self.shuffle_dataset(output_filenames)
+    if self.columnar_data_files():
+      columnar.write_columnar_shards(
+          [fname.replace(generator_utils.UNSHUFFLED_SUFFIX, "")
+           for fname in output_filenames])
+
+  def filepattern(self, data_dir, mode, stream=None):
+    """Training reads the latest generation of back-translated data if any.
+
+    With --dual_mono_streams, only the monolingual streams are
+    back-translated, and the parallel stream is always read from data_dir.
+    """
+    generation_dir = latest_generation_dir(data_dir)
+    if (mode == tf.estimator.ModeKeys.TRAIN and generation_dir and
+        (stream or not FLAGS.dual_mono_streams)):
+      data_dir = generation_dir
+    return super(DuallearningEnde, self).filepattern(data_dir, mode, stream)
+
+  def data_streams(self, mode, train_mode=None):
+    """Reads the features train_mode uses, as three streams if separate.
+
+    Pretraining and inference only read A and B. With --dual_mono_streams,
+    dual training zips batches of three streams: the parallel stream holds A,
+    B and their scores, and every monolingual stream a monolingual corpus and
+    its back-translation. The monolingual batches hold dual_mono_batch_ratio
+    times as many tokens as the parallel ones.
+    """
+    if (mode == tf.estimator.ModeKeys.PREDICT or
+        train_mode and train_mode.startswith("pretrain")):
+      return [(None, ['A', 'B'], 1)]
+    if not FLAGS.dual_mono_streams or mode != tf.estimator.ModeKeys.TRAIN:
+      return super(DuallearningEnde, self).data_streams(mode, train_mode)
+    streams = [(None, ['A', 'B', 'A_score', 'B_score'], 1)]
+    for stream, fields in _MONO_STREAM_FIELDS.items():
+      streams.append((stream, list(fields), FLAGS.dual_mono_batch_ratio))
+    return streams
+
+  def reload_data_files(self):
+    return FLAGS.dual_reload_data_files
+
+  def columnar_data_files(self):
+    return FLAGS.dual_columnar_data
+
+  def generate_backtranslated_data(self, data_dir, A_hat_path, B_hat_path,
+                                   num_shards, num_workers=1,
+                                   keep_generations=2):
+    """Writes a new generation of training data with new pseudo-sources.
+
+    The training data of the dual mode is generated again, with A_hat and
+    B_hat read from A_hat_path and B_hat_path instead of infer_ende.*, into a
+    new directory of data_dir/backtranslation. It then becomes the latest
+    generation, which filepattern returns for training. With
+    --dual_mono_streams, only the monolingual streams are generated again.
+
+    A and B are unchanged, so without score files the scores of the training
+    data read so far, once scored with dual-t2t-lm-score, are copied into the
+    new generation, see copy_scores.
+
+    Args:
+      data_dir: data directory, holding the corpora and the vocabulary.
+      A_hat_path: path of the translations of mono_ende.de into A.
+      B_hat_path: path of the translations of mono_ende.en into B.
+      num_shards: number of training shards of the generation.
+      num_workers: if > 1, encode the corpora with this many processes.
+      keep_generations: number of generations kept, the latest included.
+        Older ones are removed.
+
+    Returns:
+      the directory of the new generation.
+    """
+    generation_dir = os.path.join(
+        data_dir, _BACKTRANSLATION_DIR,
+        "generation-%05d" % (_generation_number(
+            latest_generation_dir(data_dir)) + 1))
+    tf.gfile.MakeDirs(generation_dir)
+    dataset_paths = self.dataset_paths(data_dir, True)
+    dataset_paths["A_hat_path"] = A_hat_path
+    dataset_paths["B_hat_path"] = B_hat_path
+    vocab_filepath = os.path.join(data_dir, self.vocab_file)
+    if FLAGS.dual_mono_streams:
+      stream_field_paths = dual_stream_field_paths(**dataset_paths)
+      for stream in _MONO_STREAM_FIELDS:
+        self._generate_stream_files(
+            stream_field_paths[stream], vocab_filepath,
+            self.training_filepaths(generation_dir, num_shards,
+                                    shuffled=False, stream=stream),
+            num_workers)
+    else:
+      previous_train_files = tf.gfile.Glob(
+          self.filepattern(data_dir, tf.estimator.ModeKeys.TRAIN))
+      train_paths = self.training_filepaths(
+          generation_dir, num_shards, shuffled=False)
+      if num_workers > 1:
+        parallel_generate_files(
+            dual_field_paths(True, "dual", **dataset_paths), vocab_filepath,
+            train_paths, num_workers, EOS)
+      else:
+        generator_utils.generate_files(
+            token_generator(
+                True, "dual",
+                token_vocab=text_encoder.SubwordTextEncoder(vocab_filepath),
+                eos=EOS, **dataset_paths), train_paths)
+      self.shuffle_dataset(train_paths)
+      shuffled_train_paths = self.training_filepaths(
+          generation_dir, num_shards, shuffled=True)
+      if (not all(tf.gfile.Exists(dataset_paths[field + '_path'])
+                  for field in _SCORE_FIELDS) and
+          not copy_scores(previous_train_files, shuffled_train_paths)):
+        tf.logging.warning('The training data are not scored, score %s with '
+                           'dual-t2t-lm-score.' % generation_dir)
+      if self.columnar_data_files():
+        columnar.write_columnar_shards(shuffled_train_paths)
+    _set_latest_generation_dir(data_dir, generation_dir)
+    tf.logging.info("Wrote back-translated data to %s." % generation_dir)
+    generations = sorted(
+        tf.gfile.Glob(os.path.join(data_dir, _BACKTRANSLATION_DIR,
+                                   "generation-*")),
+        key=_generation_number)
+    for old_generation_dir in generations[:-keep_generations]:
+      tf.gfile.DeleteRecursively(old_generation_dir)
+    return generation_dir
+
+  def shuffle_dataset(self, filenames):
+    generator_utils.shuffle_dataset(
+        filenames, memory_budget=FLAGS.dual_shuffle_memory_mb * 2**20,
+        across_shards=FLAGS.dual_shuffle_across_shards)
+
+  def parallel_generate_data(self, data_dir, tmp_dir, train_mode, train_paths,
+                             dev_paths, num_workers):
+    """Like generate_data, but encodes the corpora in num_workers processes."""
+    # Make sure the vocab file exists before the workers load it.
+    generator_utils.get_or_generate_vocab(
+        data_dir, tmp_dir, self.vocab_file, self.targeted_vocab_size)
+    vocab_filepath = os.path.join(data_dir, self.vocab_file)
+    train_field_paths = dual_field_paths(
+        True, train_mode, **self.dataset_paths(data_dir, True))
+    dev_field_paths = dual_field_paths(
+        False, None, **self.dataset_paths(data_dir, False))
+    if self.use_train_shards_for_dev:
+      parallel_generate_files(train_field_paths, vocab_filepath,
+                              train_paths + dev_paths, num_workers, EOS)
+    else:
+      parallel_generate_files(train_field_paths, vocab_filepath, train_paths,
+                              num_workers, EOS)
+      parallel_generate_files(dev_field_paths, vocab_filepath, dev_paths,
+                              num_workers, EOS)
+    if self.use_train_shards_for_dev:
+      self.shuffle_dataset(train_paths + dev_paths)
+    else:
+      self.shuffle_dataset(train_paths)
+      self.shuffle_dataset(dev_paths)
+
+  def dataset_paths(self, data_dir, train):
+    """Returns the token_generator path arguments for train or dev data."""
+    datasets = _DUAL_ENDE_TRAIN_DATASETS if train else _DUAL_ENDE_TEST_DATASETS
+    names = ['A_path', 'B_path', 'A_m_path', 'B_m_path', 'A_hat_path',
+             'B_hat_path', 'A_score_path', 'B_score_path']
+    return {name: os.path.join(data_dir, dataset)
+            for name, dataset in zip(names, datasets)}
 
   def generator(self, data_dir, tmp_dir, train, train_mode):
     symbolizer_vocab = generator_utils.get_or_generate_vocab(
         data_dir, tmp_dir, self.vocab_file, self.targeted_vocab_size)
     #symbolizer_vocab = text_encoder.SubwordTextEncoder(os.path.join(data_dir, self.vocab_file))
-    datasets = _DUAL_ENDE_TRAIN_DATASETS if train else _DUAL_ENDE_TEST_DATASETS
-    if train:
-      return token_generator(
-        train = train,
-        train_mode = train_mode,
-        A_path = os.path.join(data_dir,datasets[0]),
-        B_path = os.path.join(data_dir,datasets[1]),
-        A_m_path = os.path.join(data_dir,datasets[2]),
-        B_m_path = os.path.join(data_dir,datasets[3]),
-        A_hat_path = os.path.join(data_dir,datasets[4]),
-        B_hat_path = os.path.join(data_dir,datasets[5]),
-        A_score_path = os.path.join(data_dir,datasets[6]),
-        B_score_path = os.path.join(data_dir,datasets[7]),
-        token_vocab = symbolizer_vocab, 
-        eos = EOS)
-    else:
-      return token_generator(
-        train = train,
-        train_mode = None,
-        A_path = os.path.join(data_dir,datasets[0]),
-        B_path = os.path.join(data_dir,datasets[1]),
-        token_vocab = symbolizer_vocab,
-        eos=EOS)
+    return token_generator(
+      train = train,
+      train_mode = train_mode if train else None,
+      token_vocab = symbolizer_vocab,
+      eos = EOS,
+      **self.dataset_paths(data_dir, train))
 
   def preprocess_example(self, examples, mode, hparams):
     del mode
@@ -125,12 +368,10 @@ class DuallearningEnde(problem.Text2TextProblem):
     '''
     if max_seq_length > 0:
       print("######################## It is invoked!!", max_seq_length)
-      examples['A'] = examples['A'][:max_seq_length]
-      examples['B'] = examples['B'][:max_seq_length]
-      examples['A_m'] = examples['A_m'][:max_seq_length]
-      examples['B_hat'] = examples['B_hat'][:max_seq_length]
-      examples['B_m'] = examples['B_m'][:max_seq_length]
-      examples['A_hat'] = examples['A_hat'][:max_seq_length]
+      # A stream only holds some of the fields, see data_streams.
+      for field in ['A', 'B', 'A_m', 'B_hat', 'B_m', 'A_hat']:
+        if field in examples:
+          examples[field] = examples[field][:max_seq_length]
     else:
       print("######################## It is NOT invoked!!", max_seq_length)
     '''
@@ -173,65 +414,263 @@ def token_generator(
     the lines are integer lists converted from tokens in the file lines.
   '''
   tf.logging.info('Generating tokens...')
+  field_paths = dual_field_paths(
+      train, train_mode, A_path, B_path, A_m_path, B_m_path, A_hat_path,
+      B_hat_path, A_score_path, B_score_path)
+  for example in encoded_example_generator(field_paths, token_vocab, eos):
+    yield example
+
+
+def encoded_example_generator(field_paths, token_vocab, eos=None,
+                              rewound_fields=_REWOUND_FIELDS):
+  """Yields the examples of aligned files, see aligned_line_generator."""
   eos_list = [] if eos is None else [eos]
-  if not train:
-    with tf.gfile.GFile(A_path, mode="r") as A_file:
-      with tf.gfile.GFile(B_path, mode="r") as B_file:
-        A, B = A_file.readline(), B_file.readline()
-        while A and B:
-          A_ints = token_vocab.encode(A.strip()) + eos_list
-          B_ints = token_vocab.encode(B.strip()) + eos_list
-          yield {"A": A_ints, "B": B_ints}
-          A, B = A_file.readline(), B_file.readline()
-          
-  elif train_mode.startswith("pretrain"):
-    with tf.gfile.GFile(A_path, mode="r") as A_file:
-      with tf.gfile.GFile(B_path, mode="r") as B_file:
-        A = A_file.readline()
-        B = B_file.readline()
-        while A and B:
-          A_ints = token_vocab.encode(A.strip()) + eos_list
-          B_ints = token_vocab.encode(B.strip()) + eos_list
-          yield {'A':A_ints, 'B':B_ints}
-          A = A_file.readline()
-          B = B_file.readline()
-
-  else:
-    with tf.gfile.GFile(A_path, mode="r") as A_file:
-      with tf.gfile.GFile(B_path, mode="r") as B_file:
-        with tf.gfile.GFile(A_m_path, mode="r") as A_m_file:
-          with tf.gfile.GFile(B_m_path, mode="r") as B_m_file:
-            with tf.gfile.GFile(A_hat_path, mode="r") as A_hat_file:
-              with tf.gfile.GFile(B_hat_path, mode="r") as B_hat_file:
-                with tf.gfile.GFile(A_score_path, mode="r") as A_score_file:
-                  with tf.gfile.GFile(B_score_path, mode="r") as B_score_file:
-                    A = A_file.readline()
-                    B = B_file.readline()
-                    A_m = A_m_file.readline()
-                    B_m = B_m_file.readline()
-                    A_hat = A_hat_file.readline()
-                    B_hat = B_hat_file.readline()
-                    A_score = A_score_file.readline()
-                    B_score = B_score_file.readline()
-                    while A and B and A_m and B_m and A_hat and B_hat and A_score and B_score:
-                      A_ints = token_vocab.encode(A.strip()) + eos_list
-                      B_ints = token_vocab.encode(B.strip()) + eos_list
-                      A_m_ints = token_vocab.encode(A_m.strip()) + eos_list
-                      B_m_ints = token_vocab.encode(B_m.strip()) + eos_list
-                      A_hat_ints = token_vocab.encode(A_hat.strip()) + eos_list
-                      B_hat_ints = token_vocab.encode(B_hat.strip()) + eos_list
-                      A_score = [float(A_score.strip())]
-                      B_score = [float(B_score.strip())]
-                      yield {'A':A_ints, 'B':B_ints, 'A_m':A_m_ints, 'B_m':B_m_ints, 'A_hat':A_hat_ints, 'B_hat':B_hat_ints, 'A_score':A_score, 'B_score':B_score}
-                      A = A_file.readline()
-                      B = B_file.readline()
-                      A_m = read_mono_sentence(A_m_file)
-                      B_m = read_mono_sentence(B_m_file)
-                      A_hat = read_mono_sentence(A_hat_file)
-                      B_hat = read_mono_sentence(B_hat_file)
-                      A_score = A_score_file.readline()
-                      B_score = B_score_file.readline()
-    
+  fields = [field for field, _ in field_paths]
+  for lines_batch in _chunked(
+      aligned_line_generator(field_paths, rewound_fields),
+      _ENCODE_CHUNK_LINES):
+    for example in encode_lines_batch(fields, lines_batch, token_vocab,
+                                      eos_list):
+      yield example
+
+
+def dual_field_paths(
+  train,
+  train_mode,
+  A_path,
+  B_path,
+  A_m_path=None,
+  B_m_path=None,
+  A_hat_path=None,
+  B_hat_path=None,
+  A_score_path=None,
+  B_score_path=None):
+  """Returns the (field, path) pairs read for the given mode.
+
+  The score fields are only read if their files exist. Otherwise the scores
+  are written into the generated data by dual-t2t-lm-score.
+  """
+  if not train or train_mode.startswith("pretrain"):
+    return [('A', A_path), ('B', B_path)]
+  return ([('A', A_path), ('B', B_path), ('A_m', A_m_path), ('B_m', B_m_path),
+           ('A_hat', A_hat_path), ('B_hat', B_hat_path)] +
+          _score_field_paths(A_score_path, B_score_path))
+
+
+def _score_field_paths(A_score_path, B_score_path):
+  """Returns the (field, path) pairs of the score files that exist."""
+  field_paths = []
+  for field, path in [('A_score', A_score_path), ('B_score', B_score_path)]:
+    if path and tf.gfile.Exists(path):
+      field_paths.append((field, path))
+    else:
+      tf.logging.info('No %s file, score the data with dual-t2t-lm-score.' %
+                      field)
+  return field_paths
+
+
+def copy_scores(source_filenames, filenames):
+  """Writes the scores of the examples of source_filenames into filenames.
+
+  Examples are matched by their A and B, and the TFRecord files of filenames
+  are rewritten in place, as dual-t2t-lm-score does.
+
+  Args:
+    source_filenames: TFRecord files of scored examples.
+    filenames: TFRecord files of examples with the same A and B.
+
+  Returns:
+    False if source_filenames hold no scores, True otherwise.
+
+  Raises:
+    ValueError: if an example of filenames has no scored example in
+      source_filenames.
+  """
+  scores = {}
+  for filename in source_filenames:
+    for record in generator_utils.read_records(filename):
+      feature = tf.train.Example.FromString(record).features.feature
+      example_scores = {field: list(feature[field].float_list.value)
+                        for field in _SCORE_FIELDS if field in feature}
+      if example_scores:
+        scores[_parallel_key(feature)] = example_scores
+  if not scores:
+    return False
+  for filename in filenames:
+    examples = [tf.train.Example.FromString(record)
+                for record in generator_utils.read_records(filename)]
+    for example in examples:
+      feature = example.features.feature
+      key = _parallel_key(feature)
+      if key not in scores:
+        raise ValueError('An example of %s has no scores in %s.' %
+                         (filename, source_filenames))
+      for field, values in scores[key].items():
+        feature[field].float_list.value[:] = values
+    tmp_filename = filename + '.scoring'
+    generator_utils.write_records(
+        [example.SerializeToString() for example in examples], tmp_filename)
+    tf.gfile.Rename(tmp_filename, filename, overwrite=True)
+  return True
+
+
+def _parallel_key(feature):
+  return (tuple(feature['A'].int64_list.value),
+          tuple(feature['B'].int64_list.value))
+
+
+def dual_stream_field_paths(
+  A_path,
+  B_path,
+  A_m_path,
+  B_m_path,
+  A_hat_path,
+  B_hat_path,
+  A_score_path=None,
+  B_score_path=None):
+  """Returns the (field, path) pairs of every stream of the dual mode.
+
+  The parallel stream, named None, reads A, B and their scores, see
+  dual_field_paths. Every monolingual stream reads a monolingual corpus and
+  its back-translation, which have the same number of lines.
+  """
+  paths = {'A_m': A_m_path, 'B_m': B_m_path, 'A_hat': A_hat_path,
+           'B_hat': B_hat_path}
+  stream_field_paths = collections.OrderedDict()
+  stream_field_paths[None] = ([('A', A_path), ('B', B_path)] +
+                              _score_field_paths(A_score_path, B_score_path))
+  for stream, fields in _MONO_STREAM_FIELDS.items():
+    stream_field_paths[stream] = [(field, paths[field]) for field in fields]
+  return stream_field_paths
+
+
+def aligned_line_generator(field_paths, rewound_fields=_REWOUND_FIELDS):
+  """Yields lists of aligned raw lines, one per (field, path) pair.
+
+  The files of rewound_fields, by default the monolingual and pseudo-source
+  files, are rewound when exhausted (see read_mono_sentence), so iteration
+  stops with the shortest other file.
+  """
+  files = [tf.gfile.GFile(path, mode="r") for _, path in field_paths]
+  readers = [read_mono_sentence if field in rewound_fields else
+             (lambda f: f.readline()) for field, _ in field_paths]
+  try:
+    while True:
+      lines = [read(f) for read, f in zip(readers, files)]
+      if not all(lines):
+        return
+      yield lines
+  finally:
+    for f in files:
+      f.close()
+
+
+def encode_lines_batch(fields, lines_batch, token_vocab, eos_list):
+  """Encodes a batch of aligned raw lines into example dictionaries.
+
+  Each text field is encoded with a single TextEncoder.encode_batch call.
+  """
+  columns = {}
+  for i, field in enumerate(fields):
+    column = [lines[i].strip() for lines in lines_batch]
+    if field in _SCORE_FIELDS:
+      columns[field] = [[float(line)] for line in column]
+    else:
+      values, offsets = token_vocab.encode_batch(column)
+      values = values.tolist()
+      columns[field] = [values[offsets[j]:offsets[j + 1]] + eos_list
+                        for j in xrange(len(column))]
+  return [{field: columns[field][j] for field in fields}
+          for j in xrange(len(lines_batch))]
+
+
+def parallel_generate_files(field_paths,
+                            vocab_filepath,
+                            output_filenames,
+                            num_workers,
+                            eos=None,
+                            chunk_size=_ENCODE_CHUNK_LINES,
+                            rewound_fields=_REWOUND_FIELDS):
+  """Encodes aligned files in a process pool and writes sharded TFRecords.
+
+  The aligned files are cut into ranges of `chunk_size` lines. Each worker
+  loads the vocabulary once, encodes a range and serializes its tf.Examples,
+  and generator_utils.generate_files_in_pool writes them round-robin over
+  the shards. The output holds the examples of
+  generator_utils.generate_files(token_generator(...), output_filenames).
+
+  Args:
+    field_paths: list of (field, path) pairs, see dual_field_paths.
+    vocab_filepath: path of the SubwordTextEncoder vocabulary file.
+    output_filenames: List of output file paths.
+    num_workers: number of encoding processes.
+    eos: id appended to every encoded line, or None.
+    chunk_size: number of aligned lines encoded per task.
+    rewound_fields: fields rewound when exhausted, see aligned_line_generator.
+  """
+  fields = [field for field, _ in field_paths]
+  generator_utils.generate_files_in_pool(
+      aligned_line_generator(field_paths, rewound_fields), output_filenames,
+      _encode_chunk, num_workers, chunk_size=chunk_size,
+      initializer=_init_encode_worker, initargs=(vocab_filepath, fields, eos))
+
+
+def _chunked(iterable, chunk_size):
+  chunk = []
+  for item in iterable:
+    chunk.append(item)
+    if len(chunk) == chunk_size:
+      yield chunk
+      chunk = []
+  if chunk:
+    yield chunk
+
+
+# Per-process state of the parallel_generate_files workers.
+_worker_state = {}
+
+
+def _init_encode_worker(vocab_filepath, fields, eos):
+  _worker_state["vocab"] = text_encoder.SubwordTextEncoder(vocab_filepath)
+  _worker_state["fields"] = fields
+  _worker_state["eos_list"] = [] if eos is None else [eos]
+
+
+def _encode_chunk(chunk):
+  vocab = _worker_state["vocab"]
+  fields = _worker_state["fields"]
+  eos_list = _worker_state["eos_list"]
+  return [
+      generator_utils.to_example(example).SerializeToString()
+      for example in encode_lines_batch(fields, chunk, vocab, eos_list)
+  ]
+
+
+def latest_generation_dir(data_dir):
+  """Returns the latest generation of back-translated data, or None."""
+  latest_filename = os.path.join(data_dir, _BACKTRANSLATION_DIR,
+                                 _LATEST_GENERATION_FILENAME)
+  if not tf.gfile.Exists(latest_filename):
+    return None
+  with tf.gfile.Open(latest_filename) as f:
+    return os.path.join(data_dir, _BACKTRANSLATION_DIR, f.read().strip())
+
+
+def _set_latest_generation_dir(data_dir, generation_dir):
+  """Atomically makes generation_dir the latest generation."""
+  latest_filename = os.path.join(data_dir, _BACKTRANSLATION_DIR,
+                                 _LATEST_GENERATION_FILENAME)
+  with tf.gfile.Open(latest_filename + ".tmp", "w") as f:
+    f.write(os.path.basename(generation_dir))
+  tf.gfile.Rename(latest_filename + ".tmp", latest_filename, overwrite=True)
+
+
+def _generation_number(generation_dir):
+  if not generation_dir:
+    return 0
+  return int(re.search(r"generation-(\d+)$", generation_dir).group(1))
+
+
 def read_mono_sentence(mono_file):
   line = mono_file.readline()
   if not line:
@@ -0,0 +1,227 @@
+# coding=utf-8
+# Copyright 2017 The DLT2T Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Dual learning generators test."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import os
+import tempfile
+
+# Dependency imports
+
+from DLT2T.data_generators import dual_learning
+from DLT2T.data_generators import generator_utils
+from DLT2T.data_generators import text_encoder
+
+import tensorflow as tf
+
+
+_CORPUS = {
+    "A": ["the cat sat", "a dog ran", "the bird sang", "a fish swam",
+          "the cow slept"],
+    "B": ["die katze sass", "ein hund lief", "der vogel sang",
+          "ein fisch schwamm", "die kuh schlief"],
+    "A_m": ["a cat ran", "the dog sat"],
+    "B_m": ["ein vogel lief"],
+    "A_hat": ["the fish sang", "a cow ran", "the cat swam"],
+    "B_hat": ["der hund sang"],
+    "A_score": ["-1.5", "-2.0", "-0.5", "-3.25", "-1.0"],
+    "B_score": ["-2.5", "-1.0", "-4.5", "-0.25", "-2.0"],
+}
+
+
+class DualLearningTest(tf.test.TestCase):
+
+  def _write_corpus(self, tmp_dir):
+    paths = {}
+    for field, lines in _CORPUS.items():
+      paths[field + "_path"] = os.path.join(tmp_dir, field)
+      with tf.gfile.Open(paths[field + "_path"], "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return paths
+
+  def _build_vocab(self, tmp_dir):
+    token_counts = collections.Counter(
+        " ".join(" ".join(lines) for lines in _CORPUS.values()).split())
+    vocab = text_encoder.SubwordTextEncoder.build_to_target_size(
+        100, token_counts, 1, 10)
+    vocab_filepath = os.path.join(tmp_dir, "vocab")
+    vocab.store_to_file(vocab_filepath)
+    return text_encoder.SubwordTextEncoder(vocab_filepath), vocab_filepath
+
+  def testTokenGeneratorRewindsMonolingualFiles(self):
+    tmp_dir = tempfile.mkdtemp(dir=self.get_temp_dir())
+    paths = self._write_corpus(tmp_dir)
+    vocab, _ = self._build_vocab(tmp_dir)
+    examples = list(dual_learning.token_generator(
+        True, "dual", token_vocab=vocab, eos=text_encoder.EOS_ID, **paths))
+
+    self.assertEqual(len(_CORPUS["A"]), len(examples))
+    self.assertEqual(vocab.encode("the dog sat") + [text_encoder.EOS_ID],
+                     examples[3]["A_m"])
+    self.assertEqual(vocab.encode("ein vogel lief") + [text_encoder.EOS_ID],
+                     examples[4]["B_m"])
+    self.assertEqual([-0.25], examples[3]["B_score"])
+
+  def testParallelGenerateFilesMatchesGenerateFiles(self):
+    tmp_dir = tempfile.mkdtemp(dir=self.get_temp_dir())
+    paths = self._write_corpus(tmp_dir)
+    vocab, vocab_filepath = self._build_vocab(tmp_dir)
+
+    serial_files = generator_utils.train_data_filenames("serial", tmp_dir, 2)
+    generator_utils.generate_files(
+        dual_learning.token_generator(
+            True, "dual", token_vocab=vocab, eos=text_encoder.EOS_ID,
+            **paths), serial_files)
+
+    parallel_files = generator_utils.train_data_filenames(
+        "parallel", tmp_dir, 2)
+    dual_learning.parallel_generate_files(
+        dual_learning.dual_field_paths(True, "dual", **paths), vocab_filepath,
+        parallel_files, num_workers=2, eos=text_encoder.EOS_ID, chunk_size=2)
+
+    # The maps of the protos may serialize in a different order in the worker
+    # processes, so the examples are compared parsed.
+    def read_examples(filename):
+      return [tf.train.Example.FromString(record)
+              for record in generator_utils.read_records(filename)]
+
+    for serial_file, parallel_file in zip(serial_files, parallel_files):
+      self.assertEqual(read_examples(serial_file),
+                       read_examples(parallel_file))
+
+  def testGenerateBacktranslatedData(self):
+    data_dir = tempfile.mkdtemp(dir=self.get_temp_dir())
+    problem = dual_learning.DuallearningEnde()
+    paths = problem.dataset_paths(data_dir, True)
+    for field, lines in _CORPUS.items():
+      with tf.gfile.Open(paths[field + "_path"], "w") as f:
+        f.write("\n".join(lines) + "\n")
+    vocab, vocab_filepath = self._build_vocab(data_dir)
+    tf.gfile.Rename(vocab_filepath,
+                    os.path.join(data_dir, problem.vocab_file))
+    self.assertIsNone(dual_learning.latest_generation_dir(data_dir))
+
+    generation_dirs = []
+    for A_hat in (["a cow sang"], ["the dog ran"]):
+      A_hat_path = os.path.join(data_dir, "new_A_hat")
+      with tf.gfile.Open(A_hat_path, "w") as f:
+        f.write("\n".join(A_hat) + "\n")
+      generation_dirs.append(problem.generate_backtranslated_data(
+          data_dir, A_hat_path, paths["B_hat_path"], num_shards=2,
+          keep_generations=1))
+
+    self.assertEqual(generation_dirs[1],
+                     dual_learning.latest_generation_dir(data_dir))
+    self.assertFalse(tf.gfile.Exists(generation_dirs[0]))
+    train_files = sorted(tf.gfile.Glob(
+        problem.filepattern(data_dir, tf.estimator.ModeKeys.TRAIN)))
+    self.assertEqual(2, len(train_files))
+    self.assertTrue(train_files[0].startswith(generation_dirs[1]))
+    num_records = sum(len(generator_utils.read_records(fname))
+                      for fname in train_files)
+    self.assertEqual(len(_CORPUS["A"]), num_records)
+
+  def testGenerateBacktranslatedDataCopiesScores(self):
+    data_dir = tempfile.mkdtemp(dir=self.get_temp_dir())
+    problem = dual_learning.DuallearningEnde()
+    paths = problem.dataset_paths(data_dir, True)
+    for field, lines in _CORPUS.items():
+      with tf.gfile.Open(paths[field + "_path"], "w") as f:
+        f.write("\n".join(lines) + "\n")
+    vocab, vocab_filepath = self._build_vocab(data_dir)
+    tf.gfile.Rename(vocab_filepath,
+                    os.path.join(data_dir, problem.vocab_file))
+    # Training data scored in place, as by dual-t2t-lm-score, and no score
+    # files.
+    generator_utils.generate_files(
+        dual_learning.token_generator(True, "dual", token_vocab=vocab,
+                                      eos=dual_learning.EOS, **paths),
+        problem.training_filepaths(data_dir, 1, shuffled=True))
+    for field in ["A_score", "B_score"]:
+      tf.gfile.Remove(paths[field + "_path"])
+
+    def read_scores():
+      scores = {}
+      for fname in tf.gfile.Glob(
+          problem.filepattern(data_dir, tf.estimator.ModeKeys.TRAIN)):
+        for record in generator_utils.read_records(fname):
+          feature = tf.train.Example.FromString(record).features.feature
+          scores[tuple(feature["A"].int64_list.value)] = (
+              list(feature["A_score"].float_list.value),
+              list(feature["B_score"].float_list.value))
+      return scores
+
+    scores = read_scores()
+    self.assertEqual(sorted(float(s) for s in _CORPUS["A_score"]),
+                     sorted(a for (a,), _ in scores.values()))
+    problem.generate_backtranslated_data(
+        data_dir, paths["A_hat_path"], paths["B_hat_path"], num_shards=2)
+    self.assertEqual(scores, read_scores())
+
+  def testGenerateStreamData(self):
+    data_dir = tempfile.mkdtemp(dir=self.get_temp_dir())
+    problem = dual_learning.DuallearningEnde()
+    # Back-translations have the lines of their monolingual corpus.
+    corpus = dict(_CORPUS, A_hat=["the bird ran"],
+                  B_hat=["eine katze lief", "der hund sass"])
+    for train in [True, False]:
+      for field, path in problem.dataset_paths(data_dir, train).items():
+        with tf.gfile.Open(path, "w") as f:
+          f.write("\n".join(corpus[field[:-len("_path")]]) + "\n")
+    _, vocab_filepath = self._build_vocab(data_dir)
+    tf.gfile.Rename(vocab_filepath,
+                    os.path.join(data_dir, problem.vocab_file))
+
+    dual_learning.FLAGS.dual_mono_streams = True
+    try:
+      problem.generate_data(data_dir, data_dir, "dual")
+      streams = problem.data_streams(tf.estimator.ModeKeys.TRAIN, "dual")
+      stream_examples = {}
+      for stream, _, _ in streams:
+        stream_examples[stream] = []
+        for fname in tf.gfile.Glob(problem.filepattern(
+            data_dir, tf.estimator.ModeKeys.TRAIN, stream)):
+          stream_examples[stream].extend(
+              generator_utils.read_records(fname))
+    finally:
+      dual_learning.FLAGS.dual_mono_streams = False
+
+    self.assertEqual([None, "mono_A", "mono_B"],
+                     [stream for stream, _, _ in streams])
+    # Every corpus is written once, without rewinding the monolingual ones.
+    self.assertEqual(len(_CORPUS["A"]), len(stream_examples[None]))
+    self.assertEqual(len(_CORPUS["A_m"]), len(stream_examples["mono_A"]))
+    self.assertEqual(len(_CORPUS["B_m"]), len(stream_examples["mono_B"]))
+
+  def testDataStreamsOnlyReadUsedFeatures(self):
+    problem = dual_learning.DuallearningEnde()
+    for mode, train_mode in [
+        (tf.estimator.ModeKeys.TRAIN, "pretrain_A2B"),
+        (tf.estimator.ModeKeys.EVAL, "pretrain_B2A"),
+        (tf.estimator.ModeKeys.PREDICT, "dual")]:
+      self.assertEqual([(None, ["A", "B"], 1)],
+                       problem.data_streams(mode, train_mode))
+    self.assertEqual([(None, None, 1)],
+                     problem.data_streams(tf.estimator.ModeKeys.TRAIN,
+                                          "dual"))
+
+
+if __name__ == "__main__":
+  tf.test.main()
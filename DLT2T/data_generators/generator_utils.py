@@ -19,17 +19,24 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-from collections import defaultdict
+import collections
 import gzip
 import io
+import itertools
+import math
+import multiprocessing
 import os
 import random
+import sys
 import tarfile
+import threading
+import time
 
 # Dependency imports
 
 import requests
 import six
+from six.moves import queue
 from six.moves import xrange  # pylint: disable=redefined-builtin
 import six.moves.urllib_request as urllib  # Imports urllib on Python2, urllib.request on Python3
 
@@ -40,6 +47,14 @@ import tensorflow as tf
 
 UNSHUFFLED_SUFFIX = "-unshuffled"
 
+# Cases sent at a time to a generate_files worker, and the number of
+# serialized examples buffered for each shard writer thread.
+_SERIALIZE_CHUNK_SIZE = 1000
+_SHARD_QUEUE_SIZE = 10000
+
+# Bytes of records shuffle_dataset holds in memory at once.
+DEFAULT_SHUFFLE_MEMORY_BUDGET = 2**30
+
 
 def to_example(dictionary):
   """Helper: build tf.Example from (string -> int/float/str list) dictionary."""
@@ -125,33 +140,170 @@ def shard_filepath(fname, num_shards):
   ]
 
 
-def generate_files(generator, output_filenames, max_cases=None):
+def generate_files(generator, output_filenames, max_cases=None,
+                   num_workers=1, chunk_size=_SERIALIZE_CHUNK_SIZE):
   """Generate cases from a generator and save as TFRecord files.
 
   Generated cases are transformed to tf.Example protos and saved as TFRecords
   in sharded files named output_dir/output_name-00..N-of-00..M=num_shards.
 
+  With num_workers > 1 the protos are built and serialized in a process pool
+  while one thread per shard writes them out, so every shard receives the
+  same cases, in the same order, as with a single process. See
+  generate_files_in_pool.
+
   Args:
     generator: a generator yielding (string -> int/float/str list) dictionaries.
     output_filenames: List of output file paths.
     max_cases: maximum number of cases to get from the generator;
       if None (default), we use the generator until StopIteration is raised.
+    num_workers: number of processes serializing the cases.
+    chunk_size: number of cases sent to a worker at a time.
   """
+  if max_cases:
+    generator = itertools.islice(generator, max_cases)
+  if num_workers > 1:
+    generate_files_in_pool(generator, output_filenames, _serialize_cases,
+                           num_workers, chunk_size)
+    return
+  progress = _ExampleRateLogger()
   num_shards = len(output_filenames)
-  writers = [tf.python_io.TFRecordWriter(fname) for fname in output_filenames]
-  counter, shard = 0, 0
+  writers = [tf.python_io.TFRecordWriter(fname)
+             for fname in output_filenames]
+  shard = 0
   for case in generator:
-    if counter > 0 and counter % 100000 == 0:
-      tf.logging.info("Generating case %d." % counter)
-    counter += 1
-    if max_cases and counter > max_cases:
-      break
     sequence_example = to_example(case)
     writers[shard].write(sequence_example.SerializeToString())
     shard = (shard + 1) % num_shards
+    progress.update(1)
 
   for writer in writers:
     writer.close()
+  progress.finish()
+
+
+class _ExampleRateLogger(object):
+  """Logs the number of generated examples and examples/sec periodically."""
+
+  def __init__(self, interval_secs=60):
+    self._interval_secs = interval_secs
+    self._start_time = self._last_log_time = time.time()
+    self.count = 0
+
+  def update(self, num_examples):
+    self.count += num_examples
+    now = time.time()
+    if now - self._last_log_time >= self._interval_secs:
+      self._last_log_time = now
+      self._log("Generating case %d (%.0f examples/sec).", now)
+
+  def finish(self):
+    self._log("Generated %d cases (%.0f examples/sec).", time.time())
+
+  def _log(self, message, now):
+    elapsed = max(now - self._start_time, 1e-6)
+    tf.logging.info(message, self.count, self.count / elapsed)
+
+
+def _serialize_cases(cases):
+  return [to_example(case).SerializeToString() for case in cases]
+
+
+def _write_shard(writer, records_queue, errors):
+  """Writes the records of records_queue until None.
+
+  The writer is closed in any case. An error is appended to errors as
+  sys.exc_info(), and the rest of the queue is then drained, so that putting
+  records never blocks on a dead writer.
+
+  Args:
+    writer: a TFRecordWriter.
+    records_queue: a Queue of serialized records, ended by None.
+    errors: a list shared by the writer threads.
+  """
+  record = records_queue.get()
+  try:
+    try:
+      while record is not None:
+        writer.write(record)
+        record = records_queue.get()
+    finally:
+      writer.close()
+  except Exception:  # pylint: disable=broad-except
+    errors.append(sys.exc_info())
+    while record is not None:
+      record = records_queue.get()
+
+
+def generate_files_in_pool(items, output_filenames, serialize_fn, num_workers,
+                           chunk_size=_SERIALIZE_CHUNK_SIZE, initializer=None,
+                           initargs=()):
+  """Serializes items in a process pool and saves them as TFRecord files.
+
+  Lists of chunk_size items are serialized by serialize_fn in num_workers
+  processes while one thread per shard writes the records out, round-robin
+  over the shards in the order of the items, as generate_files does.
+
+  Args:
+    items: an iterable of the items to serialize.
+    output_filenames: List of output file paths.
+    serialize_fn: a picklable function of a list of items, returning the list
+      of their serialized tf.Examples.
+    num_workers: number of processes serializing the items.
+    chunk_size: number of items sent to a worker at a time.
+    initializer: optional function setting up every worker process.
+    initargs: arguments of initializer.
+  """
+  progress = _ExampleRateLogger()
+  num_shards = len(output_filenames)
+  queues = [queue.Queue(maxsize=_SHARD_QUEUE_SIZE)
+            for _ in output_filenames]
+  errors = []
+  writer_threads = [
+      threading.Thread(target=_write_shard,
+                       args=(tf.python_io.TFRecordWriter(fname), q, errors))
+      for fname, q in zip(output_filenames, queues)]
+  for thread in writer_threads:
+    thread.daemon = True
+    thread.start()
+
+  shard = [0]
+
+  def dispatch(records):
+    if errors:
+      six.reraise(*errors[0])
+    for record in records:
+      queues[shard[0]].put(record)
+      shard[0] = (shard[0] + 1) % num_shards
+    progress.update(len(records))
+
+  pool = multiprocessing.Pool(num_workers, initializer=initializer,
+                              initargs=initargs)
+  try:
+    # Results are consumed in submission order, which keeps the round-robin
+    # shard assignment of the serial path.
+    pending = collections.deque()
+    max_pending = 2 * num_workers
+    items = iter(items)
+    while True:
+      chunk = list(itertools.islice(items, chunk_size))
+      if not chunk:
+        break
+      pending.append(pool.apply_async(serialize_fn, (chunk,)))
+      if len(pending) >= max_pending:
+        dispatch(pending.popleft().get())
+    while pending:
+      dispatch(pending.popleft().get())
+  finally:
+    pool.terminate()
+    pool.join()
+    for q in queues:
+      q.put(None)
+    for thread in writer_threads:
+      thread.join()
+  if errors:
+    six.reraise(*errors[0])
+  progress.finish()
 
 
 def download_report_hook(count, block_size, total_size):
@@ -300,7 +452,7 @@ _DATA_FILE_URLS = [
 
 
 def get_or_generate_vocab_inner(data_dir, vocab_filename, vocab_size,
-                                generator):
+                                generator, num_workers=None):
   """Inner implementation for vocab generators.
 
   Args:
@@ -309,6 +461,8 @@ def get_or_generate_vocab_inner(data_dir, vocab_filename, vocab_size,
     vocab_filename: relative filename where vocab file is stored
     vocab_size: target size of the vocabulary constructed by SubwordTextEncoder
     generator: a generator that produces tokens from the vocabulary
+    num_workers: number of processes used to tokenize the generated strings
+        and build the vocabulary. Defaults to the number of CPUs.
 
   Returns:
     A SubwordTextEncoder vocabulary object.
@@ -324,13 +478,11 @@ def get_or_generate_vocab_inner(data_dir, vocab_filename, vocab_size,
     return vocab
 
   tf.logging.info("Generating vocab file: %s", vocab_filepath)
-  token_counts = defaultdict(int)
-  for item in generator:
-    for tok in tokenizer.encode(text_encoder.native_to_unicode(item)):
-      token_counts[tok] += 1
-
+  if num_workers is None:
+    num_workers = multiprocessing.cpu_count()
+  token_counts = tokenizer.generator_token_counts(generator, num_workers)
   vocab = text_encoder.SubwordTextEncoder.build_to_target_size(
-      vocab_size, token_counts, 1, 1e3)
+      vocab_size, token_counts, 1, 1e3, num_workers=num_workers)
 
   if vocab_filepath is not None:
     vocab.store_to_file(vocab_filepath)
@@ -460,18 +612,89 @@ def generate_dataset_and_shuffle(train_gen,
                                  train_paths,
                                  dev_gen,
                                  dev_paths,
-                                 shuffle=True):
-  generate_files(train_gen, train_paths)
-  generate_files(dev_gen, dev_paths)
+                                 shuffle=True,
+                                 memory_budget=DEFAULT_SHUFFLE_MEMORY_BUDGET,
+                                 across_shards=False,
+                                 num_workers=1):
+  generate_files(train_gen, train_paths, num_workers=num_workers)
+  generate_files(dev_gen, dev_paths, num_workers=num_workers)
   if shuffle:
-    shuffle_dataset(train_paths + dev_paths)
+    if across_shards:
+      # Keep training and dev examples apart.
+      shuffle_dataset(train_paths, memory_budget, across_shards=True)
+      shuffle_dataset(dev_paths, memory_budget, across_shards=True)
+    else:
+      shuffle_dataset(train_paths + dev_paths, memory_budget)
+
+
+def shuffle_dataset(filenames,
+                    memory_budget=DEFAULT_SHUFFLE_MEMORY_BUDGET,
+                    across_shards=False):
+  """Shuffles unshuffled TFRecord files with bounded memory.
 
+  Files that fit in memory_budget are shuffled in memory. Larger ones are
+  shuffled in two passes: the records are first scattered at random into
+  temporary bucket files small enough to fit in memory_budget, then each
+  bucket is shuffled in memory and appended to the output.
 
-def shuffle_dataset(filenames):
+  Args:
+    filenames: List of unshuffled file paths, which are removed once the
+      shuffled files (the same paths without UNSHUFFLED_SUFFIX) are written.
+    memory_budget: Approximate number of bytes of records to hold in memory.
+    across_shards: If True, records are shuffled across all the files and
+      dealt round-robin to the output files; otherwise each file is shuffled
+      on its own.
+  """
   tf.logging.info("Shuffling data...")
-  for fname in filenames:
-    records = read_records(fname)
+  groups = [filenames] if across_shards else [[fname] for fname in filenames]
+  for group in groups:
+    out_fnames = [fname.replace(UNSHUFFLED_SUFFIX, "") for fname in group]
+    _shuffle_records(group, out_fnames, memory_budget)
+    for fname in group:
+      tf.gfile.Remove(fname)
+
+
+def _shuffle_records(in_fnames, out_fnames, memory_budget):
+  """Writes the records of in_fnames, shuffled, round-robin to out_fnames."""
+  total_bytes = sum(tf.gfile.Stat(fname).length for fname in in_fnames)
+  num_buckets = max(1, int(math.ceil(total_bytes / float(memory_budget))))
+  if num_buckets == 1:
+    records = []
+    for fname in in_fnames:
+      records.extend(read_records(fname))
     random.shuffle(records)
-    out_fname = fname.replace(UNSHUFFLED_SUFFIX, "")
-    write_records(records, out_fname)
-    tf.gfile.Remove(fname)
+    _write_records_round_robin(records, out_fnames)
+    return
+
+  tf.logging.info("Scattering %d bytes into %d buckets.", total_bytes,
+                  num_buckets)
+  bucket_fnames = ["%s.bucket-%05d" % (out_fnames[0], i)
+                   for i in xrange(num_buckets)]
+  bucket_writers = [tf.python_io.TFRecordWriter(fname)
+                    for fname in bucket_fnames]
+  for fname in in_fnames:
+    for record in tf.python_io.tf_record_iterator(fname):
+      bucket_writers[random.randrange(num_buckets)].write(record)
+  for writer in bucket_writers:
+    writer.close()
+
+  writers = [tf.python_io.TFRecordWriter(fname) for fname in out_fnames]
+  shard = 0
+  for bucket_fname in bucket_fnames:
+    records = read_records(bucket_fname)
+    random.shuffle(records)
+    for record in records:
+      writers[shard].write(record)
+      shard = (shard + 1) % len(writers)
+    del records
+    tf.gfile.Remove(bucket_fname)
+  for writer in writers:
+    writer.close()
+
+
+def _write_records_round_robin(records, out_fnames):
+  if len(out_fnames) == 1:
+    write_records(records, out_fnames[0])
+    return
+  for shard, out_fname in enumerate(out_fnames):
+    write_records(records[shard::len(out_fnames)], out_fname)
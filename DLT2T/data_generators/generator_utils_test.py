@@ -27,6 +27,7 @@ import tempfile
 # Dependency imports
 
 from builtins import bytes  # pylint: disable=redefined-builtin
+import mock
 
 from DLT2T.data_generators import generator_utils
 
@@ -52,6 +53,92 @@ class GeneratorUtilsTest(tf.test.TestCase):
     os.remove(tmp_file_path + "-train-00000-of-00001")
     os.remove(tmp_file_path)
 
+  def testGenerateFilesInParallel(self):
+    tmp_dir = tempfile.mkdtemp(dir=self.get_temp_dir())
+
+    def test_generator():
+      for i in range(100):
+        yield {"inputs": [i], "targets": [i + 1]}
+
+    serial = generator_utils.train_data_filenames("serial", tmp_dir, 3)
+    generator_utils.generate_files(test_generator(), serial, max_cases=95)
+    parallel = generator_utils.train_data_filenames("parallel", tmp_dir, 3)
+    generator_utils.generate_files(test_generator(), parallel, max_cases=95,
+                                   num_workers=2, chunk_size=7)
+
+    # The maps of the protos may serialize in a different order in the worker
+    # processes, so the examples are compared parsed.
+    def read_examples(filename):
+      return [tf.train.Example.FromString(record)
+              for record in generator_utils.read_records(filename)]
+
+    for serial_file, parallel_file in zip(serial, parallel):
+      self.assertEqual(read_examples(serial_file),
+                       read_examples(parallel_file))
+    self.assertEqual(
+        95, sum(len(generator_utils.read_records(f)) for f in parallel))
+
+  def testGenerateFilesInParallelWriterError(self):
+    tmp_dir = tempfile.mkdtemp(dir=self.get_temp_dir())
+
+    closed = []
+
+    class FailingWriter(object):
+
+      def __init__(self, filename):
+        self.filename = filename
+
+      def write(self, unused_record):
+        raise IOError("Disk full.")
+
+      def close(self):
+        closed.append(self.filename)
+
+    def test_generator():
+      for i in range(100):
+        yield {"inputs": [i], "targets": [i + 1]}
+
+    # With queues of 2 records, a writer that stopped reading its queue would
+    # block generate_files forever.
+    filenames = generator_utils.train_data_filenames("failing", tmp_dir, 2)
+    with mock.patch.object(generator_utils, "_SHARD_QUEUE_SIZE", 2):
+      with mock.patch.object(tf.python_io, "TFRecordWriter", FailingWriter):
+        with self.assertRaisesRegexp(IOError, "Disk full."):
+          generator_utils.generate_files(test_generator(), filenames,
+                                         num_workers=2, chunk_size=7)
+    self.assertEqual(sorted(filenames), sorted(closed))
+
+  def testShuffleDataset(self):
+    tmp_dir = tempfile.mkdtemp(dir=self.get_temp_dir())
+
+    def test_generator():
+      for i in range(100):
+        yield {"inputs": [i], "targets": [i + 1]}
+
+    for across_shards in [False, True]:
+      filenames = generator_utils.train_data_filenames(
+          "shuffle", tmp_dir, 2)
+      unshuffled = [fname + generator_utils.UNSHUFFLED_SUFFIX
+                    for fname in filenames]
+      generator_utils.generate_files(test_generator(), unshuffled)
+      expected = [sorted(generator_utils.read_records(fname))
+                  for fname in unshuffled]
+
+      # A budget much smaller than a shard forces bucketed shuffling.
+      generator_utils.shuffle_dataset(
+          unshuffled, memory_budget=64, across_shards=across_shards)
+      self.assertEqual(sorted(tf.gfile.ListDirectory(tmp_dir)),
+                       sorted(os.path.basename(f) for f in filenames))
+      records = [generator_utils.read_records(fname) for fname in filenames]
+      self.assertEqual([50, 50], [len(r) for r in records])
+      if across_shards:
+        self.assertEqual(sorted(expected[0] + expected[1]),
+                         sorted(records[0] + records[1]))
+      else:
+        self.assertEqual(expected, [sorted(r) for r in records])
+      for fname in filenames:
+        os.remove(fname)
+
   def testMaybeDownload(self):
     tmp_dir = self.get_temp_dir()
     (_, tmp_file_path) = tempfile.mkstemp(dir=tmp_dir)
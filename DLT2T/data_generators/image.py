@@ -22,10 +22,13 @@ from __future__ import print_function
 import gzip
 import io
 import json
+from multiprocessing import pool as mp_pool
 import os
 import random
+import struct
 import tarfile
 import zipfile
+import zlib
 
 # Dependency imports
 
@@ -42,8 +45,21 @@ from DLT2T.utils import registry
 import tensorflow as tf
 
 
+# Formats of the images written by image_generator.
+IMAGE_FORMATS = ("png", "raw")
+
+
 class ImageProblem(problem.Problem):
 
+  @property
+  def image_format(self):
+    """The format of the images of image_generator, one of IMAGE_FORMATS.
+
+    "raw" images are stored as their uint8 bytes and their shape, and are read
+    without any decoding.
+    """
+    return "png"
+
   def example_reading_spec(self, label_key=None):
     if label_key is None:
       label_key = "image/class/label"
@@ -53,19 +69,34 @@ class ImageProblem(problem.Problem):
         "image/format": tf.FixedLenFeature((), tf.string),
         label_key: tf.VarLenFeature(tf.int64)
     }
+    if self.image_format == "raw":
+      data_fields["image/shape"] = tf.FixedLenFeature((3,), tf.int64)
+      inputs_decoder = tf.contrib.slim.tfexample_decoder.ItemHandlerCallback(
+          ["image/encoded", "image/shape"], _decode_raw_image)
+    else:
+      inputs_decoder = tf.contrib.slim.tfexample_decoder.Image(
+          image_key="image/encoded",
+          format_key="image/format",
+          channels=3)
     data_items_to_decoders = {
-        "inputs":
-            tf.contrib.slim.tfexample_decoder.Image(
-                image_key="image/encoded",
-                format_key="image/format",
-                channels=3),
-        "targets":
-            tf.contrib.slim.tfexample_decoder.Tensor(label_key),
+        "inputs": inputs_decoder,
+        "targets": tf.contrib.slim.tfexample_decoder.Tensor(label_key),
     }
 
     return data_fields, data_items_to_decoders
 
 
+def _decode_raw_image(keys_to_tensors):
+  """Reads a raw image as a uint8 [height, width, 3] Tensor, like Image."""
+  shape = tf.to_int32(keys_to_tensors["image/shape"])
+  image = tf.reshape(
+      tf.decode_raw(keys_to_tensors["image/encoded"], tf.uint8), shape)
+  # Grayscale images are repeated on 3 channels, alpha channels dropped.
+  image = tf.tile(image, [1, 1, tf.maximum(3 // shape[2], 1)])[:, :, :3]
+  image.set_shape([None, None, 3])
+  return image
+
+
 @registry.register_problem("image_celeba_tune")
 class ImageCeleba(ImageProblem):
   """CelebA dataset, aligned and cropped images."""
@@ -408,41 +439,87 @@ class Img2imgImagenet(ImageProblem):
     p.target_space_id = 1
 
 
-def image_generator(images, labels):
-  """Generator for images that takes image and labels lists and creates pngs.
+def image_generator(images, labels, image_format="png", num_threads=8,
+                    batch_size=1000):
+  """Generator for images that takes image and labels lists and encodes them.
+
+  Images are encoded batch_size at a time by a pool of num_threads threads.
+  PNGs are written with zlib, which releases the GIL, so the threads encode in
+  parallel.
 
   Args:
     images: list of images given as [width x height x channels] numpy arrays.
     labels: list of ints, same length as images.
+    image_format: one of IMAGE_FORMATS.
+    num_threads: number of encoding threads.
+    batch_size: number of images encoded at a time.
 
   Yields:
     A dictionary representing the images with the following fields:
-    * image/encoded: the string encoding the image as PNG,
-    * image/format: the string "png" representing image format,
+    * image/encoded: the string encoding the image as PNG, or its raw bytes,
+    * image/format: the string "png" or "raw" representing image format,
     * image/class/label: an integer representing the label,
     * image/height: an integer representing the height,
-    * image/width: an integer representing the width.
+    * image/width: an integer representing the width,
+    * image/shape: for raw images only, the 3 dimensions of the array.
     Every field is actually a singleton list of the corresponding type.
 
   Raises:
-    ValueError: if images is an empty list.
+    ValueError: if images is an empty list or image_format is unknown.
   """
   if not images:
     raise ValueError("Must provide some images for the generator.")
-  (width, height, channels) = images[0].shape
-  with tf.Graph().as_default():
-    image_t = tf.placeholder(dtype=tf.uint8, shape=(width, height, channels))
-    encoded_image_t = tf.image.encode_png(image_t)
-    with tf.Session() as sess:
-      for (image, label) in zip(images, labels):
-        enc_string = sess.run(encoded_image_t, feed_dict={image_t: image})
-        yield {
+  if image_format not in IMAGE_FORMATS:
+    raise ValueError("Unknown image format %s, expected one of %s." %
+                     (image_format, IMAGE_FORMATS))
+  (width, height, _) = images[0].shape
+  encode = _encode_png if image_format == "png" else _encode_raw
+  pool = mp_pool.ThreadPool(num_threads)
+  try:
+    for start in xrange(0, len(images), batch_size):
+      batch_images = images[start:start + batch_size]
+      batch_labels = labels[start:start + batch_size]
+      for (image, label, enc_string) in zip(
+          batch_images, batch_labels, pool.map(encode, batch_images)):
+        example = {
             "image/encoded": [enc_string],
-            "image/format": ["png"],
+            "image/format": [image_format],
             "image/class/label": [int(label)],
             "image/height": [height],
             "image/width": [width]
         }
+        if image_format == "raw":
+          example["image/shape"] = list(image.shape)
+        yield example
+  finally:
+    pool.terminate()
+
+
+def _encode_raw(image):
+  return np.asarray(image).astype(np.uint8).tobytes()
+
+
+def _encode_png(image, compression=6):
+  """Encodes a [height, width, channels] array as an 8-bit PNG."""
+  image = np.asarray(image).astype(np.uint8)
+  height, width, channels = image.shape
+  # Grayscale, grayscale with alpha, RGB and RGBA.
+  color_type = {1: 0, 2: 4, 3: 2, 4: 6}[channels]
+  # Every row starts with its filter type, 0 for none.
+  rows = np.zeros([height, 1 + width * channels], dtype=np.uint8)
+  rows[:, 1:] = image.reshape([height, width * channels])
+
+  def chunk(chunk_type, data):
+    return (struct.pack(">I", len(data)) + chunk_type + data +
+            struct.pack(">I", zlib.crc32(chunk_type + data) & 0xffffffff))
+
+  return b"".join([
+      b"\x89PNG\r\n\x1a\n",
+      chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0,
+                                 0, 0)),
+      chunk(b"IDAT", zlib.compress(rows.tobytes(), compression)),
+      chunk(b"IEND", b""),
+  ])
 
 
 # URLs and filenames for MNIST data.
@@ -498,7 +575,8 @@ def _extract_mnist_labels(filename, num_labels):
   return labels
 
 
-def mnist_generator(tmp_dir, training, how_many, start_from=0):
+def mnist_generator(tmp_dir, training, how_many, start_from=0,
+                    image_format="png"):
   """Image generator for MNIST.
 
   Args:
@@ -506,6 +584,7 @@ def mnist_generator(tmp_dir, training, how_many, start_from=0):
     training: a Boolean; if true, we use the train set, otherwise the test set.
     how_many: how many images and labels to generate.
     start_from: from which image to start.
+    image_format: one of IMAGE_FORMATS.
 
   Returns:
     An instance of image_generator that produces MNIST images.
@@ -522,7 +601,8 @@ def mnist_generator(tmp_dir, training, how_many, start_from=0):
   random.shuffle(data)
   images, labels = list(zip(*data))
   return image_generator(images[start_from:start_from + how_many],
-                         labels[start_from:start_from + how_many])
+                         labels[start_from:start_from + how_many],
+                         image_format=image_format)
 
 
 @registry.register_problem
@@ -547,9 +627,11 @@ class ImageMnistTune(Image2ClassProblem):
 
   def generator(self, data_dir, tmp_dir, is_training):
     if is_training:
-      return mnist_generator(tmp_dir, True, 55000)
+      return mnist_generator(tmp_dir, True, 55000,
+                             image_format=self.image_format)
     else:
-      return mnist_generator(tmp_dir, True, 5000, 55000)
+      return mnist_generator(tmp_dir, True, 5000, 55000,
+                             image_format=self.image_format)
 
 
 @registry.register_problem
@@ -557,9 +639,20 @@ class ImageMnist(ImageMnistTune):
 
   def generator(self, data_dir, tmp_dir, is_training):
     if is_training:
-      return mnist_generator(tmp_dir, True, 60000)
+      return mnist_generator(tmp_dir, True, 60000,
+                             image_format=self.image_format)
     else:
-      return mnist_generator(tmp_dir, False, 10000)
+      return mnist_generator(tmp_dir, False, 10000,
+                             image_format=self.image_format)
+
+
+@registry.register_problem
+class ImageMnistRaw(ImageMnist):
+  """MNIST, with raw images."""
+
+  @property
+  def image_format(self):
+    return "raw"
 
 
 # URLs and filenames for CIFAR data.
@@ -580,7 +673,8 @@ def _get_cifar10(directory):
   tarfile.open(path, "r:gz").extractall(directory)
 
 
-def cifar10_generator(tmp_dir, training, how_many, start_from=0):
+def cifar10_generator(tmp_dir, training, how_many, start_from=0,
+                      image_format="png"):
   """Image generator for CIFAR-10.
 
   Args:
@@ -588,6 +682,7 @@ def cifar10_generator(tmp_dir, training, how_many, start_from=0):
     training: a Boolean; if true, we use the train set, otherwise the test set.
     how_many: how many images and labels to generate.
     start_from: from which image to start.
+    image_format: one of IMAGE_FORMATS.
 
   Returns:
     An instance of image_generator that produces CIFAR-10 images and labels.
@@ -609,7 +704,8 @@ def cifar10_generator(tmp_dir, training, how_many, start_from=0):
     labels = data["labels"]
     all_labels.extend([labels[j] for j in xrange(num_images)])
   return image_generator(all_images[start_from:start_from + how_many],
-                         all_labels[start_from:start_from + how_many])
+                         all_labels[start_from:start_from + how_many],
+                         image_format=image_format)
 
 
 @registry.register_problem
@@ -631,9 +727,11 @@ class ImageCifar10Tune(ImageMnistTune):
 
   def generator(self, data_dir, tmp_dir, is_training):
     if is_training:
-      return cifar10_generator(tmp_dir, True, 48000)
+      return cifar10_generator(tmp_dir, True, 48000,
+                               image_format=self.image_format)
     else:
-      return cifar10_generator(tmp_dir, True, 2000, 48000)
+      return cifar10_generator(tmp_dir, True, 2000, 48000,
+                               image_format=self.image_format)
 
 
 @registry.register_problem
@@ -641,9 +739,20 @@ class ImageCifar10(ImageCifar10Tune):
 
   def generator(self, data_dir, tmp_dir, is_training):
     if is_training:
-      return cifar10_generator(tmp_dir, True, 50000)
+      return cifar10_generator(tmp_dir, True, 50000,
+                               image_format=self.image_format)
     else:
-      return cifar10_generator(tmp_dir, False, 10000)
+      return cifar10_generator(tmp_dir, False, 10000,
+                               image_format=self.image_format)
+
+
+@registry.register_problem
+class ImageCifar10Raw(ImageCifar10):
+  """Cifar-10, with raw images."""
+
+  @property
+  def image_format(self):
+    return "raw"
 
 
 @registry.register_problem
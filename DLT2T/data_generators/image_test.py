@@ -67,6 +67,26 @@ class ImageTest(tf.test.TestCase):
       decoded2 = sess.run(decoded_png_t, feed_dict={image_t: encoded_img2[0]})
       self.assertAllClose(decoded2, image2)
 
+  def testRawImageGenerator(self):
+    np.random.seed(1111)  # To avoid any flakiness.
+    images = [np.random.randint(0, 255, size=(10, 12, 1)) for _ in range(3)]
+    examples = list(image.image_generator(images, [1, 2, 3],
+                                          image_format="raw", batch_size=2))
+    self.assertEqual(3, len(examples))
+    self.assertEqual(["raw"], examples[2]["image/format"])
+    self.assertEqual([10, 12, 1], examples[2]["image/shape"])
+    self.assertEqual([3], examples[2]["image/class/label"])
+
+    # Raw images are read as RGB, like PNGs.
+    keys_to_tensors = {
+        "image/encoded": tf.constant(examples[2]["image/encoded"][0]),
+        "image/shape": tf.constant(examples[2]["image/shape"], tf.int64),
+    }
+    decoded_t = image._decode_raw_image(keys_to_tensors)  # pylint: disable=protected-access
+    with self.test_session() as sess:
+      decoded = sess.run(decoded_t)
+    self.assertAllEqual(np.tile(images[2], [1, 1, 3]), decoded)
+
 
 if __name__ == "__main__":
   tf.test.main()
@@ -22,6 +22,7 @@ import os
 import random
 # Dependency imports
 import six
+from DLT2T.data_generators import columnar
 from DLT2T.data_generators import generator_utils
 from DLT2T.data_generators import text_encoder
 from DLT2T.utils import metrics
@@ -153,6 +154,13 @@ class Problem(object):
     * hparams(defaults, model_hparams)
         - Specify the problem hyperparameters (see _default_hparams)
         - Mutate defaults as needed
+    * reload_data_files()
+        - Whether training picks up new data files without a restart.
+    * columnar_data_files()
+        - Whether the data is read from columnar shards, see columnar.py.
+    * data_streams(mode, train_mode)
+        - The streams of examples batched separately and read together, and
+          the features read from them.
     * example_reading_spec
         - Specify the names and types of the features on disk.
         - Specify tf.contrib.slim.tfexample_decoder
@@ -203,6 +211,46 @@ class Problem(object):
   def preprocess_example(self, example, mode, hparams):
     return preprocess_example_common(example, hparams, mode)
 
+  def reload_data_files(self):
+    """Whether training looks up filepattern again before every data file.
+
+    If True, the training Dataset reads its data files one at a time and
+    starts a new pass over the files as soon as filepattern(data_dir, TRAIN)
+    changes, so that data written while training is read without a restart.
+    """
+    return False
+
+  def columnar_data_files(self):
+    """Whether the data is read from the columnar shards of the data files.
+
+    The columnar shards (see columnar.py) must have been written next to the
+    TFRecord files with columnar.write_columnar_shards. They are read without
+    proto parsing, so data_items_to_decoders of example_reading_spec is
+    ignored and all data_fields must be VarLenFeatures.
+    """
+    return False
+
+  def data_streams(self, mode, train_mode=None):
+    """The streams of examples read for mode.
+
+    Every stream is read from its own files (see filepattern), batched on its
+    own and its batches are merged into one feature map, so the streams must
+    have distinct features. Only the listed features are parsed, batched and
+    padded.
+
+    Args:
+      mode: tf.estimator.ModeKeys.
+      train_mode: the train_mode of the model, e.g. "pretrain_A2B", or None.
+
+    Returns:
+      a list of (stream, features, batch_size_multiplier) tuples: the stream
+      name passed to filepattern, the list of features read from it, or None
+      for all the data_fields of example_reading_spec, and a multiplier of
+      hparams.batch_size for its batches.
+    """
+    del mode, train_mode
+    return [(None, None, 1)]
+
   def eval_metrics(self):
     return [
         metrics.Metrics.ACC, metrics.Metrics.ACC_TOP5,
@@ -213,8 +261,10 @@ class Problem(object):
   # END SUBCLASS INTERFACE
   # ============================================================================
 
-  def training_filepaths(self, data_dir, num_shards, shuffled):
+  def training_filepaths(self, data_dir, num_shards, shuffled, stream=None):
     file_basename = self.dataset_filename()
+    if stream:
+      file_basename += "_" + stream
     if not shuffled:
       file_basename += generator_utils.UNSHUFFLED_SUFFIX
     return generator_utils.train_data_filenames(file_basename, data_dir,
@@ -234,7 +284,7 @@ class Problem(object):
     return generator_utils.test_data_filenames(file_basename, data_dir,
                                                num_shards)
 
-  def filepattern(self, data_dir, mode):
+  def filepattern(self, data_dir, mode, stream=None):
     """Get filepattern for data files for mode.
 
     Matches mode to a suffix.
@@ -246,11 +296,15 @@ class Problem(object):
     Args:
       data_dir: str, data directory.
       mode: tf.estimator.ModeKeys or "test".
+      stream: optional name of a stream of data_streams, whose files are
+        named after dataset_filename() + "_" + stream.
 
     Returns:
       filepattern str
     """
     path = os.path.join(data_dir, self.dataset_filename())
+    if stream:
+      path += "_" + stream
 
     if mode == tf.estimator.ModeKeys.TRAIN:
       suffix = "train"
@@ -328,7 +382,9 @@ class Problem(object):
               shuffle_files=None,
               hparams=None,
               preprocess=True,
-              dataset_split=None):
+              dataset_split=None,
+              stream=None,
+              features=None):
     """Build a Dataset for this problem.
 
     Args:
@@ -347,6 +403,9 @@ class Problem(object):
         Problem.preprocess_example.
       dataset_split: tf.estimator.ModeKeys + ["test"], which split to read data
         from (TRAIN:"-train", EVAL:"-dev", "test":"-test"). Defaults to mode.
+      stream: optional name of the stream to read, see data_streams.
+      features: optional list of the features to read, of the data_fields of
+        example_reading_spec. Defaults to all of them.
 
     Returns:
       Dataset containing dict<feature name, Tensor>.
@@ -365,6 +424,11 @@ class Problem(object):
     _ = self.get_hparams(hparams)
 
     data_fields, data_items_to_decoders = self.example_reading_spec()
+    if features is not None:
+      data_fields = {field: data_fields[field] for field in features}
+      if data_items_to_decoders is not None:
+        data_items_to_decoders = {field: data_items_to_decoders[field]
+                                  for field in features}
     if data_items_to_decoders is None:
       data_items_to_decoders = {
           field: tf.contrib.slim.tfexample_decoder.Tensor(field)
@@ -372,13 +436,28 @@ class Problem(object):
       }
 
     is_training = mode == tf.estimator.ModeKeys.TRAIN
-    data_filepattern = self.filepattern(data_dir, dataset_split)
-    tf.logging.info("Reading data files from %s", data_filepattern)
-    data_files = tf.contrib.slim.parallel_reader.get_data_files(
-        data_filepattern)
-    if shuffle_files or shuffle_files is None and is_training:
-      random.shuffle(data_files)
-    dataset = tf.contrib.data.TFRecordDataset(data_files)
+    columnar_data_files = self.columnar_data_files()
+    if is_training and self.reload_data_files():
+      filepattern_fn = lambda: self.filepattern(data_dir, dataset_split,
+                                                stream)
+      if columnar_data_files:
+        dataset = columnar.columnar_dataset(
+            None, data_fields, filepattern_fn=filepattern_fn)
+      else:
+        dataset = _reloading_record_dataset(filepattern_fn)
+    else:
+      data_filepattern = self.filepattern(data_dir, dataset_split, stream)
+      if columnar_data_files:
+        data_filepattern = columnar.columnar_path(data_filepattern)
+      tf.logging.info("Reading data files from %s", data_filepattern)
+      data_files = tf.contrib.slim.parallel_reader.get_data_files(
+          data_filepattern)
+      if shuffle_files or shuffle_files is None and is_training:
+        random.shuffle(data_files)
+      if columnar_data_files:
+        dataset = columnar.columnar_dataset(data_files, data_fields)
+      else:
+        dataset = tf.contrib.data.TFRecordDataset(data_files)
 
     def decode_record(record):
       """Serialized Example to dict of <feature name, Tensor>."""
@@ -395,7 +474,10 @@ class Problem(object):
       self.maybe_copy_features(example)
       return example
 
-    dataset = dataset.map(decode_record, num_threads=num_threads)
+    # Columnar examples are already decoded; both kinds of examples are then
+    # preprocessed, reversed and copied by _preprocess.
+    if not columnar_data_files:
+      dataset = dataset.map(decode_record, num_threads=num_threads)
 
     if preprocess:
       dataset = dataset.map(
@@ -468,6 +550,38 @@ class FeatureInfo(object):
     self.space_id = space_id
 
 
+def _reloading_record_dataset(filepattern_fn):
+  """An endless TFRecord Dataset over the files of a changing filepattern.
+
+  The files are read one at a time, in shuffled passes. Before every file,
+  filepattern_fn is called again, and a new pass over the files it matches
+  starts if it returned a different filepattern.
+
+  Args:
+    filepattern_fn: function returning the current filepattern str.
+
+  Returns:
+    Dataset of serialized records.
+  """
+  state = {"filepattern": None, "data_files": []}
+
+  def next_data_file():
+    filepattern = filepattern_fn()
+    if filepattern != state["filepattern"] or not state["data_files"]:
+      if filepattern != state["filepattern"]:
+        tf.logging.info("Reading data files from %s", filepattern)
+      data_files = tf.contrib.slim.parallel_reader.get_data_files(filepattern)
+      random.shuffle(data_files)
+      state["filepattern"] = filepattern
+      state["data_files"] = data_files
+    return state["data_files"].pop()
+
+  data_files = tf.contrib.data.Dataset.from_tensors(tf.constant(0)).repeat()
+  return data_files.flat_map(
+      lambda _: tf.contrib.data.TFRecordDataset(
+          tf.py_func(next_data_file, [], tf.string)))
+
+
 def _copy_problem_hparams(p_hparams):
   """Use input modality, vocab, and space id for target."""
   p = p_hparams
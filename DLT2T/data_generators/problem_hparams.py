@@ -24,6 +24,8 @@ import os
 
 # Dependency imports
 
+from DLT2T.data_generators import audio
+from DLT2T.data_generators import generator_utils
 from DLT2T.data_generators import problem
 from DLT2T.data_generators import text_encoder
 from DLT2T.layers import modalities  # pylint: disable=unused-import
@@ -38,6 +40,15 @@ import tensorflow as tf
 class AudioTimitProblem(problem.Problem):
   """Base class for TIMIT problems."""
 
+  @property
+  def spectral(self):
+    """Whether the inputs are spectral features, see audio.timit_generator.
+
+    They are float32 [frame_count, bin_count] arrays bitcast to int32 and
+    flattened, which preprocess_example reshapes for AudioSpectralModality.
+    """
+    return False
+
   def example_reading_spec(self):
     data_fields = {
         "inputs": tf.VarLenFeature(tf.int64),
@@ -45,6 +56,9 @@ class AudioTimitProblem(problem.Problem):
         "audio/sample_width": tf.FixedLenFeature((), tf.int64),
         "targets": tf.VarLenFeature(tf.int64),
     }
+    if self.spectral:
+      data_fields["audio/frame_count"] = tf.FixedLenFeature((), tf.int64)
+      data_fields["audio/bin_count"] = tf.FixedLenFeature((), tf.int64)
     return data_fields, None
 
   def preprocess_example(self, example, mode, hparams):
@@ -54,8 +68,15 @@ class AudioTimitProblem(problem.Problem):
     sample_count = tf.to_int32(example.pop("audio/sample_count"))
     sample_width = tf.to_int32(example.pop("audio/sample_width"))
     channel_count = 1
-    example["inputs"] = tf.reshape(example["inputs"],
-                                   [sample_count, sample_width, channel_count])
+    if self.spectral:
+      frame_count = tf.to_int32(example.pop("audio/frame_count"))
+      bin_count = tf.to_int32(example.pop("audio/bin_count"))
+      # The int32 bit patterns, for AudioSpectralModality to bitcast back.
+      example["inputs"] = tf.reshape(tf.to_int32(example["inputs"]),
+                                     [frame_count, bin_count, channel_count])
+    else:
+      example["inputs"] = tf.reshape(
+          example["inputs"], [sample_count, sample_width, channel_count])
     return example
 
 
@@ -77,6 +98,30 @@ class AudioTimitCharactersTune(AudioTimitProblem):
     hp.target_modality = (registry.Modalities.SYMBOL, 256)
 
 
+@registry.register_problem
+class AudioTimitCharactersSpectralTune(AudioTimitCharactersTune):
+  """TIMIT to characters, from spectral features."""
+
+  @property
+  def spectral(self):
+    return True
+
+  def generate_data(self, data_dir, tmp_dir, task_id=-1):
+    generator_utils.generate_dataset_and_shuffle(
+        audio.timit_generator(data_dir, tmp_dir, True, 1718, spectral=True),
+        self.training_filepaths(data_dir, 10, shuffled=False),
+        audio.timit_generator(data_dir, tmp_dir, False, 626, spectral=True),
+        self.dev_filepaths(data_dir, 1, shuffled=False))
+
+  def hparams(self, defaults, model_hparams):
+    super(AudioTimitCharactersSpectralTune, self).hparams(
+        defaults, model_hparams)
+    defaults.input_modality = {
+        "inputs": ("%s:audio_spectral_modality" % registry.Modalities.AUDIO,
+                   None),
+    }
+
+
 @registry.register_problem
 class AudioTimitTokens8kTune(AudioTimitProblem):
   """TIMIT to tokens."""
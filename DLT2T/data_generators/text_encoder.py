@@ -26,10 +26,12 @@ from __future__ import print_function
 
 import collections
 from itertools import chain
+import multiprocessing
 import re
 
 # Dependency imports
 
+import numpy as np
 import six
 from six.moves import xrange  # pylint: disable=redefined-builtin
 from DLT2T.data_generators import tokenizer
@@ -56,6 +58,23 @@ else:
 _UNESCAPE_REGEX = re.compile(r"\\u|\\\\|\\([0-9]+);")
 _ESCAPE_CHARS = set(u"\\_u;0123456789")
 
+# Key of the subtoken id in a SubwordTextEncoder trie node. Never a character.
+_TRIE_ID = None
+
+# Default number of tokens memoized by SubwordTextEncoder.encode.
+DEFAULT_SUBTOKEN_CACHE_SIZE = 2**16
+
+SubtokenCacheInfo = collections.namedtuple(
+    "SubtokenCacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+# Minimum number of distinct tokens per process when counting candidate
+# subtokens in parallel; smaller builds are not worth the pool overhead.
+_MIN_TOKENS_PER_WORKER = 10000
+
+# Number of strings or id sequences per task when encode_batch and
+# decode_batch run in a pool.
+_POOL_CHUNK_SIZE = 1024
+
 
 # Conversion between Unicode and UTF-8, if required (on Python2).
 if six.PY2:
@@ -134,11 +153,84 @@ class TextEncoder(object):
         decoded_ids.append(id_ - self._num_reserved_ids)
     return [str(d) for d in decoded_ids]
 
+  def encode_batch(self, strings, pool=None):
+    """Transform a list of human-readable strings into a ragged batch of ids.
+
+    EOS is not appended.
+
+    Args:
+      strings: list of human-readable strings to be converted.
+      pool: optional thread or process pool, i.e. any object with a `map`
+        method such as multiprocessing.Pool or multiprocessing.pool.ThreadPool,
+        used to encode chunks of strings concurrently.
+
+    Returns:
+      values: int64 numpy array with the ids of all strings, concatenated.
+      offsets: int64 numpy array of length len(strings) + 1; the ids of
+        strings[i] are values[offsets[i]:offsets[i + 1]].
+    """
+    if pool is None:
+      return ids_to_ragged([self.encode(s) for s in strings])
+    return ids_to_ragged(_map_chunks(pool, _encode_chunk, self, strings))
+
+  def decode_batch(self, ids_batch, offsets=None, pool=None):
+    """Transform a batch of id sequences into human-readable strings.
+
+    Args:
+      ids_batch: list of id sequences (lists or 1-D numpy arrays), a 2-D numpy
+        array with one sequence per row, or, if offsets is given, the ragged
+        values returned by encode_batch.
+      offsets: optional offsets returned by encode_batch.
+      pool: optional thread or process pool, see encode_batch.
+
+    Returns:
+      strs: list of human-readable strings.
+    """
+    if offsets is not None:
+      ids_batch = ragged_to_ids(ids_batch, offsets)
+    if pool is None:
+      return [self.decode(ids) for ids in ids_batch]
+    return _map_chunks(pool, _decode_chunk, self, list(ids_batch))
+
   @property
   def vocab_size(self):
     raise NotImplementedError()
 
 
+def ids_to_ragged(ids_list):
+  """Packs a list of id sequences into ragged (values, offsets) arrays."""
+  lengths = np.fromiter((len(ids) for ids in ids_list), np.int64,
+                        count=len(ids_list))
+  offsets = np.zeros(len(ids_list) + 1, np.int64)
+  np.cumsum(lengths, out=offsets[1:])
+  values = np.fromiter(chain.from_iterable(ids_list), np.int64,
+                       count=int(offsets[-1]))
+  return values, offsets
+
+
+def ragged_to_ids(values, offsets):
+  """Splits ragged (values, offsets) arrays into a list of id arrays."""
+  values = np.asarray(values)
+  return [values[offsets[i]:offsets[i + 1]] for i in xrange(len(offsets) - 1)]
+
+
+def _encode_chunk(args):
+  encoder, strings = args
+  return [encoder.encode(s) for s in strings]
+
+
+def _decode_chunk(args):
+  encoder, ids_batch = args
+  return [encoder.decode(ids) for ids in ids_batch]
+
+
+def _map_chunks(pool, fn, encoder, items):
+  """Maps fn over chunks of items in pool and concatenates the results."""
+  chunks = [(encoder, items[i:i + _POOL_CHUNK_SIZE])
+            for i in xrange(0, len(items), _POOL_CHUNK_SIZE)]
+  return list(chain.from_iterable(pool.map(fn, chunks)))
+
+
 class ByteTextEncoder(TextEncoder):
   """Encodes each byte to an id. For 8-bit strings only."""
 
@@ -177,6 +269,18 @@ class ByteTextEncoder(TextEncoder):
     # Python3: join byte arrays and then decode string
     return decoded_ids
 
+  def encode_batch(self, strings, pool=None):
+    del pool  # Encoding is a single vectorized pass.
+    encoded = [s.encode("utf-8") if isinstance(s, six.text_type) else s
+               for s in strings]
+    lengths = np.fromiter((len(b) for b in encoded), np.int64,
+                          count=len(encoded))
+    offsets = np.zeros(len(encoded) + 1, np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    values = np.frombuffer(b"".join(encoded), np.uint8).astype(np.int64)
+    values += self._num_reserved_ids
+    return values, offsets
+
   @property
   def vocab_size(self):
     return 2**8 + self._num_reserved_ids
@@ -412,14 +516,18 @@ class SubwordTextEncoder(TextEncoder):
 
   """
 
-  def __init__(self, filename=None):
+  def __init__(self, filename=None, cache_size=DEFAULT_SUBTOKEN_CACHE_SIZE):
     """Initialize and read from a file, if provided.
 
     Args:
       filename: filename from which to read vocab. If None, do not load a
         vocab
+      cache_size: maximum number of tokens whose subtoken ids are memoized
+        by encode. 0 disables the cache.
     """
     self._alphabet = set()
+    self._cache_size = cache_size
+    self._clear_cache()
     if filename is not None:
       self._load_from_file(filename)
     super(SubwordTextEncoder, self).__init__(num_reserved_ids=None)
@@ -449,11 +557,34 @@ class SubwordTextEncoder(TextEncoder):
   def decode_list(self, subtokens):
     return [self._subtoken_id_to_subtoken_string(s) for s in subtokens]
 
+  def __getstate__(self):
+    # The trie and the cache are derived data and expensive to pickle, e.g.
+    # when encode_batch sends the encoder to a process pool.
+    state = self.__dict__.copy()
+    state.pop("_subtoken_trie", None)
+    state["_cache"] = collections.OrderedDict()
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    if "_subtoken_string_to_id" in state:
+      self._init_subtoken_trie()
+
   @property
   def vocab_size(self):
     """The subtoken vocabulary size."""
     return len(self._all_subtoken_strings)
 
+  def cache_info(self):
+    """Returns the hit/miss statistics of the token -> subtoken ids cache."""
+    return SubtokenCacheInfo(self._cache_hits, self._cache_misses,
+                             self._cache_size, len(self._cache))
+
+  def _clear_cache(self):
+    self._cache = collections.OrderedDict()
+    self._cache_hits = 0
+    self._cache_misses = 0
+
   def _tokens_to_subtoken_ids(self, tokens):
     """Converts a list of tokens to a list of subtoken ids.
 
@@ -462,11 +593,29 @@ class SubwordTextEncoder(TextEncoder):
     Returns:
       a list of integers in the range [0, vocab_size)
     """
+    if not self._cache_size:
+      ret = []
+      for token in tokens:
+        ret.extend(
+            self._escaped_token_to_subtoken_ids(
+                _escape_token(token, self._alphabet)))
+      return ret
+
     ret = []
+    cache = self._cache
     for token in tokens:
-      ret.extend(
-          self._escaped_token_to_subtoken_ids(
-              _escape_token(token, self._alphabet)))
+      subtoken_ids = cache.pop(token, None)
+      if subtoken_ids is None:
+        self._cache_misses += 1
+        subtoken_ids = self._escaped_token_to_subtoken_ids(
+            _escape_token(token, self._alphabet))
+        if len(cache) >= self._cache_size:
+          cache.popitem(last=False)
+      else:
+        self._cache_hits += 1
+      # (Re-)inserting marks the token as most recently used.
+      cache[token] = subtoken_ids
+      ret.extend(subtoken_ids)
     return ret
 
   def _subtoken_ids_to_tokens(self, subtokens):
@@ -496,26 +645,11 @@ class SubwordTextEncoder(TextEncoder):
     Returns:
       A list of subtokens as unicode strings.
     """
-    # NOTE: This algorithm is greedy; it won't necessarily produce the "best"
-    # list of subtokens.
     ret = []
     start = 0
-    token_len = len(escaped_token)
-    while start < token_len:
-      for end in xrange(
-          min(token_len, start + self._max_subtoken_len), start, -1):
-        subtoken = escaped_token[start:end]
-        if subtoken in self._subtoken_string_to_id:
-          ret.append(subtoken)
-          start = end
-          break
-
-      else:  # Did not break
-        # If there is no possible encoding of the escaped token then one of the
-        # characters in the token is not in the alphabet. This should be
-        # impossible and would be indicative of a bug.
-        assert False, "Token substring not found in subtoken vocabulary."
-
+    for end, _ in self._escaped_token_to_subtoken_spans(escaped_token):
+      ret.append(escaped_token[start:end])
+      start = end
     return ret
 
   def _escaped_token_to_subtoken_ids(self, escaped_token):
@@ -527,21 +661,72 @@ class SubwordTextEncoder(TextEncoder):
       A list of subtoken IDs as integers.
     """
     return [
-        self._subtoken_string_to_id[subtoken]
-        for subtoken in self._escaped_token_to_subtoken_strings(escaped_token)
+        subtoken_id for _, subtoken_id in
+        self._escaped_token_to_subtoken_spans(escaped_token)
     ]
 
+  def _escaped_token_to_subtoken_spans(self, escaped_token):
+    """Greedily segments an escaped token by walking the subtoken trie.
+
+    Args:
+      escaped_token: An escaped token as a unicode string.
+    Returns:
+      A list of (end, subtoken_id) pairs, one per subtoken, where end is the
+      position in escaped_token at which the subtoken ends.
+    """
+    # NOTE: This algorithm is greedy; it won't necessarily produce the "best"
+    # list of subtokens.
+    ret = []
+    start = 0
+    token_len = len(escaped_token)
+    trie = self._subtoken_trie
+    while start < token_len:
+      # Most tokens (or their remainders) are subtokens themselves, and then
+      # they are the longest match.
+      if token_len - start <= self._max_subtoken_len:
+        subtoken_id = self._subtoken_string_to_id.get(escaped_token[start:])
+        if subtoken_id is not None:
+          ret.append((token_len, subtoken_id))
+          break
+
+      # Otherwise follow the trie as far as the token allows, remembering the
+      # longest prefix that is a complete subtoken.
+      node = trie
+      end = subtoken_id = None
+      pos = start
+      for c in escaped_token[start:start + self._max_subtoken_len]:
+        node = node.get(c)
+        if node is None:
+          break
+        pos += 1
+        if _TRIE_ID in node:
+          end, subtoken_id = pos, node[_TRIE_ID]
+
+      if end is None:
+        # If there is no possible encoding of the escaped token then one of the
+        # characters in the token is not in the alphabet. This should be
+        # impossible and would be indicative of a bug.
+        assert False, "Token substring not found in subtoken vocabulary."
+
+      ret.append((end, subtoken_id))
+      start = end
+
+    return ret
+
   @classmethod
   def build_to_target_size(cls,
                            target_size,
                            token_counts,
                            min_val,
                            max_val,
-                           num_iterations=4):
+                           num_iterations=4,
+                           num_workers=1):
     """Builds a SubwordTextEncoder that has `vocab_size` near `target_size`.
 
     Uses simple recursive binary search to find a minimum token count that most
-    closely matches the `target_size`.
+    closely matches the `target_size`. The escaped tokens and the candidate
+    subtoken counts of the first refinement iteration do not depend on the
+    minimum token count, so they are computed once and shared by all probes.
 
     Args:
       target_size: Desired vocab_size to approximate.
@@ -549,6 +734,8 @@ class SubwordTextEncoder(TextEncoder):
       min_val: An integer; lower bound for the minimum token count.
       max_val: An integer; upper bound for the minimum token count.
       num_iterations: An integer; how many iterations of refinement.
+      num_workers: An integer; number of processes counting candidate
+        subtokens.
 
     Returns:
       A SubwordTextEncoder instance.
@@ -562,13 +749,16 @@ class SubwordTextEncoder(TextEncoder):
     if target_size < 1:
       raise ValueError("Target size must be positive.")
 
+    counter = _CandidateSubtokenCounter(token_counts, NUM_RESERVED_TOKENS,
+                                        num_workers)
+
     def bisect(min_val, max_val):
       """Bisection to find the right size."""
       present_count = (max_val + min_val) // 2
       tf.logging.info("Trying min_count %d" % present_count)
       subtokenizer = cls()
-      subtokenizer.build_from_token_counts(token_counts, present_count,
-                                           num_iterations)
+      subtokenizer._build_from_counter(counter, present_count, num_iterations,
+                                       NUM_RESERVED_TOKENS)
 
       # Being within 1% of the target size is ok.
       is_ok = abs(subtokenizer.vocab_size - target_size) * 100 < target_size
@@ -589,13 +779,17 @@ class SubwordTextEncoder(TextEncoder):
         return other_subtokenizer
       return subtokenizer
 
-    return bisect(min_val, max_val)
+    try:
+      return bisect(min_val, max_val)
+    finally:
+      counter.close()
 
   def build_from_token_counts(self,
                               token_counts,
                               min_count,
                               num_iterations=4,
-                              num_reserved_ids=NUM_RESERVED_TOKENS):
+                              num_reserved_ids=NUM_RESERVED_TOKENS,
+                              num_workers=1):
     """Train a SubwordTextEncoder based on a dictionary of word counts.
 
     Args:
@@ -603,23 +797,26 @@ class SubwordTextEncoder(TextEncoder):
       min_count: an integer - discard subtokens with lower counts.
       num_iterations: an integer.  how many iterations of refinement.
       num_reserved_ids: an integer.  how many ids to reserve for special tokens.
+      num_workers: an integer.  number of processes counting candidate
+        subtokens.
 
     Raises:
       ValueError: if reserved is not 0 or len(RESERVED_TOKENS). In this case, it
         is not clear what the space is being reserved for, or when it will be
         filled in.
     """
-    # Initialize the alphabet. Note, this must include reserved tokens or it can
-    # result in encoding failures.
-    if num_reserved_ids == NUM_RESERVED_TOKENS:
-      alphabet_tokens = chain(six.iterkeys(token_counts),
-                              [native_to_unicode(t) for t in RESERVED_TOKENS])
-    elif num_reserved_ids == 0:
-      alphabet_tokens = six.iterkeys(token_counts)
-    else:
-      raise ValueError("Unexpected value for reserved. What is being reserved?")
+    counter = _CandidateSubtokenCounter(token_counts, num_reserved_ids,
+                                        num_workers)
+    try:
+      self._build_from_counter(counter, min_count, num_iterations,
+                               num_reserved_ids)
+    finally:
+      counter.close()
 
-    self._init_alphabet_from_tokens(alphabet_tokens)
+  def _build_from_counter(self, counter, min_count, num_iterations,
+                          num_reserved_ids):
+    """Implements build_from_token_counts with a _CandidateSubtokenCounter."""
+    self._init_alphabet_from_tokens(counter.alphabet)
 
     # Bootstrap the initial list of subtokens with the characters from the
     # alphabet plus the escaping characters.
@@ -636,16 +833,10 @@ class SubwordTextEncoder(TextEncoder):
 
       # Collect all substrings of the encoded token that break along current
       # subtoken boundaries.
-      subtoken_counts = collections.defaultdict(int)
-      for token, count in six.iteritems(token_counts):
-        escaped_token = _escape_token(token, self._alphabet)
-        subtokens = self._escaped_token_to_subtoken_strings(escaped_token)
-        start = 0
-        for subtoken in subtokens:
-          for end in xrange(start + 1, len(escaped_token) + 1):
-            new_subtoken = escaped_token[start:end]
-            subtoken_counts[new_subtoken] += count
-          start += len(subtoken)
+      if i == 0:
+        subtoken_counts = counter.initial_counts(self)
+      else:
+        subtoken_counts = counter.count(self)
 
       # Array of sets of candidate subtoken strings, by length.
       len_to_subtoken_strings = []
@@ -710,6 +901,9 @@ class SubwordTextEncoder(TextEncoder):
       # insert copies of "" for each reserved count?
       raise ValueError("Unexpected value for reserved. What is being reserved?")
 
+    # Memoized segmentations are only valid for the previous vocabulary.
+    self._clear_cache()
+
     # we remember the maximum length of any subtoken to avoid having to
     # check arbitrarily long strings.
     self._max_subtoken_len = max([len(s) for s in subtoken_strings])
@@ -718,12 +912,29 @@ class SubwordTextEncoder(TextEncoder):
         for i, s in enumerate(subtoken_strings) if s
     }
 
+    self._init_subtoken_trie()
+
+  def _init_subtoken_trie(self):
+    """Builds a prefix trie over the subtoken strings.
+
+    The longest subtoken matching at a position of an escaped token is then
+    found in a single walk.
+    """
+    self._subtoken_trie = {}
+    for subtoken_string, subtoken_id in six.iteritems(
+        self._subtoken_string_to_id):
+      node = self._subtoken_trie
+      for c in subtoken_string:
+        node = node.setdefault(c, {})
+      node[_TRIE_ID] = subtoken_id
+
   def _init_alphabet_from_tokens(self, tokens):
     """Initialize alphabet from an iterable of token or subtoken strings."""
     # Include all characters from all tokens in the alphabet to guarantee that
     # any token can be encoded. Additionally, include all escaping characters.
     self._alphabet = {c for token in tokens for c in token}
     self._alphabet |= _ESCAPE_CHARS
+    self._clear_cache()
 
   def _load_from_file_object(self, f):
     """Load from a file object.
@@ -755,3 +966,97 @@ class SubwordTextEncoder(TextEncoder):
     with tf.gfile.Open(filename, "w") as f:
       for subtoken_string in self._all_subtoken_strings:
         f.write("'" + unicode_to_native(subtoken_string) + "'\n")
+
+
+class _CandidateSubtokenCounter(object):
+  """Counts candidate subtokens for SubwordTextEncoder builds.
+
+  A candidate is a substring of an escaped token that starts at a subtoken
+  boundary of the token's current segmentation. With num_workers > 1 the
+  tokens are sharded over a process pool and the per-shard counts are summed.
+  The escaped tokens and the counts for the alphabet-only vocabulary of the
+  first iteration are computed once and reused by every build.
+  """
+
+  def __init__(self, token_counts, num_reserved_ids, num_workers=1):
+    # Initialize the alphabet. Note, this must include reserved tokens or it
+    # can result in encoding failures.
+    if num_reserved_ids == NUM_RESERVED_TOKENS:
+      alphabet_tokens = chain(six.iterkeys(token_counts),
+                              [native_to_unicode(t) for t in RESERVED_TOKENS])
+    elif num_reserved_ids == 0:
+      alphabet_tokens = six.iterkeys(token_counts)
+    else:
+      raise ValueError("Unexpected value for reserved. What is being reserved?")
+    alphabet = {c for token in alphabet_tokens for c in token}
+    alphabet |= _ESCAPE_CHARS
+    self.alphabet = alphabet
+
+    self._escaped_token_counts = [
+        (_escape_token(token, alphabet), count)
+        for token, count in six.iteritems(token_counts)
+    ]
+    self._initial_counts = None
+
+    num_workers = min(num_workers,
+                      len(self._escaped_token_counts) // _MIN_TOKENS_PER_WORKER)
+    self._num_workers = num_workers
+    self._pool = None
+    if num_workers > 1:
+      self._pool = multiprocessing.Pool(
+          num_workers, initializer=_init_counting_worker,
+          initargs=(self._escaped_token_counts,))
+
+  def initial_counts(self, encoder):
+    """Counts for the alphabet-only vocabulary; computed once, then copied."""
+    if self._initial_counts is None:
+      self._initial_counts = self.count(encoder)
+    return collections.defaultdict(int, self._initial_counts)
+
+  def count(self, encoder):
+    """Counts candidate subtokens for the current vocabulary of encoder."""
+    if self._pool is None:
+      return _count_candidate_subtokens(encoder, self._escaped_token_counts)
+    shard_counts = self._pool.map(
+        _count_candidate_subtokens_shard,
+        [(encoder, shard, self._num_workers)
+         for shard in xrange(self._num_workers)])
+    subtoken_counts = shard_counts[0]
+    for counts in shard_counts[1:]:
+      for subtoken_string, count in six.iteritems(counts):
+        subtoken_counts[subtoken_string] += count
+    return subtoken_counts
+
+  def close(self):
+    if self._pool is not None:
+      self._pool.terminate()
+      self._pool.join()
+      self._pool = None
+
+
+def _count_candidate_subtokens(encoder, escaped_token_counts):
+  """Counts the candidate subtokens of escaped tokens, see above."""
+  subtoken_counts = collections.defaultdict(int)
+  for escaped_token, count in escaped_token_counts:
+    token_len = len(escaped_token)
+    start = 0
+    for end, _ in encoder._escaped_token_to_subtoken_spans(escaped_token):  # pylint: disable=protected-access
+      for new_end in xrange(start + 1, token_len + 1):
+        subtoken_counts[escaped_token[start:new_end]] += count
+      start = end
+  return subtoken_counts
+
+
+# Escaped token counts of a _CandidateSubtokenCounter pool worker.
+_counting_worker_tokens = []
+
+
+def _init_counting_worker(escaped_token_counts):
+  global _counting_worker_tokens
+  _counting_worker_tokens = escaped_token_counts
+
+
+def _count_candidate_subtokens_shard(args):
+  encoder, shard, num_shards = args
+  return _count_candidate_subtokens(
+      encoder, _counting_worker_tokens[shard::num_shards])
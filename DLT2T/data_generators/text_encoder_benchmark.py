@@ -0,0 +1,118 @@
+# coding=utf-8
+# Copyright 2017 The DLT2T Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+r"""Microbenchmark for SubwordTextEncoder segmentation.
+
+Compares the trie-based longest-match segmentation of SubwordTextEncoder with
+the previous algorithm, which tried every end position from the maximum
+subtoken length down and looked each substring up in a dict.
+
+Example usage:
+
+python data_generators/text_encoder_benchmark.py \
+    --corpus_filepattern=$DATA_DIR/parallel_ende.* \
+    --vocab_filename=$DATA_DIR/vocab.endefr.32768 \
+    --logtostderr
+
+By default the bundled test_data corpora are used, with a vocabulary built
+from them.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import timeit
+
+# Dependency imports
+
+from six.moves import xrange  # pylint: disable=redefined-builtin
+from DLT2T.data_generators import text_encoder
+from DLT2T.data_generators import tokenizer
+
+import tensorflow as tf
+
+tf.flags.DEFINE_string('corpus_filepattern',
+                       os.path.join(os.path.dirname(__file__), 'test_data',
+                                    'corpus-*.txt'),
+                       'Corpus of one or more text files to encode.')
+tf.flags.DEFINE_string('vocab_filename', '',
+                       'SubwordTextEncoder vocab file. If empty, a vocab is '
+                       'built from the corpus.')
+tf.flags.DEFINE_integer('min_count', 1,
+                        'Minimum subtoken count when building the vocab.')
+tf.flags.DEFINE_integer('corpus_max_lines', 100000,
+                        'How many lines of corpus to read')
+tf.flags.DEFINE_integer('num_repeats', 5,
+                        'Timings are the best of this many runs.')
+FLAGS = tf.flags.FLAGS
+
+
+def linear_escaped_token_to_subtoken_ids(encoder, escaped_token):
+  """The segmentation algorithm SubwordTextEncoder used before the trie."""
+  ret = []
+  start = 0
+  token_len = len(escaped_token)
+  while start < token_len:
+    for end in xrange(
+        min(token_len, start + encoder._max_subtoken_len), start, -1):  # pylint: disable=protected-access
+      subtoken = escaped_token[start:end]
+      if subtoken in encoder._subtoken_string_to_id:  # pylint: disable=protected-access
+        ret.append(encoder._subtoken_string_to_id[subtoken])  # pylint: disable=protected-access
+        start = end
+        break
+    else:
+      assert False, 'Token substring not found in subtoken vocabulary.'
+  return ret
+
+
+def main(unused_argv):
+  lines = list(tokenizer._read_filepattern(  # pylint: disable=protected-access
+      FLAGS.corpus_filepattern, max_lines=FLAGS.corpus_max_lines))
+  if FLAGS.vocab_filename:
+    encoder = text_encoder.SubwordTextEncoder(FLAGS.vocab_filename)
+  else:
+    token_counts = tokenizer.corpus_token_counts(FLAGS.corpus_filepattern,
+                                                 FLAGS.corpus_max_lines)
+    encoder = text_encoder.SubwordTextEncoder()
+    encoder.build_from_token_counts(token_counts, FLAGS.min_count)
+
+  escaped_tokens = [
+      text_encoder._escape_token(token, encoder._alphabet)  # pylint: disable=protected-access
+      for line in lines
+      for token in tokenizer.encode(text_encoder.native_to_unicode(line))
+  ]
+
+  def trie():
+    return [encoder._escaped_token_to_subtoken_ids(t)  # pylint: disable=protected-access
+            for t in escaped_tokens]
+
+  def linear():
+    return [linear_escaped_token_to_subtoken_ids(encoder, t)
+            for t in escaped_tokens]
+
+  if trie() != linear():
+    raise ValueError('Trie and linear segmentations differ.')
+
+  trie_secs = min(timeit.repeat(trie, number=1, repeat=FLAGS.num_repeats))
+  linear_secs = min(timeit.repeat(linear, number=1, repeat=FLAGS.num_repeats))
+  tf.logging.info('Encoded %d tokens with a vocab of %d subtokens.',
+                  len(escaped_tokens), encoder.vocab_size)
+  tf.logging.info('linear: %.4fs, trie: %.4fs, speedup: %.2fx', linear_secs,
+                  trie_secs, linear_secs / max(trie_secs, 1e-9))
+
+
+if __name__ == '__main__':
+  tf.app.run()
@@ -50,6 +50,9 @@ tf.flags.DEFINE_integer('corpus_max_lines', 10000,
                         'How many lines of corpus to read')
 tf.flags.DEFINE_integer('num_iterations', 4, 'Number of iterations')
 tf.flags.DEFINE_bool('split_on_newlines', True, 'Break corpus into lines.')
+tf.flags.DEFINE_integer('num_workers', 1,
+                        'Number of processes counting corpus tokens and '
+                        'candidate subtokens.')
 FLAGS = tf.flags.FLAGS
 
 
@@ -62,7 +65,8 @@ def main(unused_argv):
     token_counts = tokenizer.corpus_token_counts(
         FLAGS.corpus_filepattern,
         FLAGS.corpus_max_lines,
-        split_on_newlines=FLAGS.split_on_newlines)
+        split_on_newlines=FLAGS.split_on_newlines,
+        num_workers=FLAGS.num_workers)
 
   elif FLAGS.vocab_filepattern:
     token_counts = tokenizer.vocab_token_counts(FLAGS.vocab_filepattern,
@@ -74,7 +78,8 @@ def main(unused_argv):
 
   encoder = text_encoder.SubwordTextEncoder()
   encoder.build_from_token_counts(token_counts, FLAGS.min_count,
-                                  FLAGS.num_iterations)
+                                  FLAGS.num_iterations,
+                                  num_workers=FLAGS.num_workers)
   encoder.store_to_file(FLAGS.output_filename)
 
 
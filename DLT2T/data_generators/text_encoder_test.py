@@ -22,6 +22,8 @@ from __future__ import unicode_literals
 
 import collections
 import io
+import multiprocessing
+import multiprocessing.pool
 import os
 import shutil
 
@@ -30,6 +32,7 @@ import mock
 import six
 
 from DLT2T.data_generators import text_encoder
+from DLT2T.data_generators import tokenizer
 import tensorflow as tf
 
 
@@ -61,6 +64,47 @@ class EscapeUnescapeTokenTest(tf.test.TestCase):
         "Foo! Bar.\nunder_score back\\slash", unescaped)
 
 
+class BatchEncodeDecodeTest(tf.test.TestCase):
+
+  def test_ids_to_ragged(self):
+    values, offsets = text_encoder.ids_to_ragged([[3, 4], [], [5]])
+    self.assertAllEqual([3, 4, 5], values)
+    self.assertAllEqual([0, 2, 2, 3], offsets)
+    self.assertEqual([[3, 4], [], [5]],
+                     [list(ids) for ids in
+                      text_encoder.ragged_to_ids(values, offsets)])
+
+  def test_byte_text_encoder_batch(self):
+    encoder = text_encoder.ByteTextEncoder()
+    strings = ["hello", "", "w\xf6rld"]
+    values, offsets = encoder.encode_batch(strings)
+    for i, s in enumerate(strings):
+      self.assertEqual(encoder.encode(s),
+                       list(values[offsets[i]:offsets[i + 1]]))
+    self.assertEqual(strings, encoder.decode_batch(values, offsets))
+
+  def test_subword_text_encoder_batch_in_pools(self):
+    corpus = "the quick brown fox jumps over the lazy dog"
+    token_counts = collections.Counter(corpus.split(" "))
+    encoder = text_encoder.SubwordTextEncoder.build_to_target_size(
+        100, token_counts, 2, 10)
+    strings = ["the lazy fox", "quick brown dogs", "", "Over THE fox!"] * 500
+    expected = [encoder.encode(s) for s in strings]
+
+    for pool in [None, multiprocessing.pool.ThreadPool(2),
+                 multiprocessing.Pool(2)]:
+      values, offsets = encoder.encode_batch(strings, pool=pool)
+      self.assertEqual(
+          expected,
+          [list(ids) for ids in text_encoder.ragged_to_ids(values, offsets)])
+      self.assertEqual(strings,
+                       encoder.decode_batch(values, offsets, pool=pool))
+      self.assertEqual(strings, encoder.decode_batch(expected, pool=pool))
+      if pool is not None:
+        pool.close()
+        pool.join()
+
+
 class TokenTextEncoderTest(tf.test.TestCase):
 
   @classmethod
@@ -190,6 +234,61 @@ class SubwordTextEncoderTest(tf.test.TestCase):
     encoded_str = "".join(encoder._all_subtoken_strings[i] for i in encoded)
     self.assertIn("\\84;", encoded_str)
 
+  @mock.patch.object(text_encoder, "_MIN_TOKENS_PER_WORKER", new=1)
+  def test_build_in_parallel(self):
+    corpus = (
+        "This is a corpus of text that provides a bunch of tokens from which "
+        "to build a vocabulary. It will be used when strings are encoded "
+        "with a TextEncoder subclass. The encoder was coded by a coder.")
+    token_counts = collections.Counter(corpus.split(" "))
+
+    encoder = text_encoder.SubwordTextEncoder.build_to_target_size(
+        100, token_counts, 2, 10)
+    parallel_encoder = text_encoder.SubwordTextEncoder.build_to_target_size(
+        100, token_counts, 2, 10, num_workers=3)
+
+    self.assertEqual(encoder._all_subtoken_strings,
+                     parallel_encoder._all_subtoken_strings)
+
+  def test_longest_match_segmentation(self):
+    encoder = text_encoder.SubwordTextEncoder()
+    encoder._init_subtokens_from_list(["a", "b", "c", "_", "ab", "abcd"])
+
+    self.assertEqual(["ab", "c", "ab", "_"],
+                     encoder._escaped_token_to_subtoken_strings("abcab_"))
+    self.assertEqual(["abcd", "_"],
+                     encoder._escaped_token_to_subtoken_strings("abcd_"))
+    self.assertEqual([4, 2, 5, 3],
+                     encoder._escaped_token_to_subtoken_ids("abcabcd_"))
+
+  def test_encode_cache(self):
+    corpus = "the quick brown fox jumps over the lazy dog"
+    token_counts = collections.Counter(corpus.split(" "))
+    encoder = text_encoder.SubwordTextEncoder.build_to_target_size(
+        100, token_counts, 2, 10)
+    filename = os.path.join(self.test_temp_dir, "cache.voc")
+    encoder.store_to_file(filename)
+    cached = text_encoder.SubwordTextEncoder(filename, cache_size=3)
+    uncached = text_encoder.SubwordTextEncoder(filename, cache_size=0)
+
+    original = "the dog jumps over the quick fox, the lazy dog"
+    self.assertEqual(uncached.encode(original), cached.encode(original))
+    self.assertEqual(uncached.encode(original), cached.encode(original))
+
+    info = cached.cache_info()
+    self.assertEqual(3, info.maxsize)
+    self.assertEqual(3, info.currsize)
+    self.assertEqual(2 * len(tokenizer.encode(original)),
+                     info.hits + info.misses)
+    self.assertGreater(info.hits, 0)
+    self.assertEqual((0, 0, 0, 0), uncached.cache_info())
+
+    # Least recently used tokens are evicted first.
+    cached.encode("a b c d")
+    self.assertEqual(["b", "c", "d"], list(cached._cache))
+    cached.encode("b e")
+    self.assertEqual(["d", "b", "e"], list(cached._cache))
+
   @mock.patch.object(text_encoder, "_ESCAPE_CHARS", new=set("\\_;13579"))
   def test_raises_exception_when_not_encodable(self):
     corpus = "the quick brown fox jumps over the lazy dog"
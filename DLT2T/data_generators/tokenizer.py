@@ -45,7 +45,10 @@ from __future__ import division
 from __future__ import print_function
 
 import collections
+import itertools
+import multiprocessing
 import sys
+import time
 import unicodedata
 
 # Dependency imports
@@ -57,6 +60,13 @@ import tensorflow as tf
 # Conversion between Unicode and UTF-8, if required (on Python2)
 _native_to_unicode = (lambda s: s.decode("utf-8")) if six.PY2 else (lambda s: s)
 
+# Size of the byte ranges that corpus_token_counts reads in parallel.
+_BYTES_PER_RANGE = 2**24
+
+# Strings of a generator that a generator_token_counts worker tokenizes at a
+# time.
+_STRINGS_PER_CHUNK = 100000
+
 
 # This set contains all letter and number characters.
 _ALPHANUMERIC_CHAR_SET = set(
@@ -148,26 +158,184 @@ def _read_filepattern(filepattern, max_lines=None, split_on_newlines=True):
 
 
 def corpus_token_counts(
-    text_filepattern, corpus_max_lines, split_on_newlines=True):
+    text_filepattern, corpus_max_lines, split_on_newlines=True, num_workers=1):
   """Read the corpus and compute a dictionary of token counts.
 
+  With num_workers > 1 and split_on_newlines, every file is split into byte
+  ranges that are read and tokenized in a process pool, and the per-range
+  counts are merged with a tree reduction.
+
   Args:
     text_filepattern: A pattern matching one or more files.
     corpus_max_lines: An integer; maximum total lines to read.
     split_on_newlines: A boolean. If true, then split files by lines and strip
         leading and trailing whitespace from each line. Otherwise, treat each
         file as a single string.
+    num_workers: An integer; number of processes reading and tokenizing.
 
   Returns:
     a dictionary mapping token to count.
   """
+  start_time = time.time()
+  if num_workers > 1 and split_on_newlines:
+    counts, num_lines = _parallel_corpus_token_counts(
+        text_filepattern, corpus_max_lines, num_workers)
+  else:
+    counts = collections.Counter()
+    num_lines = 0
+    for doc in _read_filepattern(
+        text_filepattern,
+        max_lines=corpus_max_lines,
+        split_on_newlines=split_on_newlines):
+      counts.update(encode(_native_to_unicode(doc)))
+      num_lines += 1
+
+  elapsed = max(time.time() - start_time, 1e-6)
+  tf.logging.info("Counted tokens in %d %s (%.0f per sec).", num_lines,
+                  "lines" if split_on_newlines else "documents",
+                  num_lines / elapsed)
+  return counts
+
+
+def _parallel_corpus_token_counts(text_filepattern, max_lines, num_workers):
+  """Implements corpus_token_counts for num_workers > 1.
+
+  Args:
+    text_filepattern: A pattern matching one or more files.
+    max_lines: If set, only count the first max_lines lines, in the same order
+        as _read_filepattern.
+    num_workers: An integer; number of processes.
+
+  Returns:
+    a (Counter, number of lines read) tuple.
+  """
+  ranges = []
+  for filename in sorted(tf.gfile.Glob(text_filepattern)):
+    size = tf.gfile.Stat(filename).length
+    for start in xrange(0, size, _BYTES_PER_RANGE):
+      ranges.append((filename, start, min(start + _BYTES_PER_RANGE, size),
+                     None))
+
+  pool = multiprocessing.Pool(num_workers)
+  try:
+    if max_lines:
+      # Consume the ranges in corpus order until max_lines lines are counted;
+      # the ranges after them are dropped with the pool. The range holding
+      # the last line is counted again up to it.
+      results = []
+      num_lines = 0
+      for i, (counts, range_lines) in enumerate(
+          pool.imap(_range_token_counts, ranges)):
+        if num_lines + range_lines > max_lines:
+          filename, start, end, _ = ranges[i]
+          counts, range_lines = _range_token_counts(
+              (filename, start, end, max_lines - num_lines))
+        results.append((counts, range_lines))
+        num_lines += range_lines
+        if num_lines >= max_lines:
+          break
+    else:
+      results = pool.map(_range_token_counts, ranges)
+      num_lines = sum(n for _, n in results)
+    counts = _tree_reduce_counts(pool, [c for c, _ in results])
+  finally:
+    pool.terminate()
+    pool.join()
+  return counts, num_lines
+
+
+def _read_range_lines(filename, start, end, max_lines=None):
+  """Yields the lines of a file that start in the byte range [start, end)."""
+  with tf.gfile.Open(filename, "rb") as f:
+    if start > 0:
+      # Skip the line started by the previous range, if any.
+      f.seek(start - 1)
+      f.readline()
+    pos = f.tell()
+    num_lines = 0
+    while pos < end and (max_lines is None or num_lines < max_lines):
+      line = f.readline()
+      if not line:
+        return
+      pos += len(line)
+      num_lines += 1
+      yield line
+
+
+def _range_token_counts(args):
+  """Tokenizes a byte range of a file; returns a (Counter, lines) tuple."""
+  filename, start, end, max_lines = args
   counts = collections.Counter()
-  for doc in _read_filepattern(
-      text_filepattern,
-      max_lines=corpus_max_lines,
-      split_on_newlines=split_on_newlines):
-    counts.update(encode(_native_to_unicode(doc)))
+  num_lines = 0
+  try:
+    for line in _read_range_lines(filename, start, end, max_lines):
+      counts.update(encode(line.decode("utf-8").strip()))
+      num_lines += 1
+  except tf.errors.OpError as e:
+    # OpErrors cannot be unpickled by the pool, which would then hang.
+    raise IOError("Failed to read %s: %s" % (filename, e.message))
+  return counts, num_lines
+
+
+def _merge_counts(pair):
+  counts, other = pair
+  counts.update(other)
+  return counts
+
 
+def _tree_reduce_counts(pool, counts_list):
+  """Sums a list of Counters by merging pairs of them in parallel."""
+  if not counts_list:
+    return collections.Counter()
+  while len(counts_list) > 1:
+    pairs = list(zip(counts_list[0::2], counts_list[1::2]))
+    merged = pool.map(_merge_counts, pairs)
+    if len(counts_list) % 2:
+      merged.append(counts_list[-1])
+    counts_list = merged
+  return counts_list[0]
+
+
+def generator_token_counts(generator, num_workers=1):
+  """Computes a dictionary of token counts of the strings of a generator.
+
+  With num_workers > 1, chunks of the strings are tokenized in a process pool
+  while the generator runs, and the counts are merged with a tree reduction.
+
+  Args:
+    generator: yields the strings to tokenize.
+    num_workers: An integer; number of processes tokenizing.
+
+  Returns:
+    a dictionary mapping token to count.
+  """
+  if num_workers <= 1:
+    return _chunk_token_counts(generator)
+  pool = multiprocessing.Pool(num_workers)
+  try:
+    # Chunks are submitted as the generator yields them, at most two per
+    # worker ahead of the results.
+    pending = collections.deque()
+    chunk_counts = []
+    while True:
+      chunk = list(itertools.islice(generator, _STRINGS_PER_CHUNK))
+      if not chunk:
+        break
+      pending.append(pool.apply_async(_chunk_token_counts, (chunk,)))
+      if len(pending) >= 2 * num_workers:
+        chunk_counts.append(pending.popleft().get())
+    chunk_counts.extend(result.get() for result in pending)
+    counts = _tree_reduce_counts(pool, chunk_counts)
+  finally:
+    pool.terminate()
+    pool.join()
+  return counts
+
+
+def _chunk_token_counts(strings):
+  counts = collections.Counter()
+  for string in strings:
+    counts.update(encode(_native_to_unicode(string)))
   return counts
 
 
@@ -25,6 +25,7 @@ import random
 
 # Dependency imports
 
+import mock
 import six
 from six.moves import xrange  # pylint: disable=redefined-builtin
 from DLT2T.data_generators import tokenizer
@@ -116,6 +117,36 @@ class TestTokenCounts(tf.test.TestCase):
         u".\n": 1
     }, token_counts)
 
+  def test_corpus_token_counts_parallel(self):
+    with mock.patch.object(tokenizer, "_BYTES_PER_RANGE", 16):
+      for max_lines in [0, 5, 7]:
+        serial_counts = tokenizer.corpus_token_counts(
+            self.corpus_path, corpus_max_lines=max_lines)
+        parallel_counts = tokenizer.corpus_token_counts(
+            self.corpus_path, corpus_max_lines=max_lines, num_workers=2)
+        self.assertEqual(serial_counts, parallel_counts)
+
+  def test_corpus_token_counts_parallel_stops_at_max_lines(self):
+    tmp_dir = self.get_temp_dir()
+    with open(os.path.join(tmp_dir, "stop-a.txt"), "w") as f:
+      f.write("one line\nand another\n")
+    # Reading a directory raises, so the results of its ranges must not be
+    # consumed once the first max_lines lines are counted.
+    tf.gfile.MakeDirs(os.path.join(tmp_dir, "stop-b.txt"))
+    with mock.patch.object(tokenizer, "_BYTES_PER_RANGE", 4):
+      token_counts = tokenizer.corpus_token_counts(
+          os.path.join(tmp_dir, "stop-*.txt"), corpus_max_lines=2,
+          num_workers=2)
+    self.assertEqual({u"one": 1, u"line": 1, u"and": 1, u"another": 1},
+                     token_counts)
+
+  def test_generator_token_counts(self):
+    lines = [u"I shot an elephant", u"in my pajamas."] * 5
+    with mock.patch.object(tokenizer, "_STRINGS_PER_CHUNK", 3):
+      self.assertEqual(
+          tokenizer.generator_token_counts(iter(lines)),
+          tokenizer.generator_token_counts(iter(lines), num_workers=2))
+
   def test_vocab_token_counts(self):
     token_counts = tokenizer.vocab_token_counts(self.vocab_path, 0)
 
@@ -1718,6 +1718,8 @@ def multihead_attention(query_antecedent,
                         gap_size=0,
                         num_memory_blocks=2,
                         name=None,
+                        decode_loop_step=None,
+                        finished=None,
                         **kwargs):
   """Multihead scaled-dot-product attention with input/output transformations.
 
@@ -1756,6 +1758,16 @@ def multihead_attention(query_antecedent,
     num_memory_blocks: Integer option to indicate how many memory blocks to look
       at.
     name: an optional string
+    decode_loop_step: An integer scalar Tensor, the step of the decoding loop.
+      If given, the 'k' and 'v' of the cache are TensorArrays of
+      max_decode_length [batch_size, key/value_channels] positions, and the
+      keys and values of this step are written at position decode_loop_step
+      instead of being concatenated. Attention then reads the positions up
+      to decode_loop_step, which the bias must cover as with a growing cache,
+      with dot_product_attention_time_major.
+    finished: An optional boolean Tensor [batch_size] of the decoding rows
+      that are done. Their rows of the cache get zeros instead of the keys and
+      values of this step.
     **kwargs (dict): Params for the attention function
 
   Caching:
@@ -1801,8 +1813,19 @@ def multihead_attention(query_antecedent,
       if bias is None:
         raise ValueError("Bias required for caching. See function docstring "
                          "for details.")
-      k = cache["k"] = tf.concat([cache["k"], k], axis=1)
-      v = cache["v"] = tf.concat([cache["v"], v], axis=1)
+      if finished is not None:
+        k = tf.where(finished, tf.zeros_like(k), k)
+        v = tf.where(finished, tf.zeros_like(v), v)
+      if decode_loop_step is None:
+        k = cache["k"] = tf.concat([cache["k"], k], axis=1)
+        v = cache["v"] = tf.concat([cache["v"], v], axis=1)
+      else:
+        cache["k"], k = write_to_cache(cache["k"], k, decode_loop_step)
+        cache["v"], v = write_to_cache(cache["v"], v, decode_loop_step)
+        x = dot_product_attention_time_major(q, k, v, bias, num_heads,
+                                             dropout_rate)
+        return common_layers.conv1d(x, output_depth, 1,
+                                    name="output_transform")
 
     q = split_heads(q, num_heads)
     k = split_heads(k, num_heads)
@@ -1843,6 +1866,70 @@ def multihead_attention(query_antecedent,
     return x
 
 
+def write_to_cache(cache_array, x, position):
+  """Writes x at a position of a preallocated cache.
+
+  The cache is a TensorArray of max_length positions: writing a position
+  neither copies nor reads the others, and only the positions written so far
+  are read back, so the cost of a decoding step does not depend on
+  max_length.
+
+  Args:
+    cache_array: a TensorArray of max_length [batch, channels] Tensors,
+      written up to position - 1, with clear_after_read=False.
+    x: a Tensor with shape [batch, 1, channels]
+    position: an integer scalar Tensor
+
+  Returns:
+    cache_array: the TensorArray, with x written at position.
+    prefix: a Tensor with shape [position + 1, batch, channels], the cached
+      positions up to position, time-major.
+  """
+  cache_array = cache_array.write(position, tf.squeeze(x, axis=1))
+  return cache_array, cache_array.gather(tf.range(position + 1))
+
+
+def dot_product_attention_time_major(q, k, v, bias, num_heads,
+                                     dropout_rate=0.0, name=None):
+  """Multihead dot-product attention of one position over time-major memory.
+
+  The keys and values are read in the layout write_to_cache returns them,
+  instead of being transposed by split_heads, which would copy the whole
+  memory at every decoding step.
+
+  Args:
+    q: a Tensor with shape [batch, 1, total_key_depth]
+    k: a Tensor with shape [length, batch, total_key_depth]
+    v: a Tensor with shape [length, batch, total_value_depth]
+    bias: bias Tensor broadcastable to [batch, num_heads, 1, length]
+    num_heads: an integer dividing total_key_depth and total_value_depth
+    dropout_rate: a floating point number
+    name: an optional string
+
+  Returns:
+    A Tensor with shape [batch, 1, total_value_depth].
+  """
+  with tf.variable_scope(
+      name, default_name="dot_product_attention_time_major",
+      values=[q, k, v]):
+    total_key_depth = q.get_shape().as_list()[-1]
+    total_value_depth = v.get_shape().as_list()[-1]
+    length, batch = tf.shape(k)[0], tf.shape(k)[1]
+    q = tf.reshape(q, [batch, num_heads, total_key_depth // num_heads])
+    q *= (total_key_depth // num_heads)**-0.5
+    k = tf.reshape(k, [length, batch, num_heads, total_key_depth // num_heads])
+    v = tf.reshape(v,
+                   [length, batch, num_heads, total_value_depth // num_heads])
+    # [length, batch, num_heads]
+    logits = tf.reduce_sum(k * q, axis=-1)
+    if bias is not None:
+      logits += tf.squeeze(tf.transpose(bias, [3, 0, 1, 2]), axis=3)
+    weights = tf.nn.softmax(logits, dim=0, name="attention_weights")
+    weights = tf.nn.dropout(weights, 1.0 - dropout_rate)
+    x = tf.reduce_sum(tf.expand_dims(weights, -1) * v, axis=0)
+    return tf.reshape(x, [batch, 1, total_value_depth])
+
+
 def multihead_attention_2d(query_antecedent,
                            memory_antecedent,
                            total_key_depth,
@@ -42,6 +42,51 @@ class CommonAttentionTest(tf.test.TestCase):
       res = session.run(a)
     self.assertEqual(res.shape, (5, 7, 12, 32))
 
+  def testDotProductAttentionTimeMajor(self):
+    batch, length, num_heads, depth = 3, 6, 4, 8
+    q = np.random.rand(batch, 1, num_heads * depth)
+    k = np.random.rand(batch, length, num_heads * depth)
+    v = np.random.rand(batch, length, num_heads * depth)
+    bias = np.random.rand(1, 1, 1, length)
+    with self.test_session() as session:
+      q_t, k_t, v_t, bias_t = [tf.constant(t, dtype=tf.float32)
+                               for t in (q, k, v, bias)]
+      a = common_attention.dot_product_attention_time_major(
+          q_t, tf.transpose(k_t, [1, 0, 2]), tf.transpose(v_t, [1, 0, 2]),
+          bias_t, num_heads)
+      b = common_attention.combine_heads(
+          common_attention.dot_product_attention(
+              common_attention.split_heads(q_t, num_heads) * depth**-0.5,
+              common_attention.split_heads(k_t, num_heads),
+              common_attention.split_heads(v_t, num_heads), bias_t))
+      res_a, res_b = session.run([a, b])
+    self.assertEqual(res_a.shape, (batch, 1, num_heads * depth))
+    self.assertAllClose(res_a, res_b)
+
+  def testMultiheadAttentionCacheSkipsFinishedRows(self):
+    batch, depth = 2, 8
+    x = np.random.rand(batch, 1, depth)
+    finished = np.array([True, False])
+    with self.test_session() as session:
+      caches = [
+          {"k": tf.zeros([batch, 0, depth]),
+           "v": tf.zeros([batch, 0, depth])},
+          {"k": tf.TensorArray(tf.float32, size=1, clear_after_read=False),
+           "v": tf.TensorArray(tf.float32, size=1, clear_after_read=False)}]
+      for name, cache, decode_loop_step in [("concat", caches[0], None),
+                                            ("preallocated", caches[1], 0)]:
+        common_attention.multihead_attention(
+            tf.constant(x, dtype=tf.float32), None,
+            tf.zeros([1, 1, 1, 1]), depth, depth, depth, 2, 0.0,
+            cache=cache, decode_loop_step=decode_loop_step,
+            finished=tf.constant(finished), name=name)
+      session.run(tf.global_variables_initializer())
+      concat_k, preallocated_k = session.run(
+          [caches[0]["k"], tf.transpose(caches[1]["k"].stack(), [1, 0, 2])])
+    for k in concat_k, preallocated_k:
+      self.assertAllEqual(np.zeros([1, depth]), k[0])
+      self.assertTrue(np.any(k[1]))
+
   def testMaskedLocalAttention1D(self):
     q = np.array([[[[1.0, 0.0, 0.0, 0.0], [1.0, 0.0, 0.0, 0.0],
                     [1.0, 0.0, 0.0, 0.0], [1.0, 0.0, 0.0, 0.0],
@@ -96,13 +96,17 @@ class SymbolModality(modality.Modality):
     else:
       return self.bottom_simple(x, "target_emb", reuse=None)
 
-  def top(self, body_output, _):
+  def top(self, body_output, _, shortlist=None):
     """Generate logits.
 
     Args:
       body_output: A Tensor with shape [batch, p0, p1, body_input_depth]
+      shortlist: An optional int32 Tensor [shortlist_size] of ids, see
+        utils/shortlist.py. At inference, the logits are only computed for
+        these rows of the softmax weights.
     Returns:
-      logits: A Tensor with shape  [batch, p0, p1, ?, vocab_size].
+      logits: A Tensor with shape  [batch, p0, p1, ?, vocab_size], or
+        [batch, p0, p1, ?, shortlist_size] over the ids of shortlist.
     """
     if self._model_hparams.shared_embedding_and_softmax_weights:
       scope_name = "shared"
@@ -118,11 +122,15 @@ class SymbolModality(modality.Modality):
         body_output = tf.expand_dims(body_output, 3)
         logits = common_layers.FactoredTensor(body_output, var)
       else:
+        vocab_size = self._vocab_size
+        if shortlist is not None:
+          var = tf.gather(var, shortlist)
+          vocab_size = tf.shape(shortlist)[0]
         shape = tf.shape(body_output)[:-1]
         body_output = tf.reshape(body_output, [-1, self._body_input_depth])
         logits = tf.matmul(body_output, var, transpose_b=True)
         logits = tf.reshape(
-            logits, tf.concat([shape, [1, self._vocab_size]], 0))
+            logits, tf.concat([shape, [1, vocab_size]], 0))
       return logits
 
 
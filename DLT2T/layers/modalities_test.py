@@ -122,6 +122,30 @@ class ModalityTest(tf.test.TestCase):
     self.assertEqual(res1.shape, (batch_size, length, height, 1, vocab_size))
     self.assertEqual(res2.shape, ())
 
+  def testSymbolModalityShortlist(self):
+    batch_size = 4
+    hidden_size = 9
+    vocab_size = 11
+    model_hparams = tf.contrib.training.HParams(
+        symbol_modality_num_shards=4,
+        hidden_size=hidden_size,
+        shared_embedding_and_softmax_weights=0,
+        factored_logits=0,
+        mode=tf.estimator.ModeKeys.PREDICT)
+    body_output = np.random.rand(batch_size, 1, 1, hidden_size)
+    shortlist = np.array([0, 1, 7, 3], dtype=np.int32)
+    m = modalities.SymbolModality(model_hparams, vocab_size)
+    with self.test_session() as session:
+      with tf.variable_scope("modality"):
+        logits = m.top(tf.to_float(body_output), None)
+      with tf.variable_scope("modality", reuse=True):
+        shortlist_logits = m.top(tf.to_float(body_output), None,
+                                 shortlist=tf.constant(shortlist))
+      session.run(tf.global_variables_initializer())
+      res1, res2 = session.run((logits, shortlist_logits))
+    self.assertEqual(res2.shape, (batch_size, 1, 1, 1, len(shortlist)))
+    self.assertAllClose(res1[..., shortlist], res2)
+
 
 if __name__ == "__main__":
   tf.test.main()
@@ -30,12 +30,15 @@ from six.moves import xrange  # pylint: disable=redefined-builtin
 from DLT2T.layers import common_attention
 from DLT2T.layers import common_hparams
 from DLT2T.layers import common_layers
+from DLT2T.utils import beam_search
 from DLT2T.utils import expert_utils
 from DLT2T.utils import registry
 from DLT2T.utils import t2t_model
 
 import tensorflow as tf
 
+from tensorflow.python.util import nest
+
 
 @registry.register_model
 class Transformer(t2t_model.T2TModel):
@@ -78,7 +81,9 @@ class Transformer(t2t_model.T2TModel):
       encoder_decoder_attention_bias,
       decoder_self_attention_bias,
       hparams,
-      cache=None):
+      cache=None,
+      decode_loop_step=None,
+      finished=None):
     """Decode Transformer outputs from encoder representation.
 
     Args:
@@ -93,6 +98,10 @@ class Transformer(t2t_model.T2TModel):
       hparams: hyperparmeters for model.
       cache: dict, containing tensors which are the results of previous
           attentions, used for fast decoding.
+      decode_loop_step: Step of the decoding loop if the cache is
+          preallocated, see common_attention.multihead_attention.
+      finished: Optional boolean [batch_size] of the rows that are done, whose
+          cache is not updated, see common_attention.multihead_attention.
 
     Returns:
       Final decoder representation. [batch_size, decoder_length, hidden_dim]
@@ -106,7 +115,9 @@ class Transformer(t2t_model.T2TModel):
         decoder_self_attention_bias,
         encoder_decoder_attention_bias,
         hparams,
-        cache=cache)
+        cache=cache,
+        decode_loop_step=decode_loop_step,
+        finished=finished)
 
     # Expand since t2t expects 4d tensors.
     return tf.expand_dims(decoder_output, axis=2)
@@ -149,6 +160,17 @@ class Transformer(t2t_model.T2TModel):
       self, features, decode_length, last_position_only=True):
     """Fast version of greedy decoding.
 
+    Decoding stops once every row has emitted EOS; the positions after the
+    EOS of a row are padding, and the row no longer updates the cache.
+
+    With hparams.preallocate_decoder_cache, the decoder self-attention keys
+    and values live in TensorArrays of decode_length positions created before
+    the loop, and every step writes its position instead of concatenating it
+    to a growing cache.
+
+    With a "shortlist" feature, the ids of utils/shortlist.py, every step only
+    computes the logits of the shortlist ids.
+
     Args:
       features: an map of string to `Tensor`
       decode_length: an integer.  How many additional timesteps to decode.
@@ -167,8 +189,6 @@ class Transformer(t2t_model.T2TModel):
       raise ValueError("Fast decoding only deals with the last positions!")
     if self._num_datashards != 1:
       raise NotImplementedError("Fast decoding only supports a single shard.")
-    dp = self._data_parallelism
-    hparams = self._hparams
 
     inputs = features["inputs"]
     batch_size = tf.shape(inputs)[0]
@@ -178,6 +198,150 @@ class Transformer(t2t_model.T2TModel):
     else:
       decode_length = tf.shape(inputs)[1] + decode_length
 
+    encoder_output, encoder_decoder_attention_bias = self._fast_encode(
+        features)
+    preallocate = bool(self._hparams.preallocate_decoder_cache)
+    shortlist = features.get("shortlist")
+    symbols_to_logits_fn = self._fast_symbols_to_logits_fn(
+        encoder_output, encoder_decoder_attention_bias, decode_length,
+        preallocate_cache=preallocate, shortlist=shortlist)
+
+    def inner_loop(i, next_id, decoded_ids, finished, cache):
+      """One decoding step; rows that emitted EOS only append padding."""
+      logits = symbols_to_logits_fn(next_id, i, cache, finished=finished)
+      next_id = tf.expand_dims(tf.argmax(logits, axis=-1), axis=1)
+      if shortlist is not None:
+        next_id = tf.gather(tf.to_int64(shortlist), next_id)
+      next_id = tf.where(finished, tf.zeros_like(next_id), next_id)
+      finished = tf.logical_or(
+          finished, tf.equal(next_id[:, 0], beam_search.EOS_ID))
+      decoded_ids = tf.concat([decoded_ids, next_id], axis=1)
+      return i+1, next_id, decoded_ids, finished, cache
+
+    def is_not_finished(i, unused_next_id, unused_decoded_ids, finished,
+                        unused_cache):
+      return tf.logical_and(tf.less(i, decode_length),
+                            tf.logical_not(tf.reduce_all(finished)))
+
+    cache = self._init_decoder_cache(
+        batch_size, decode_length if preallocate else None)
+    decoded_ids = tf.zeros([batch_size, 0], dtype=tf.int64)
+    next_id = tf.zeros([batch_size, 1], dtype=tf.int64)
+    finished = tf.zeros([batch_size], dtype=tf.bool)
+    num_steps, _, decoded_ids, _, _ = tf.while_loop(
+        is_not_finished,
+        inner_loop,
+        [tf.constant(0), next_id, decoded_ids, finished, cache],
+        shape_invariants=[
+            tf.TensorShape([]),
+            tf.TensorShape([None, None]),
+            tf.TensorShape([None, None]),
+            tf.TensorShape([None]),
+            # The flows of the TensorArrays of a preallocated cache are
+            # scalars.
+            nest.map_structure(
+                lambda t: tf.TensorShape([]) if preallocate else tf.TensorShape(
+                    [None, None, t.shape[2]]), cache),
+        ])
+    tf.summary.scalar("greedy_decoding_steps_saved",
+                      decode_length - num_steps)
+
+    # Pad to decode_length if every row finished early.
+    decoded_ids = tf.pad(decoded_ids, [[0, 0], [0, decode_length - num_steps]])
+
+    return decoded_ids, None, None
+
+  def _beam_decode(self, features, decode_length, beam_size, top_beams,
+                   last_position_only, alpha):
+    """Beam search decoding, with the decoder self-attention cached.
+
+    The source is encoded once per sentence and the keys and values of the
+    decoder self-attention are passed to beam_search as states, so every step
+    only runs the decoder on the last position of each beam.
+
+    With a "shortlist" feature, the beam search runs over the positions of the
+    shortlist ids, which are mapped back to ids at the end.
+
+    Args:
+      features: an map of string to `Tensor`
+      decode_length: an integer.  How many additional timesteps to decode.
+      beam_size: number of beams.
+      top_beams: an integer. How many of the beams to return.
+      last_position_only: a boolean, speed-up by computing last position only.
+      alpha: Float that controls the length penalty. larger the alpha, stronger
+        the preference for slonger translations.
+
+    Returns:
+       samples: an integer `Tensor`. Top samples from the beam search
+    """
+    if self._num_datashards != 1 or "partial_targets" in features:
+      # The slow beam search computes the logits of the whole vocabulary.
+      features = {k: v for k, v in features.items() if k != "shortlist"}
+      return super(Transformer, self)._beam_decode(
+          features, decode_length, beam_size, top_beams, last_position_only,
+          alpha)
+
+    inputs = features["inputs"]
+    batch_size = tf.shape(inputs)[0]
+    decode_length = tf.shape(inputs)[1] + decode_length
+
+    encoder_output, encoder_decoder_attention_bias = self._fast_encode(
+        features)
+    # All the beams of a sentence attend to the same encoder output.
+    encoder_output = beam_search.merge_beam_dim(
+        beam_search.expand_to_beam_size(encoder_output, beam_size))
+    encoder_decoder_attention_bias = beam_search.merge_beam_dim(
+        beam_search.expand_to_beam_size(encoder_decoder_attention_bias,
+                                        beam_size))
+    shortlist = features.get("shortlist")
+    logits_fn = self._fast_symbols_to_logits_fn(
+        encoder_output, encoder_decoder_attention_bias, decode_length,
+        shortlist=shortlist)
+
+    def symbols_to_logits_fn(ids, cache):
+      """Go from the ids of every beam to logits for their next symbol."""
+      i = tf.shape(ids)[1] - 1
+      next_ids = ids[:, -1:]
+      if shortlist is not None:
+        next_ids = tf.gather(shortlist, next_ids)
+      logits = logits_fn(next_ids, i, cache)
+      return logits, cache
+
+    target_modality = self._problem_hparams.target_modality
+    if shortlist is None:
+      vocab_size = target_modality.top_dimensionality
+    else:
+      # The padding and EOS ids are at their own positions in the shortlist.
+      vocab_size = tf.shape(shortlist)[0]
+    ids, _ = beam_search.beam_search(
+        symbols_to_logits_fn,
+        tf.zeros([batch_size], dtype=tf.int32),
+        beam_size,
+        decode_length,
+        vocab_size,
+        alpha,
+        states=self._init_decoder_cache(batch_size))
+    if shortlist is not None:
+      ids = tf.gather(shortlist, ids)
+
+    # Remove the initial id from the beam search.
+    if top_beams == 1:
+      return ids[:, 0, 1:]
+    return ids[:, :top_beams, 1:]
+
+  def _fast_encode(self, features):
+    """Runs the input modality and the encoder for fast decoding.
+
+    Args:
+      features: an map of string to `Tensor`
+
+    Returns:
+      Tuple of:
+          encoder_output: [batch_size, input_length, hidden_dim]
+          encoder_decoder_attention_bias: [batch_size, 1, 1, input_length]
+    """
+    dp = self._data_parallelism
+    inputs = features["inputs"]
     # TODO(llion): Clean up this reshaping logic.
     inputs = tf.expand_dims(inputs, axis=1)
     if len(inputs.shape) < 5:
@@ -191,7 +355,33 @@ class Transformer(t2t_model.T2TModel):
       inputs = input_modality.bottom_sharded(inputs, dp)
     with tf.variable_scope("body"):
       encoder_output, encoder_decoder_attention_bias = dp(
-          self.encode, inputs, features["target_space_id"], hparams)
+          self.encode, inputs, features["target_space_id"], self._hparams)
+    return encoder_output[0], encoder_decoder_attention_bias[0]
+
+  def _fast_symbols_to_logits_fn(self, encoder_output,
+                                 encoder_decoder_attention_bias, decode_length,
+                                 preallocate_cache=False, shortlist=None):
+    """Returns a function computing the logits of one decoding step.
+
+    Args:
+      encoder_output: [batch_size, input_length, hidden_dim]
+      encoder_decoder_attention_bias: [batch_size, 1, 1, input_length]
+      decode_length: Maximum number of decoding steps.
+      preallocate_cache: Whether the cache holds decode_length positions, see
+        _init_decoder_cache.
+      shortlist: Optional int32 [shortlist_size] ids whose logits are computed,
+        instead of the whole vocabulary.
+
+    Returns:
+      A function symbols_to_logits_fn(ids, i, cache, finished=None) that takes
+      the ids decoded at step i - 1 [batch_size, 1] and the decoder cache,
+      which it updates except for the rows of the optional boolean
+      [batch_size] finished, and returns the logits for step i [batch_size, vocab_size], or
+      [batch_size, shortlist_size] with a shortlist.
+    """
+    dp = self._data_parallelism
+    hparams = self._hparams
+    target_modality = self._problem_hparams.target_modality
 
     if hparams.pos == "timing":
       timing_signal = common_attention.get_timing_signal_1d(
@@ -234,62 +424,69 @@ class Transformer(t2t_model.T2TModel):
       decoder_self_attention_bias += common_attention.attention_bias_proximal(
           decode_length)
 
-    def symbols_to_logits_fn(ids, i, cache):
+    def symbols_to_logits_fn(ids, i, cache, finished=None):
       """Go from ids to logits for next symbol."""
       targets = tf.expand_dims(tf.expand_dims(ids, axis=2), axis=3)
       targets = preprocess_targets(targets, i)
 
+      # Attention only reads the positions decoded so far, from either cache.
       bias = decoder_self_attention_bias[:, :, i:i+1, :i+1]
+      decode_loop_step = i if preallocate_cache else None
 
       with tf.variable_scope("body"):
         body_outputs = dp(
             self.decode,
             targets,
-            encoder_output[0],
-            encoder_decoder_attention_bias[0],
+            encoder_output,
+            encoder_decoder_attention_bias,
             bias,
             hparams,
-            cache)
+            cache,
+            decode_loop_step=decode_loop_step,
+            finished=finished)
 
       with tf.variable_scope(target_modality.name):
-        logits = target_modality.top_sharded(body_outputs, None, dp)[0]
+        if shortlist is None:
+          logits = target_modality.top_sharded(body_outputs, None, dp)[0]
+        else:
+          logits = dp(target_modality.top, body_outputs, None,
+                      shortlist=shortlist)[0]
 
       return tf.squeeze(logits, axis=[1, 2, 3])
 
-    def inner_loop(i, next_id, decoded_ids, cache):
-      logits = symbols_to_logits_fn(next_id, i, cache)
-      next_id = tf.expand_dims(tf.argmax(logits, axis=-1), axis=1)
-      decoded_ids = tf.concat([decoded_ids, next_id], axis=1)
-      return i+1, next_id, decoded_ids, cache
+    return symbols_to_logits_fn
+
+  def _init_decoder_cache(self, batch_size, max_length=None):
+    """Returns the initial decoder self-attention cache.
 
+    Args:
+      batch_size: an integer scalar.
+      max_length: an integer scalar. If None, the cache is empty and grows by
+        one position every step. Otherwise it holds TensorArrays of max_length
+        [batch_size, channels] positions, which the decoding steps write in
+        order, see common_attention.write_to_cache.
+
+    Returns:
+      A dict from layer name to a dict of "k" and "v" Tensors or TensorArrays.
+    """
+    hparams = self._hparams
     key_channels = hparams.attention_key_channels or hparams.hidden_size
     value_channels = hparams.attention_value_channels or hparams.hidden_size
     num_layers = hparams.num_decoder_layers or hparams.num_hidden_layers
 
-    cache = {
+    def init_cache(channels):
+      if max_length is None:
+        return tf.zeros([batch_size, 0, channels])
+      return tf.TensorArray(tf.float32, size=max_length,
+                            clear_after_read=False,
+                            element_shape=tf.TensorShape([None, channels]))
+
+    return {
         "layer_%d" % layer: {
-            "k": tf.zeros([batch_size, 0, key_channels]),
-            "v": tf.zeros([batch_size, 0, value_channels]),
+            "k": init_cache(key_channels),
+            "v": init_cache(value_channels),
         } for layer in range(num_layers)
     }
-    decoded_ids = tf.zeros([batch_size, 0], dtype=tf.int64)
-    next_id = tf.zeros([batch_size, 1], dtype=tf.int64)
-    _, _, decoded_ids, _ = tf.while_loop(
-        # TODO(llion): Early stopping.
-        lambda i, *_: tf.less(i, decode_length),
-        inner_loop,
-        [tf.constant(0), next_id, decoded_ids, cache],
-        shape_invariants=[
-            tf.TensorShape([]),
-            tf.TensorShape([None, None]),
-            tf.TensorShape([None, None]),
-            {"layer_%d" % layer: {
-                "k": tf.TensorShape([None, None, key_channels]),
-                "v": tf.TensorShape([None, None, value_channels]),
-            } for layer in range(num_layers)}
-        ])
-
-    return decoded_ids, None, None
 
 
 @registry.register_model
@@ -450,6 +647,8 @@ def transformer_decoder(decoder_input,
                         encoder_decoder_attention_bias,
                         hparams,
                         cache=None,
+                        decode_loop_step=None,
+                        finished=None,
                         name="decoder"):
   """A stack of transformer layers.
 
@@ -463,6 +662,10 @@ def transformer_decoder(decoder_input,
     hparams: hyperparameters for model
     cache: dict, containing tensors which are the results of previous
         attentions, used for fast decoding.
+    decode_loop_step: Step of the decoding loop if the cache is preallocated,
+        see common_attention.multihead_attention.
+    finished: optional boolean Tensor [batch_size] of the decoding rows that
+        are done, see common_attention.multihead_attention.
     name: a string
 
   Returns:
@@ -487,7 +690,9 @@ def transformer_decoder(decoder_input,
               hparams.attention_dropout,
               attention_type=hparams.self_attention_type,
               max_relative_position=hparams.max_relative_position,
-              cache=layer_cache)
+              cache=layer_cache,
+              decode_loop_step=decode_loop_step,
+              finished=finished)
           x = common_layers.layer_postprocess(x, y, hparams)
         if encoder_output is not None:
           with tf.variable_scope("encdec_attention"):
@@ -608,6 +813,8 @@ def transformer_base():
   hparams.add_hparam("use_pad_remover", int(True))
   hparams.add_hparam("self_attention_type", "dot_product")
   hparams.add_hparam("max_relative_position", 0)
+  # Preallocate the decoder self-attention cache in fast greedy decoding.
+  hparams.add_hparam("preallocate_decoder_cache", int(False))
   return hparams
 
 
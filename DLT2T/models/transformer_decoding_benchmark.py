@@ -0,0 +1,147 @@
+# coding=utf-8
+# Copyright 2017 The DLT2T Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+r"""Benchmark for the decoder cache and shortlists of Transformer decoding.
+
+Compares a decoder self-attention cache that grows by concatenation with one
+preallocated for the whole output (hparams.preallocate_decoder_cache), on a
+randomly initialized model. Reports the latency per decoded token and the peak
+memory: of the GPU allocator on GPU, the peak resident memory of the process on
+CPU. The peak is over the whole process, so the preallocated cache runs first
+and the concatenated one only raises the peak if it needs more. To compare the
+peaks, run each of --cache_modes in its own process.
+
+With --shortlist_size, also reports the latency of decoding with a random
+shortlist of that many ids (see utils/shortlist.py), the typical size of the
+shortlists of a batch, which dual-t2t-shortlist logs.
+
+Example usage:
+
+python models/transformer_decoding_benchmark.py \
+    --hparams_set=transformer_base --decode_length=256 --logtostderr
+
+python models/transformer_decoding_benchmark.py \
+    --hparams_set=transformer_small --decode_length=1024 \
+    --cache_modes=concat --logtostderr
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import resource
+import timeit
+
+# Dependency imports
+
+import numpy as np
+from DLT2T.data_generators import problem_hparams
+from DLT2T.data_generators import text_encoder
+from DLT2T.models import transformer
+from DLT2T.utils import registry
+
+import tensorflow as tf
+
+tf.flags.DEFINE_string('hparams_set', 'transformer_base',
+                       'Transformer hparams set of the model.')
+tf.flags.DEFINE_integer('batch_size', 32, 'Number of sentences to decode.')
+tf.flags.DEFINE_integer('input_length', 32, 'Length of the inputs.')
+tf.flags.DEFINE_integer('decode_length', 256,
+                        'Number of positions decoded after the inputs.')
+tf.flags.DEFINE_integer('vocab_size', 32000, 'Size of the vocabulary.')
+tf.flags.DEFINE_string('cache_modes', 'preallocated,concat',
+                       'Comma-separated decoder caches to benchmark, in order: '
+                       'preallocated and/or concat.')
+tf.flags.DEFINE_integer('shortlist_size', 0,
+                        'If > 0, size of the shortlist of a shortlisted '
+                        'decoding.')
+tf.flags.DEFINE_integer('num_repeats', 3,
+                        'Timings are the best of this many runs.')
+FLAGS = tf.flags.FLAGS
+
+
+def build_decoding(features, preallocate, reuse):
+  """Returns the ids of the greedy decoding of features."""
+  hparams = registry.hparams(FLAGS.hparams_set)()
+  hparams.preallocate_decoder_cache = int(preallocate)
+  p_hparams = problem_hparams.test_problem_hparams(FLAGS.vocab_size,
+                                                   FLAGS.vocab_size)
+  hparams.problems = [p_hparams]
+  model = transformer.Transformer(hparams, tf.estimator.ModeKeys.PREDICT,
+                                  p_hparams)
+  with tf.variable_scope(tf.get_variable_scope(), reuse=reuse):
+    decoded_ids, _, _ = model._greedy_infer(  # pylint: disable=protected-access
+        features, FLAGS.decode_length)
+  return decoded_ids
+
+
+def main(unused_argv):
+  rng = np.random.RandomState(0)
+  inputs = rng.randint(
+      2, FLAGS.vocab_size,
+      size=(FLAGS.batch_size, FLAGS.input_length, 1, 1))
+  features = {
+      'inputs': tf.constant(inputs, dtype=tf.int32),
+      'target_space_id': tf.constant(1, dtype=tf.int32),
+  }
+  names = [name for name in FLAGS.cache_modes.split(',') if name]
+  decodings = {}
+  for name in names:
+    decodings[name] = build_decoding(features, name == 'preallocated',
+                                     True if decodings else None)
+  if FLAGS.shortlist_size:
+    shortlist = np.concatenate([
+        np.arange(text_encoder.NUM_RESERVED_TOKENS),
+        rng.choice(np.arange(text_encoder.NUM_RESERVED_TOKENS,
+                             FLAGS.vocab_size),
+                   FLAGS.shortlist_size - text_encoder.NUM_RESERVED_TOKENS,
+                   replace=False)])
+    shortlist_features = dict(features)
+    shortlist_features['shortlist'] = tf.constant(shortlist, dtype=tf.int32)
+    decodings['shortlisted'] = build_decoding(shortlist_features, False,
+                                              True if decodings else None)
+    names.append('shortlisted')
+  use_gpu = tf.test.is_gpu_available()
+  if use_gpu:
+    # pylint: disable=g-import-not-at-top
+    from tensorflow.contrib.memory_stats.python.ops import memory_stats_ops
+    # pylint: enable=g-import-not-at-top
+    max_bytes_in_use = memory_stats_ops.MaxBytesInUse()
+
+  with tf.Session() as sess:
+    sess.run(tf.global_variables_initializer())
+    results = {}
+    for name in names:
+      decoded_ids = decodings[name]
+      results[name] = sess.run(decoded_ids)  # Warm up.
+      secs = min(timeit.repeat(lambda: sess.run(decoded_ids),  # pylint: disable=cell-var-from-loop
+                               number=1, repeat=FLAGS.num_repeats))
+      num_positions = results[name].shape[1]
+      tf.logging.info('%s: %.2fms per decoded position over %d positions.',
+                      name, 1000 * secs / num_positions, num_positions)
+      if use_gpu:
+        tf.logging.info('%s: peak GPU memory %.1fMB.', name,
+                        sess.run(max_bytes_in_use) / 2.0**20)
+      else:
+        # ru_maxrss is in KB on Linux.
+        tf.logging.info('%s: peak resident memory %.1fMB.', name,
+                        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss /
+                        2.0**10)
+  if ('concat' in results and 'preallocated' in results and
+      not np.array_equal(results['concat'], results['preallocated'])):
+    raise ValueError('Concatenated and preallocated caches decode differently.')
+
+
+if __name__ == '__main__':
+  tf.app.run()
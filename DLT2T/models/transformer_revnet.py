@@ -26,6 +26,7 @@ from DLT2T.layers import common_layers
 from DLT2T.layers import rev_block
 from DLT2T.models import transformer
 from DLT2T.utils import registry
+from DLT2T.utils import t2t_model
 
 import tensorflow as tf
 
@@ -73,6 +74,13 @@ class TransformerRevnet(transformer.Transformer):
 
     return decoder_output
 
+  def _beam_decode(self, features, decode_length, beam_size, top_beams,
+                   last_position_only, alpha):
+    # The cached decoding of Transformer does not apply to reversible layers.
+    return t2t_model.T2TModel._beam_decode(
+        self, features, decode_length, beam_size, top_beams,
+        last_position_only, alpha)
+
 
 def transformer_revnet_encoder(encoder_input,
                                encoder_self_attention_bias,
@@ -13,25 +13,46 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-"""Script to average values of variables in a list of checkpoint files."""
+"""Script to average values of variables in a list of checkpoint files.
+
+Variables are averaged one at a time: a pool of threads reads a variable from
+every checkpoint, the values are summed in their own dtype, with Kahan
+summation unless --kahan_summation=false, and the averages are buffered until
+--output_shard_mb of them are written as a shard of the output checkpoint. So
+only one variable of every checkpoint and one output shard are in memory.
+
+Optimizer slots and accumulators (--exclude_variables) are neither averaged nor
+written: the averaged checkpoint is for decoding, not to resume training.
+Non-float variables are copied from the last checkpoint.
+
+The average is uniform, weighted by --checkpoint_weights, or exponential with
+--ema_decay, where the i-th of n checkpoints weighs ema_decay**(n - 1 - i).
+"""
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+from multiprocessing import pool as mp_pool
 import os
+import re
 
 # Dependency imports
 
 import numpy as np
-import six
-from six.moves import zip  # pylint: disable=redefined-builtin
 import tensorflow as tf
+from tensorflow.python.ops import gen_io_ops
+from tensorflow.python.ops import io_ops
+
+# Slots of the Adam and momentum optimizers (also used by YellowFin) and the
+# powers of the Adam betas.
+OPTIMIZER_VARIABLES = r"/(Adam|Adam_1|Momentum)$|(^|/)beta[12]_power(_\d+)?$"
 
 flags = tf.flags
 FLAGS = flags.FLAGS
 
 flags.DEFINE_string("checkpoints", "",
-                    "Comma-separated list of checkpoints to average.")
+                    "Comma-separated list of checkpoints to average, oldest "
+                    "first.")
 flags.DEFINE_integer("num_last_checkpoints", 0,
                      "Averages the last N saved checkpoints."
                      " If the checkpoints flag is set, this is ignored.")
@@ -39,6 +60,21 @@ flags.DEFINE_string("prefix", "",
                     "Prefix (e.g., directory) to append to each checkpoint.")
 flags.DEFINE_string("output_path", "/tmp/averaged.ckpt",
                     "Path to output the averaged checkpoint to.")
+flags.DEFINE_string("checkpoint_weights", "",
+                    "Comma-separated weights of the checkpoints, normalized to "
+                    "sum to 1. If empty, see --ema_decay.")
+flags.DEFINE_float("ema_decay", 0.0,
+                   "If > 0, exponential average of the checkpoints, the newest "
+                   "weighing the most. If 0, uniform average.")
+flags.DEFINE_bool("kahan_summation", True,
+                  "Whether to compensate the rounding errors of the sums.")
+flags.DEFINE_string("exclude_variables", OPTIMIZER_VARIABLES,
+                    "Regular expression of the names of the variables not to "
+                    "average nor write.")
+flags.DEFINE_integer("num_readers", 4,
+                     "Number of threads reading the checkpoints.")
+flags.DEFINE_integer("output_shard_mb", 512,
+                     "Size in MB of the shards of the output checkpoint.")
 
 
 def checkpoint_exists(path):
@@ -46,6 +82,156 @@ def checkpoint_exists(path):
           tf.gfile.Exists(path + ".index"))
 
 
+def checkpoint_weights(num_checkpoints, weights=None, ema_decay=0.0):
+  """Returns the averaging weights of checkpoints, oldest first.
+
+  Args:
+    num_checkpoints: number of checkpoints.
+    weights: optional list of the weights of the checkpoints.
+    ema_decay: if > 0 and no weights are given, the weights decay
+      exponentially with the age of the checkpoints.
+
+  Returns:
+    a float64 array [num_checkpoints] of weights summing to 1.
+
+  Raises:
+    ValueError: if weights are not one non-negative weight per checkpoint.
+  """
+  if weights:
+    if len(weights) != num_checkpoints:
+      raise ValueError("Got %d weights for %d checkpoints." %
+                       (len(weights), num_checkpoints))
+    weights = np.array(weights, dtype=np.float64)
+  elif ema_decay > 0:
+    weights = ema_decay**np.arange(num_checkpoints - 1, -1, -1,
+                                   dtype=np.float64)
+  else:
+    weights = np.ones(num_checkpoints, dtype=np.float64)
+  if (weights < 0).any() or weights.sum() <= 0:
+    raise ValueError("Weights must be non-negative with a positive sum, got "
+                     "%s." % weights.tolist())
+  return weights / weights.sum()
+
+
+class KahanSum(object):
+  """Sum of arrays in their dtype, optionally with Kahan summation."""
+
+  def __init__(self, compensated=True):
+    self.total = None
+    self._compensated = compensated
+    self._compensation = None
+
+  def add(self, value):
+    if self.total is None:
+      self.total = np.array(value)
+      if self._compensated:
+        self._compensation = np.zeros_like(self.total)
+    elif not self._compensated:
+      self.total += value
+    else:
+      corrected = value - self._compensation
+      total = self.total + corrected
+      self._compensation = (total - self.total) - corrected
+      self.total = total
+
+
+class CheckpointWriter(object):
+  """Writes named arrays to a checkpoint, in shards of about shard_bytes."""
+
+  def __init__(self, output_prefix, shard_bytes):
+    self._output_prefix = output_prefix
+    self._shard_bytes = shard_bytes
+    self._shard_prefixes = []
+    self._names = []
+    self._values = []
+    self._num_bytes = 0
+
+  def add(self, name, value):
+    self._names.append(name)
+    self._values.append(value)
+    self._num_bytes += value.nbytes
+    if self._num_bytes >= self._shard_bytes:
+      self._write_shard()
+
+  def _write_shard(self):
+    shard_prefix = os.path.join(self._output_prefix + "_temp",
+                                "part-%05d" % len(self._shard_prefixes))
+    with tf.Graph().as_default():
+      # The values are fed to the save op: no variables are created.
+      tensors = [tf.placeholder(tf.as_dtype(value.dtype), value.shape)
+                 for value in self._values]
+      save_op = io_ops.save_v2(shard_prefix, self._names,
+                               [""] * len(self._names), tensors)
+      with tf.Session() as sess:
+        sess.run(save_op, dict(zip(tensors, self._values)))
+    self._shard_prefixes.append(shard_prefix)
+    self._names, self._values, self._num_bytes = [], [], 0
+
+  def close(self):
+    """Writes the last shard and merges the shards into the checkpoint."""
+    if self._names or not self._shard_prefixes:
+      self._write_shard()
+    with tf.Graph().as_default():
+      merge_op = gen_io_ops.merge_v2_checkpoints(
+          self._shard_prefixes, self._output_prefix, delete_old_dirs=True)
+      with tf.Session() as sess:
+        sess.run(merge_op)
+
+
+def average_checkpoints(checkpoints,
+                        output_prefix,
+                        weights,
+                        exclude_variables=OPTIMIZER_VARIABLES,
+                        kahan_summation=True,
+                        num_readers=4,
+                        shard_bytes=512 * 2**20):
+  """Writes the weighted average of checkpoints to output_prefix.
+
+  The global step of the average is 0.
+
+  Args:
+    checkpoints: list of checkpoint paths.
+    output_prefix: path of the averaged checkpoint.
+    weights: array of the weights of the checkpoints, see checkpoint_weights.
+    exclude_variables: regular expression of the names of the variables not
+      to average nor write.
+    kahan_summation: whether to compensate the rounding errors of the sums.
+    num_readers: number of threads reading the checkpoints.
+    shard_bytes: size of the shards of the output checkpoint.
+  """
+  readers = [tf.train.NewCheckpointReader(c) for c in checkpoints]
+  names, excluded = [], []
+  for name in sorted(readers[0].get_variable_to_shape_map()):
+    if name.startswith("global_step"):
+      continue
+    if exclude_variables and re.search(exclude_variables, name):
+      excluded.append(name)
+    else:
+      names.append(name)
+  writer = CheckpointWriter(output_prefix, shard_bytes)
+  pool = mp_pool.ThreadPool(num_readers)
+  try:
+    for name in names:
+      total, value = KahanSum(compensated=kahan_summation), None
+      for weight, value in zip(weights, pool.imap(
+          lambda reader: reader.get_tensor(name), readers)):  # pylint: disable=cell-var-from-loop
+        if np.issubdtype(value.dtype, np.floating):
+          total.add(value * value.dtype.type(weight))
+      # Non-float variables are copied from the last checkpoint.
+      writer.add(name, np.asarray(value if total.total is None
+                                  else total.total))
+    pool.close()
+  except:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+  writer.add("global_step", np.array(0, dtype=np.int64))
+  writer.close()
+  tf.logging.info("Averaged %d variables, skipped %d: %s", len(names),
+                  len(excluded), excluded)
+
+
 def main(_):
   if FLAGS.checkpoints:
     # Get the checkpoints list from flags and run some basic checks.
@@ -73,44 +259,24 @@ def main(_):
     else:
       raise ValueError("Could not find checkpoints at %s" %
                        os.path.dirname(FLAGS.prefix))
+  weights = checkpoint_weights(
+      len(checkpoints),
+      [float(w) for w in FLAGS.checkpoint_weights.split(",") if w.strip()],
+      FLAGS.ema_decay)
 
-  # Read variables from all checkpoints and average them.
-  tf.logging.info("Reading variables and averaging checkpoints:")
-  for c in checkpoints:
-    tf.logging.info("%s ", c)
-  var_list = tf.contrib.framework.list_variables(checkpoints[0])
-  var_values, var_dtypes = {}, {}
-  for (name, shape) in var_list:
-    if not name.startswith("global_step"):
-      var_values[name] = np.zeros(shape)
-  for checkpoint in checkpoints:
-    reader = tf.contrib.framework.load_checkpoint(checkpoint)
-    for name in var_values:
-      tensor = reader.get_tensor(name)
-      var_dtypes[name] = tensor.dtype
-      var_values[name] += tensor
-    tf.logging.info("Read from checkpoint %s", checkpoint)
-  for name in var_values:  # Average.
-    var_values[name] /= len(checkpoints)
-
-  tf_vars = [
-      tf.get_variable(v, shape=var_values[v].shape, dtype=var_dtypes[name])
-      for v in var_values
-  ]
-  placeholders = [tf.placeholder(v.dtype, shape=v.shape) for v in tf_vars]
-  assign_ops = [tf.assign(v, p) for (v, p) in zip(tf_vars, placeholders)]
-  global_step = tf.Variable(
-      0, name="global_step", trainable=False, dtype=tf.int64)
-  saver = tf.train.Saver(tf.all_variables())
-
-  # Build a model consisting only of variables, set them to the average values.
-  with tf.Session() as sess:
-    sess.run(tf.initialize_all_variables())
-    for p, assign_op, (name, value) in zip(placeholders, assign_ops,
-                                           six.iteritems(var_values)):
-      sess.run(assign_op, {p: value})
-    # Use the built saver to save the averaged checkpoint.
-    saver.save(sess, FLAGS.output_path, global_step=global_step)
+  tf.logging.info("Averaging checkpoints:")
+  for c, weight in zip(checkpoints, weights):
+    tf.logging.info("%s with weight %.4f", c, weight)
+  # Named like the checkpoint of a Saver at global step 0.
+  output_prefix = FLAGS.output_path + "-0"
+  average_checkpoints(
+      checkpoints, output_prefix, weights,
+      exclude_variables=FLAGS.exclude_variables,
+      kahan_summation=FLAGS.kahan_summation,
+      num_readers=FLAGS.num_readers,
+      shard_bytes=FLAGS.output_shard_mb * 2**20)
+  tf.train.update_checkpoint_state(
+      os.path.dirname(os.path.abspath(output_prefix)), output_prefix)
 
   tf.logging.info("Averaged checkpoints saved in %s", FLAGS.output_path)
 
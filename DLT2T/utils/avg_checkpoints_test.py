@@ -0,0 +1,85 @@
+# coding=utf-8
+# Copyright 2017 The DLT2T Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for avg_checkpoints."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+# Dependency imports
+
+import numpy as np
+
+from DLT2T.utils import avg_checkpoints
+
+import tensorflow as tf
+
+
+class AvgCheckpointsTest(tf.test.TestCase):
+
+  def testCheckpointWeights(self):
+    self.assertAllClose([0.5, 0.5], avg_checkpoints.checkpoint_weights(2))
+    self.assertAllClose([0.25, 0.75],
+                        avg_checkpoints.checkpoint_weights(2, [1.0, 3.0]))
+    self.assertAllClose([1 / 3.0, 2 / 3.0],
+                        avg_checkpoints.checkpoint_weights(2, ema_decay=0.5))
+    with self.assertRaises(ValueError):
+      avg_checkpoints.checkpoint_weights(3, [1.0, 3.0])
+
+  def testKahanSumInFloat32(self):
+    value = np.full([3], 0.1, dtype=np.float32)
+    compensated = avg_checkpoints.KahanSum()
+    naive = avg_checkpoints.KahanSum(compensated=False)
+    for _ in range(100000):
+      compensated.add(value)
+      naive.add(value)
+    self.assertEqual(np.float32, compensated.total.dtype)
+    self.assertAllClose(np.full([3], 10000.0), compensated.total, rtol=1e-6)
+    self.assertGreater(np.abs(naive.total - 10000.0).max(),
+                       np.abs(compensated.total - 10000.0).max())
+
+  def testAverageCheckpoints(self):
+    checkpoints = []
+    for i, value in enumerate([1.0, 3.0]):
+      with tf.Graph().as_default():
+        with tf.variable_scope("body"):
+          tf.get_variable("w", initializer=tf.constant([value, 2 * value]))
+        with tf.variable_scope("body/w"):
+          tf.get_variable("Adam", initializer=tf.constant([0.0, 0.0]))
+        tf.get_variable("steps", initializer=tf.constant(i, dtype=tf.int64))
+        tf.train.get_or_create_global_step()
+        # test_session would return the cached session of the first graph.
+        with tf.Session() as sess:
+          sess.run(tf.global_variables_initializer())
+          checkpoints.append(tf.train.Saver().save(
+              sess, os.path.join(self.get_temp_dir(), "model.ckpt"),
+              global_step=i))
+
+    output_prefix = os.path.join(self.get_temp_dir(), "averaged.ckpt-0")
+    avg_checkpoints.average_checkpoints(
+        checkpoints, output_prefix, np.array([0.25, 0.75]), shard_bytes=4)
+    reader = tf.train.NewCheckpointReader(output_prefix)
+    self.assertEqual(["body/w", "global_step", "steps"],
+                     sorted(reader.get_variable_to_shape_map()))
+    self.assertAllClose([2.5, 5.0], reader.get_tensor("body/w"))
+    self.assertEqual(1, reader.get_tensor("steps"))
+    self.assertEqual(0, reader.get_tensor("global_step"))
+
+
+if __name__ == "__main__":
+  tf.test.main()
@@ -0,0 +1,108 @@
+# coding=utf-8
+# Copyright 2017 The DLT2T Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Back-translation of a corpus by parallel decoding processes.
+
+The corpus is split into one shard of contiguous lines per process, named as
+decoding.decode_from_file reads them with --decode_shards, the processes are
+run and their decodes are concatenated in order. See dual-t2t-backtranslate.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import subprocess
+
+# Dependency imports
+
+from six.moves import xrange  # pylint: disable=redefined-builtin
+
+from DLT2T.utils import decoding
+
+import tensorflow as tf
+
+
+def split_lines(filename, output_prefix, num_shards):
+  """Splits a file into num_shards files of contiguous lines.
+
+  Args:
+    filename: path of the file to split.
+    output_prefix: prefix of the shards, named by decoding.shard_filename.
+    num_shards: number of shards.
+  """
+  with tf.gfile.Open(filename) as f:
+    num_lines = sum(1 for _ in f)
+  with tf.gfile.Open(filename) as f:
+    for shard in xrange(num_shards):
+      shard_lines = (num_lines * (shard + 1) // num_shards -
+                     num_lines * shard // num_shards)
+      with tf.gfile.Open(decoding.shard_filename(output_prefix, shard,
+                                                 num_shards), "w") as out:
+        for _ in xrange(shard_lines):
+          out.write(f.readline())
+
+
+def merge_decodes(output_prefix, num_shards, output_filename):
+  """Concatenates the decodes of the shards of output_prefix, in order."""
+  with tf.gfile.Open(output_filename, "w") as out:
+    for shard in xrange(num_shards):
+      pattern = decoding.shard_filename(output_prefix, shard,
+                                        num_shards) + ".*.decodes"
+      decodes = tf.gfile.Glob(pattern)
+      if len(decodes) != 1:
+        raise ValueError("Expected one decode file matching %s, found %s." %
+                         (pattern, decodes))
+      with tf.gfile.Open(decodes[0]) as f:
+        for line in f:
+          out.write(line)
+
+
+def backtranslate(mono_filename, output_filename, work_dir, name,
+                  decode_command, num_workers=1, gpus=()):
+  """Translates mono_filename into output_filename, line by line.
+
+  Args:
+    mono_filename: path of the corpus to translate.
+    output_filename: path of the translations.
+    work_dir: directory of the shards of the inputs and decodes.
+    name: name of the shards in work_dir, e.g. the direction.
+    decode_command: function of (input prefix, output prefix, worker id)
+      returning the command of a decoder, which decodes the shard
+      decoding.shard_filename(input prefix, worker id, num_workers).
+    num_workers: number of decoding processes.
+    gpus: GPUs of the decoding processes, assigned round-robin. If empty,
+      they all see every GPU.
+
+  Raises:
+    RuntimeError: if a decoder fails.
+  """
+  input_prefix = os.path.join(work_dir, name + ".inputs")
+  output_prefix = os.path.join(work_dir, name)
+  split_lines(mono_filename, input_prefix, num_workers)
+  workers = []
+  for worker_id in xrange(num_workers):
+    env = dict(os.environ)
+    if gpus:
+      env["CUDA_VISIBLE_DEVICES"] = gpus[worker_id % len(gpus)]
+    workers.append(subprocess.Popen(
+        decode_command(input_prefix, output_prefix, worker_id), env=env))
+  exit_codes = [worker.wait() for worker in workers]
+  for worker_id, exit_code in enumerate(exit_codes):
+    if exit_code:
+      raise RuntimeError("%s decoder %d failed with exit code %d." %
+                         (name, worker_id, exit_code))
+  merge_decodes(output_prefix, num_workers, output_filename)
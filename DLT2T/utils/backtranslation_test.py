@@ -0,0 +1,84 @@
+# coding=utf-8
+# Copyright 2017 The DLT2T Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for utils.backtranslation."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+
+# Dependency imports
+
+import DLT2T
+from DLT2T.utils import backtranslation
+
+import tensorflow as tf
+
+# Decodes a shard as decoding.decode_from_file names its files, upper-casing
+# the lines.
+_FAKE_DECODER = """
+import sys
+sys.path.insert(0, sys.argv[1])
+from DLT2T.utils import decoding
+input_prefix, output_prefix = sys.argv[2:4]
+worker_id, num_shards = int(sys.argv[4]), int(sys.argv[5])
+with open(decoding.shard_filename(input_prefix, worker_id, num_shards)) as f:
+  lines = f.readlines()
+with open(decoding.shard_filename(output_prefix, worker_id, num_shards) +
+          ".transformer.transformer_base.decodes", "w") as f:
+  f.writelines(line.upper() for line in lines)
+"""
+
+
+class BacktranslationTest(tf.test.TestCase):
+
+  def _backtranslate(self, num_workers, decoder=_FAKE_DECODER):
+    work_dir = os.path.join(self.get_temp_dir(), "work%d" % num_workers)
+    tf.gfile.MakeDirs(work_dir)
+    mono_filename = os.path.join(self.get_temp_dir(), "mono")
+    with open(mono_filename, "w") as f:
+      f.writelines("line %d\n" % i for i in range(5))
+    output_filename = os.path.join(work_dir, "hat")
+    root_dir = os.path.dirname(os.path.dirname(os.path.abspath(
+        DLT2T.__file__)))
+
+    def decode_command(input_prefix, output_prefix, worker_id):
+      return [sys.executable, "-c", decoder, root_dir, input_prefix,
+              output_prefix, str(worker_id), str(num_workers)]
+
+    backtranslation.backtranslate(mono_filename, output_filename, work_dir,
+                                  "B2A", decode_command,
+                                  num_workers=num_workers)
+    with open(output_filename) as f:
+      return f.read()
+
+  def testBacktranslateWithOneWorker(self):
+    self.assertEqual("".join("LINE %d\n" % i for i in range(5)),
+                     self._backtranslate(1))
+
+  def testBacktranslateWithShards(self):
+    self.assertEqual("".join("LINE %d\n" % i for i in range(5)),
+                     self._backtranslate(3))
+
+  def testFailedDecoder(self):
+    with self.assertRaises(RuntimeError):
+      self._backtranslate(2, decoder="import sys; sys.exit(1)")
+
+
+if __name__ == "__main__":
+  tf.test.main()
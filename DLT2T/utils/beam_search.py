@@ -47,6 +47,26 @@ def expand_to_beam_size(tensor, beam_size):
   return tf.tile(tensor, tile_dims)
 
 
+def _shape_list(tensor):
+  """Returns the shape of a tensor, static dimensions as ints if known."""
+  static = tensor.shape.as_list()
+  dynamic = tf.shape(tensor)
+  return [dim if dim is not None else dynamic[i]
+          for i, dim in enumerate(static)]
+
+
+def merge_beam_dim(tensor):
+  """Reshapes [batch_size, beam_size, ...] to [batch_size * beam_size, ...]."""
+  shape = _shape_list(tensor)
+  return tf.reshape(tensor, [shape[0] * shape[1]] + shape[2:])
+
+
+def unmerge_beam_dim(tensor, batch_size, beam_size):
+  """Reshapes [batch_size * beam_size, ...] to [batch_size, beam_size, ...]."""
+  shape = _shape_list(tensor)
+  return tf.reshape(tensor, [batch_size, beam_size] + shape[1:])
+
+
 def log_prob_from_logits(logits):
   return logits - tf.reduce_logsumexp(logits, axis=2, keep_dims=True)
 
@@ -168,6 +188,10 @@ def beam_search(symbols_to_logits_fn,
   Args:
     symbols_to_logits_fn: Interface to the model, to provide logits.
         Shoud take [batch_size, decoded_ids] and return [batch_size, vocab_size]
+        If states are given, it is called as symbols_to_logits_fn(ids, states)
+        and returns (logits, new_states), with the states of every beam
+        flattened to [batch_size * beam_size, ...]. The states are reordered
+        with the beams they belong to, which allows caching.
     initial_ids: Ids to start off the decoding, this will be the first thing
         handed to symbols_to_logits_fn (after expanding to beam size)
         [batch_size]
@@ -302,11 +326,10 @@ def beam_search(symbols_to_logits_fn,
 
     # (batch_size * beam_size, decoded_length)
     if states:
-      flat_states = nest.map_structure(
-          lambda state: tf.reshape(state, [batch_size * beam_size, -1]), states)
+      flat_states = nest.map_structure(merge_beam_dim, states)
       flat_logits, flat_states = symbols_to_logits_fn(flat_ids, flat_states)
       states = nest.map_structure(
-          lambda state: tf.reshape(state, [batch_size, beam_size, -1]),
+          lambda state: unmerge_beam_dim(state, batch_size, beam_size),
           flat_states)
     else:
       flat_logits = symbols_to_logits_fn(flat_ids)
@@ -19,6 +19,7 @@ from __future__ import division
 from __future__ import print_function
 
 import collections
+import itertools
 import math
 
 # Dependency imports
@@ -52,6 +53,87 @@ def _get_ngrams(segment, max_order):
   return ngram_counts
 
 
+def _flatten_corpus(corpus):
+  """Returns the concatenated tokens and the lengths of a list of segments."""
+  if isinstance(corpus, np.ndarray) and corpus.ndim == 2:
+    return corpus.ravel(), np.full(corpus.shape[0], corpus.shape[1], np.int64)
+  lengths = np.array([len(segment) for segment in corpus], dtype=np.int64)
+  return np.array(list(itertools.chain.from_iterable(corpus))), lengths
+
+
+def _get_ngram_match_counts(reference_corpus, translation_corpus, max_order):
+  """Counts n-gram matches of a batch of translations with NumPy.
+
+  Every n-gram occurrence is identified by an int64 key encoding its segment
+  and its tokens, computed with sliding windows from the key of its (n-1)-gram
+  prefix and its last token. Keys are renumbered densely whenever the next
+  order could overflow int64. Clipped match counts are then obtained by
+  intersecting the sorted unique keys of references and translations.
+
+  Args:
+    reference_corpus: list of tokenized references, or a 2-D array.
+    translation_corpus: list of tokenized translations, or a 2-D array.
+    max_order: Maximum n-gram order.
+
+  Returns:
+    A tuple (matches_by_order, possible_matches_by_order, reference_length,
+    translation_length), with the same values as counting with _get_ngrams.
+  """
+  num_segments = min(len(reference_corpus), len(translation_corpus))
+  ref_tokens, ref_lengths = _flatten_corpus(reference_corpus[:num_segments])
+  trans_tokens, trans_lengths = _flatten_corpus(
+      translation_corpus[:num_segments])
+  matches_by_order = [0] * max_order
+  possible_matches_by_order = [0] * max_order
+
+  tokens = np.concatenate([ref_tokens, trans_tokens])
+  if (np.issubdtype(tokens.dtype, np.integer) and tokens.size and
+      tokens.min() >= 0 and tokens.max() < 2**31):
+    token_ids = tokens.astype(np.int64)
+    vocab_size = int(token_ids.max()) + 1
+  else:
+    vocab, token_ids = np.unique(tokens, return_inverse=True)
+    token_ids = token_ids.astype(np.int64).ravel()
+    vocab_size = max(len(vocab), 1)
+
+  # Per side: token ids, tokens left in the segment at each position, and the
+  # n-gram keys at each position.
+  sides = []
+  key_bound = max(num_segments, 1) * vocab_size
+  for offset, lengths in ((0, ref_lengths), (len(ref_tokens), trans_lengths)):
+    ids = token_ids[offset:offset + lengths.sum()]
+    segment_ids = np.repeat(np.arange(num_segments, dtype=np.int64), lengths)
+    remaining = np.repeat(np.cumsum(lengths), lengths) - np.arange(len(ids))
+    sides.append([ids, remaining, segment_ids * vocab_size + ids])
+
+  for order in xrange(1, max_order + 1):
+    if order > 1:
+      if key_bound > np.iinfo(np.int64).max // vocab_size:
+        unique_keys, inverse = np.unique(
+            np.concatenate([side[2] for side in sides]), return_inverse=True)
+        inverse = inverse.astype(np.int64).ravel()
+        sides[0][2] = inverse[:len(sides[0][2])]
+        sides[1][2] = inverse[len(sides[0][2]):]
+        key_bound = len(unique_keys)
+      for side in sides:
+        side[2] = side[2][:-1] * vocab_size + side[0][order - 1:]
+      key_bound *= vocab_size
+
+    (ref_keys, ref_counts), (trans_keys, trans_counts) = [
+        np.unique(keys[remaining[:len(keys)] >= order], return_counts=True)
+        for _, remaining, keys in sides]
+    if len(trans_keys):
+      index = np.minimum(np.searchsorted(trans_keys, ref_keys),
+                         len(trans_keys) - 1)
+      found = trans_keys[index] == ref_keys
+      matches_by_order[order - 1] = int(np.minimum(
+          ref_counts[found], trans_counts[index[found]]).sum())
+    possible_matches_by_order[order - 1] = int(trans_counts.sum())
+
+  return (matches_by_order, possible_matches_by_order,
+          int(ref_lengths.sum()), int(trans_lengths.sum()))
+
+
 def compute_bleu(reference_corpus,
                  translation_corpus,
                  max_order=4,
@@ -69,29 +151,20 @@ def compute_bleu(reference_corpus,
   Returns:
     BLEU score.
   """
-  reference_length = 0
-  translation_length = 0
+  (matches_by_order, possible_matches_by_order, reference_length,
+   translation_length) = _get_ngram_match_counts(
+       reference_corpus, translation_corpus, max_order)
+  return _bleu_from_counts(matches_by_order, possible_matches_by_order,
+                           reference_length, translation_length, max_order,
+                           use_bp)
+
+
+def _bleu_from_counts(matches_by_order, possible_matches_by_order,
+                      reference_length, translation_length, max_order,
+                      use_bp):
+  """Computes BLEU from n-gram match counts and corpus lengths."""
   bp = 1.0
   geo_mean = 0
-
-  matches_by_order = [0] * max_order
-  possible_matches_by_order = [0] * max_order
-  precisions = []
-
-  for (references, translations) in zip(reference_corpus, translation_corpus):
-    reference_length += len(references)
-    translation_length += len(translations)
-    ref_ngram_counts = _get_ngrams(references, max_order)
-    translation_ngram_counts = _get_ngrams(translations, max_order)
-
-    overlap = dict((ngram,
-                    min(count, translation_ngram_counts[ngram]))
-                   for ngram, count in ref_ngram_counts.items())
-
-    for ngram in overlap:
-      matches_by_order[len(ngram) - 1] += overlap[ngram]
-    for ngram in translation_ngram_counts:
-      possible_matches_by_order[len(ngram)-1] += translation_ngram_counts[ngram]
   precisions = [0] * max_order
   for i in xrange(0, max_order):
     if possible_matches_by_order[i] > 0:
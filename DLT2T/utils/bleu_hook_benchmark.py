@@ -0,0 +1,108 @@
+# coding=utf-8
+# Copyright 2017 The DLT2T Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+r"""Benchmark for bleu_hook.compute_bleu.
+
+Compares the NumPy n-gram matching of compute_bleu with counting n-grams in
+a Counter per segment, on random segments of token ids.
+
+Example usage:
+
+python utils/bleu_hook_benchmark.py --num_pairs=100000 --logtostderr
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import timeit
+
+# Dependency imports
+
+import numpy as np
+from six.moves import xrange  # pylint: disable=redefined-builtin
+from six.moves import zip  # pylint: disable=redefined-builtin
+from DLT2T.utils import bleu_hook
+
+import tensorflow as tf
+
+tf.flags.DEFINE_integer('num_pairs', 100000,
+                        'Number of (reference, translation) pairs.')
+tf.flags.DEFINE_integer('vocab_size', 32000, 'Size of the token vocabulary.')
+tf.flags.DEFINE_integer('max_length', 40, 'Maximum segment length.')
+tf.flags.DEFINE_integer('num_repeats', 3,
+                        'Timings are the best of this many runs.')
+FLAGS = tf.flags.FLAGS
+
+
+def counter_compute_bleu(reference_corpus, translation_corpus, max_order=4,
+                         use_bp=True):
+  """compute_bleu, counting n-grams of every segment in a Counter."""
+  reference_length = 0
+  translation_length = 0
+  matches_by_order = [0] * max_order
+  possible_matches_by_order = [0] * max_order
+  for (references, translations) in zip(reference_corpus, translation_corpus):
+    reference_length += len(references)
+    translation_length += len(translations)
+    ref_ngram_counts = bleu_hook._get_ngrams(references, max_order)  # pylint: disable=protected-access
+    translation_ngram_counts = bleu_hook._get_ngrams(translations, max_order)  # pylint: disable=protected-access
+    for ngram, count in ref_ngram_counts.items():
+      matches_by_order[len(ngram) - 1] += min(count,
+                                              translation_ngram_counts[ngram])
+    for ngram, count in translation_ngram_counts.items():
+      possible_matches_by_order[len(ngram) - 1] += count
+  return bleu_hook._bleu_from_counts(  # pylint: disable=protected-access
+      matches_by_order, possible_matches_by_order, reference_length,
+      translation_length, max_order, use_bp)
+
+
+def random_corpus(num_segments, rng):
+  """Random segments of Zipf-distributed token ids."""
+  lengths = rng.randint(1, FLAGS.max_length + 1, size=num_segments)
+  tokens = np.minimum(rng.zipf(1.2, size=lengths.sum()), FLAGS.vocab_size)
+  return [segment.tolist()
+          for segment in np.split(tokens, np.cumsum(lengths)[:-1])]
+
+
+def main(unused_argv):
+  rng = np.random.RandomState(0)
+  references = random_corpus(FLAGS.num_pairs, rng)
+  # Translations share most of their tokens with the references.
+  translations = []
+  for segment in references:
+    segment = list(segment)
+    for _ in xrange(rng.randint(0, 4)):
+      segment[rng.randint(len(segment))] = rng.randint(FLAGS.vocab_size)
+    translations.append(segment)
+
+  bleu = bleu_hook.compute_bleu(references, translations)
+  counter_bleu = counter_compute_bleu(references, translations)
+  if bleu != counter_bleu:
+    raise ValueError('BLEU scores differ: %f vs %f.' % (bleu, counter_bleu))
+
+  numpy_secs = min(timeit.repeat(
+      lambda: bleu_hook.compute_bleu(references, translations), number=1,
+      repeat=FLAGS.num_repeats))
+  counter_secs = min(timeit.repeat(
+      lambda: counter_compute_bleu(references, translations), number=1,
+      repeat=FLAGS.num_repeats))
+  tf.logging.info('BLEU %f over %d pairs.', bleu, FLAGS.num_pairs)
+  tf.logging.info('counter: %.4fs, numpy: %.4fs, speedup: %.2fx',
+                  counter_secs, numpy_secs,
+                  counter_secs / max(numpy_secs, 1e-9))
+
+
+if __name__ == '__main__':
+  tf.app.run()
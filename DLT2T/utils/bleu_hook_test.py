@@ -21,6 +21,7 @@ from __future__ import print_function
 
 # Dependency imports
 
+import numpy as np
 from DLT2T.utils import bleu_hook
 
 import tensorflow as tf
@@ -56,5 +57,38 @@ class BleuHookTest(tf.test.TestCase):
     actual_bleu = 0.486
     self.assertAllClose(bleu, actual_bleu, atol=1e-03)
 
+  def testComputeBleuMatchesNgramCounters(self):
+    rng = np.random.RandomState(0)
+    reference_corpus = [list(rng.randint(0, 5, size=rng.randint(0, 12)))
+                        for _ in range(50)]
+    translation_corpus = [list(rng.randint(0, 5, size=rng.randint(1, 12)))
+                          for _ in range(50)]
+    matches_by_order = [0] * 4
+    possible_matches_by_order = [0] * 4
+    for references, translations in zip(reference_corpus,
+                                         translation_corpus):
+      ref_ngram_counts = bleu_hook._get_ngrams(references, 4)
+      translation_ngram_counts = bleu_hook._get_ngrams(translations, 4)
+      for ngram, count in ref_ngram_counts.items():
+        matches_by_order[len(ngram) - 1] += min(
+            count, translation_ngram_counts[ngram])
+      for ngram, count in translation_ngram_counts.items():
+        possible_matches_by_order[len(ngram) - 1] += count
+
+    self.assertEqual(
+        (matches_by_order, possible_matches_by_order,
+         sum(len(r) for r in reference_corpus),
+         sum(len(t) for t in translation_corpus)),
+        bleu_hook._get_ngram_match_counts(reference_corpus,
+                                          translation_corpus, 4))
+
+  def testComputeBleuOfArrays(self):
+    reference_corpus = np.array([[1, 2, 1, 13], [12, 6, 7, 4]])
+    translation_corpus = np.array([[1, 2, 1, 3], [5, 6, 7, 4]])
+    self.assertEqual(
+        bleu_hook.compute_bleu(reference_corpus.tolist(),
+                               translation_corpus.tolist()),
+        bleu_hook.compute_bleu(reference_corpus, translation_corpus))
+
 if __name__ == '__main__':
   tf.test.main()
@@ -69,7 +69,9 @@ def input_pipeline(problem,
                    mode,
                    hparams,
                    batching_scheme,
-                   dataset_split=None):
+                   dataset_split=None,
+                   stream=None,
+                   features=None):
   """Input pipeline, returns a dictionary of batched and padded tensors.
 
   Args:
@@ -85,6 +87,9 @@ def input_pipeline(problem,
       "max_length": an integer.  We drop sequences which are longer.
     dataset_split: tf.estimator.ModeKeys + ["test"], which split of the dataset
       to use. Defaults to mode.
+    stream: optional name of the stream of the problem to read, see
+      Problem.data_streams.
+    features: optional list of the features to read, see Problem.dataset.
 
   Returns:
     dict <feature name, batched and padded Tensor>
@@ -99,7 +104,9 @@ def input_pipeline(problem,
         num_threads=num_threads,
         output_buffer_size=capacity,
         hparams=hparams,
-        dataset_split=dataset_split)
+        dataset_split=dataset_split,
+        stream=stream,
+        features=features)
     dataset = dataset.map(cast_int64_to_int32, num_threads=num_threads)
     dataset = dataset.filter(
         lambda ex: example_valid_size(ex, batching_scheme["max_length"]))
@@ -307,10 +314,11 @@ def _batching_scheme(batch_size,
 def hparams_to_batching_scheme(hparams,
                                drop_long_sequences=False,
                                shard_multiplier=1,
-                               length_multiplier=1):
+                               length_multiplier=1,
+                               batch_size_multiplier=1):
   """Wrapper around _batching_scheme with hparams."""
   return _batching_scheme(
-      batch_size=hparams.batch_size,
+      batch_size=int(hparams.batch_size * batch_size_multiplier),
       max_length=hparams.max_length,
       min_length_bucket=hparams.min_length_bucket,
       length_bucket_step=hparams.length_bucket_step,
@@ -18,7 +18,8 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import operator
+import collections
+import json
 import os
 
 # Dependency imports
@@ -29,6 +30,7 @@ import six
 from six.moves import input  # pylint: disable=redefined-builtin
 
 from DLT2T.data_generators import text_encoder
+from DLT2T.utils import data_reader
 from DLT2T.utils import devices
 from DLT2T.utils import input_fn_builder
 import tensorflow as tf
@@ -47,6 +49,23 @@ def decode_hparams(overrides=""):
       problem_idx=0,
       extra_length=50,
       batch_size=0,
+      # If > 0, decode_from_file packs batches of inputs of the same length
+      # bucket holding at most this many input tokens, padding included,
+      # instead of batches of batch_size inputs.
+      batch_tokens=0,
+      # If > 0, decode_from_file reads, sorts and decodes its inputs this many
+      # at a time, writes the decodes of every window as soon as it is done
+      # and records its progress, so that a restarted decode resumes after
+      # the last written window.
+      decode_window=0,
+      # If set, Transformer fast decoding only computes the logits of a
+      # shortlist of the vocabulary per batch: the source ids, their
+      # shortlist_translations best translations in the lexical table of this
+      # file and its shortlist_frequent most frequent ids. See shortlist.py
+      # and dual-t2t-shortlist.
+      shortlist_file="",
+      shortlist_translations=10,
+      shortlist_frequent=2000,
       beam_size=4,
       alpha=0.6,
       return_beams=False,
@@ -87,11 +106,9 @@ def log_decode_results(inputs,
     if targets is not None:
       decoded_targets = " ".join(map(str, targets.flatten()))
   else:
-    decoded_outputs = " ".join(
-        map(str, targets_vocab.decode(_save_until_eos(outputs.flatten()))))
+    decoded_outputs = targets_vocab.decode(_save_until_eos(outputs.flatten()))
     if targets is not None:
-      decoded_targets = " ".join(
-          map(str, targets_vocab.decode(_save_until_eos(targets.flatten()))))
+      decoded_targets = targets_vocab.decode(_save_until_eos(targets.flatten()))
 
   tf.logging.info("Inference results OUTPUT: %s" % decoded_outputs)
   if targets is not None:
@@ -99,6 +116,48 @@ def log_decode_results(inputs,
   return decoded_outputs, decoded_targets
 
 
+def log_decode_results_batch(inputs_list, outputs_list, inputs_vocab,
+                             targets_vocab):
+  """Log inference results for a batch of text predictions.
+
+  Same as log_decode_results for text problems, but decodes the whole batch
+  with TextEncoder.decode_batch.
+
+  Args:
+    inputs_list: list of input id arrays.
+    outputs_list: list of output id arrays.
+    inputs_vocab: TextEncoder for the inputs.
+    targets_vocab: TextEncoder for the outputs.
+
+  Returns:
+    a list of decoded outputs.
+  """
+  decoded_inputs = inputs_vocab.decode_batch(
+      [_save_until_eos(inputs.flatten()) for inputs in inputs_list])
+  decoded_outputs = targets_vocab.decode_batch(
+      [_save_until_eos(outputs.flatten()) for outputs in outputs_list])
+  for decoded_input, decoded_output in zip(decoded_inputs, decoded_outputs):
+    tf.logging.info("Inference results INPUT: %s" % decoded_input)
+    tf.logging.info("Inference results OUTPUT: %s" % decoded_output)
+  return decoded_outputs
+
+
+def _decode_results(results, decode_hp, inputs_vocab, targets_vocab):
+  """Decodes a batch of predictions; beams are joined with tabs."""
+  num_beams = decode_hp.beam_size if decode_hp.return_beams else 1
+  inputs_list, outputs_list = [], []
+  for result in results:
+    for beam in np.split(result["outputs"], num_beams, axis=0):
+      inputs_list.append(result["inputs"])
+      outputs_list.append(beam)
+  decoded_outputs = log_decode_results_batch(inputs_list, outputs_list,
+                                             inputs_vocab, targets_vocab)
+  return [
+      "\t".join(decoded_outputs[i:i + num_beams])
+      for i in range(0, len(decoded_outputs), num_beams)
+  ]
+
+
 def decode_from_dataset(estimator,
                         problem_names,
                         decode_hp,
@@ -193,8 +252,13 @@ def decode_from_dataset(estimator,
     tf.logging.info("Completed inference on %d samples." % num_predictions)  # pylint: disable=undefined-loop-variable
 
 
-def decode_from_file(estimator, filename, decode_hp, decode_to_file=None):
-  """Compute predictions on entries in filename and write them out."""
+def decode_from_file(estimator, filename, decode_hp, decode_to_file=None,
+                     checkpoint_path=None):
+  """Compute predictions on entries in filename and write them out.
+
+  Decodes with the checkpoint at checkpoint_path, or with the latest
+  checkpoint of the estimator if None.
+  """
   if not decode_hp.batch_size:
     decode_hp.batch_size = 32
     tf.logging.info(
@@ -206,56 +270,156 @@ def decode_from_file(estimator, filename, decode_hp, decode_to_file=None):
   targets_vocab = hparams.problems[problem_id].vocabulary["targets"]
   problem_name = FLAGS.problems.split("-")[problem_id]
   tf.logging.info("Performing decoding from a file.")
-  sorted_inputs, sorted_keys = _get_sorted_inputs(filename, decode_hp.shards,
-                                                  decode_hp.delimiter)
-  num_decode_batches = (len(sorted_inputs) - 1) // decode_hp.batch_size + 1
-
-  def input_fn():
-    input_gen = _decode_batch_input_fn(
-        problem_id, num_decode_batches, sorted_inputs, inputs_vocab,
-        decode_hp.batch_size, decode_hp.max_input_size)
-    gen_fn = make_input_fn_from_generator(input_gen)
-    example = gen_fn()
-    return _decode_input_tensor_to_features_dict(example, hparams)
-
-  decodes = []
-  result_iter = estimator.predict(input_fn)
-  for result in result_iter:
-    if decode_hp.return_beams:
-      beam_decodes = []
-      output_beams = np.split(result["outputs"], decode_hp.beam_size, axis=0)
-      for k, beam in enumerate(output_beams):
-        tf.logging.info("BEAM %d:" % k)
-        decoded_outputs, _ = log_decode_results(result["inputs"], beam,
-                                                problem_name, None,
-                                                inputs_vocab, targets_vocab)
-        beam_decodes.append(decoded_outputs)
-      decodes.append("\t".join(beam_decodes))
-    else:
-      decoded_outputs, _ = log_decode_results(result["inputs"],
-                                              result["outputs"], problem_name,
-                                              None, inputs_vocab, targets_vocab)
-      decodes.append(decoded_outputs)
-
-  # Reversing the decoded inputs and outputs because they were reversed in
-  # _decode_batch_input_fn
-  sorted_inputs.reverse()
-  decodes.reverse()
+  input_filename = shard_filename(filename, FLAGS.worker_id, decode_hp.shards)
   # Dumping inputs and outputs to file filename.decodes in
   # format result\tinput in the same order as original inputs
   if decode_to_file:
     output_filename = decode_to_file
   else:
     output_filename = filename
-  if decode_hp.shards > 1:
-    base_filename = output_filename + ("%.2d" % FLAGS.worker_id)
-  else:
-    base_filename = output_filename
+  base_filename = shard_filename(output_filename, FLAGS.worker_id,
+                                 decode_hp.shards)
   decode_filename = _decode_filename(base_filename, problem_name, decode_hp)
+  progress_filename = decode_filename + ".progress"
+
+  progress = {"input_offset": 0, "num_inputs": 0, "output_bytes": 0}
+  if decode_hp.decode_window and tf.gfile.Exists(progress_filename):
+    with tf.gfile.Open(progress_filename) as f:
+      progress = json.load(f)
+    tf.logging.info("Resuming decoding after %d inputs." %
+                    progress["num_inputs"])
+    _truncate_file(decode_filename, progress["output_bytes"])
+  if progress["input_offset"] >= tf.gfile.Stat(input_filename).length:
+    tf.logging.info("All the inputs of %s are already decoded." %
+                    input_filename)
+    return
+
+  # The windows whose batches were handed to the estimator, in order, as
+  # (sorted_order, batches, input_offset) tuples.
+  windows = collections.deque()
+
+  def decode_batches():
+    """Yields the batches of the inputs, one sorted window at a time."""
+    for inputs, input_offset in _read_input_windows(
+        input_filename, decode_hp.delimiter, decode_hp.decode_window,
+        progress["input_offset"]):
+      values, offsets, sorted_order = _sort_inputs(inputs, inputs_vocab)
+      lengths = _input_lengths(offsets, decode_hp.max_input_size)
+      if decode_hp.batch_tokens:
+        batches = _token_budget_batches(lengths, decode_hp.batch_tokens,
+                                        hparams.min_length_bucket,
+                                        hparams.length_bucket_step)
+      else:
+        batches = [(start, min(start + decode_hp.batch_size, len(lengths)))
+                   for start in range(0, len(lengths), decode_hp.batch_size)]
+      # Decode the longest inputs first so that if you're going to get OOMs,
+      # you'll see it in the first batch.
+      batches.reverse()
+      windows.append((sorted_order, batches, input_offset))
+      for batch in _decode_batch_input_fn(problem_id, batches, values, offsets,
+                                          decode_hp.max_input_size):
+        yield batch
+
+  def input_fn():
+    gen_fn = make_input_fn_from_generator(decode_batches())
+    example = gen_fn()
+    return _decode_input_tensor_to_features_dict(example, hparams)
+
   tf.logging.info("Writing decodes into %s" % decode_filename)
-  outfile = tf.gfile.Open(decode_filename, "w")
-  for index in range(len(sorted_inputs)):
-    outfile.write("%s\n" % (decodes[sorted_keys[index]], decode_hp.delimiter))
+  outfile = tf.gfile.Open(decode_filename,
+                          "ab" if progress["output_bytes"] else "wb")
+  # Predictions are decoded decode_hp.batch_size at a time, with one
+  # decode_batch call per vocabulary.
+  decodes = []
+  results = []
+  for result in estimator.predict(input_fn, checkpoint_path=checkpoint_path):
+    results.append(result)
+    sorted_order, batches, input_offset = windows[0]
+    window_done = len(decodes) + len(results) == len(sorted_order)
+    if len(results) == decode_hp.batch_size or window_done:
+      decodes.extend(_decode_results(results, decode_hp, inputs_vocab,
+                                     targets_vocab))
+      results = []
+    if window_done:
+      windows.popleft()
+      output = _ordered_decodes_text(decodes, sorted_order, batches,
+                                     decode_hp.delimiter)
+      outfile.write(output)
+      outfile.flush()
+      decodes = []
+      progress["input_offset"] = input_offset
+      progress["num_inputs"] += len(sorted_order)
+      progress["output_bytes"] += len(output)
+      if decode_hp.decode_window:
+        _write_progress(progress_filename, progress)
+        tf.logging.info("Wrote the decodes of %d inputs." %
+                        progress["num_inputs"])
+  outfile.close()
+  if decode_hp.decode_window:
+    tf.gfile.Remove(progress_filename)
+
+
+def _ordered_decodes_text(decodes, sorted_order, batches, delimiter):
+  """Returns the decodes of a window in input order, as delimited bytes.
+
+  Args:
+    decodes: list of the decodes, in the order the batches were decoded.
+    sorted_order: int array, see _sort_inputs.
+    batches: list of (start, end) ranges of sorted inputs that were decoded.
+    delimiter: str, written after every decode.
+
+  Returns:
+    a bytes string.
+  """
+  # The i-th decode is of the input at position decode_positions[i] of the
+  # window.
+  decode_positions = sorted_order[np.concatenate(
+      [np.arange(start, end) for start, end in batches])]
+  ordered_decodes = np.empty(len(decodes), dtype=object)
+  ordered_decodes[decode_positions] = decodes
+  return tf.compat.as_bytes(
+      "".join("%s%s" % (decode, delimiter) for decode in ordered_decodes))
+
+
+def _write_progress(progress_filename, progress):
+  """Atomically replaces the progress file of a decode."""
+  tmp_filename = progress_filename + ".tmp"
+  with tf.gfile.Open(tmp_filename, "w") as f:
+    json.dump(progress, f)
+  tf.gfile.Rename(tmp_filename, progress_filename, overwrite=True)
+
+
+def _truncate_file(filename, length, chunk_size=2**24):
+  """Drops what a killed decode wrote to filename after its last progress."""
+  if not tf.gfile.Exists(filename):
+    if length:
+      raise ValueError("%s is missing; cannot resume decoding." % filename)
+    return
+  if tf.gfile.Stat(filename).length == length:
+    return
+  tmp_filename = filename + ".tmp"
+  with tf.gfile.Open(filename, "rb") as src:
+    with tf.gfile.Open(tmp_filename, "wb") as dst:
+      remaining = length
+      while remaining:
+        chunk = src.read(min(chunk_size, remaining))
+        if not chunk:
+          raise ValueError("%s is shorter than its decode progress." %
+                           filename)
+        dst.write(chunk)
+        remaining -= len(chunk)
+  tf.gfile.Rename(tmp_filename, filename, overwrite=True)
+
+
+def shard_filename(filename, shard, num_shards):
+  """The file of a shard that decode_from_file reads or writes.
+
+  With --decode_shards > 1, each decoding replica reads and writes the files
+  suffixed with its --worker_id. A single decoder uses the files as they are.
+  """
+  if num_shards > 1:
+    return filename + ("%.2d" % shard)
+  return filename
 
 
 def _decode_filename(base_filename, problem_name, decode_hp):
@@ -327,37 +491,105 @@ def decode_interactively(estimator, decode_hp):
             targets_vocab.decode(_save_until_eos(result["outputs"].flatten())))
 
 
-def _decode_batch_input_fn(problem_id, num_decode_batches, sorted_inputs,
-                           vocabulary, batch_size, max_input_size):
-  tf.logging.info(" batch %d" % num_decode_batches)
-  # First reverse all the input sentences so that if you're going to get OOMs,
-  # you'll see it in the first batch
-  sorted_inputs.reverse()
-  for b in range(num_decode_batches):
-    tf.logging.info("Decoding batch %d" % b)
-    batch_length = 0
-    batch_inputs = []
-    for inputs in sorted_inputs[b * batch_size:(b + 1) * batch_size]:
-      input_ids = vocabulary.encode(inputs)
-      if max_input_size > 0:
-        # Subtract 1 for the EOS_ID.
-        input_ids = input_ids[:max_input_size - 1]
-      input_ids.append(text_encoder.EOS_ID)
-      batch_inputs.append(input_ids)
-      if len(input_ids) > batch_length:
-        batch_length = len(input_ids)
-    final_batch_inputs = []
-    for input_ids in batch_inputs:
-      assert len(input_ids) <= batch_length
-      x = input_ids + [0] * (batch_length - len(input_ids))
-      final_batch_inputs.append(x)
+def _decode_batch_input_fn(problem_id, batches, values, offsets,
+                           max_input_size):
+  """Yields the batches of inputs to decode.
 
+  Args:
+    problem_id: int, index of the problem.
+    batches: list of (start, end) ranges of inputs to batch together.
+    values: ragged input ids, as returned by TextEncoder.encode_batch.
+    offsets: ragged input offsets, as returned by TextEncoder.encode_batch.
+    max_input_size: int, maximum length of an input including EOS_ID, or <= 0
+      for no limit.
+
+  Yields:
+    feature dicts with padded "inputs" and "problem_choice".
+  """
+  tf.logging.info(" batch %d" % len(batches))
+  for b, (start, end) in enumerate(batches):
+    tf.logging.info("Decoding batch %d" % b)
+    batch_offsets = offsets[start:end + 1]
     yield {
-        "inputs": np.array(final_batch_inputs).astype(np.int32),
+        "inputs": _pad_ragged_inputs(
+            values[batch_offsets[0]:batch_offsets[-1]],
+            batch_offsets - batch_offsets[0], max_input_size),
         "problem_choice": np.array(problem_id).astype(np.int32),
     }
 
 
+def _input_lengths(offsets, max_input_size):
+  """Lengths of the padded inputs, including EOS_ID; see _pad_ragged_inputs."""
+  lengths = np.diff(offsets)
+  if max_input_size > 0:
+    lengths = np.minimum(lengths, max_input_size - 1)
+  return lengths + 1
+
+
+def _token_budget_batches(lengths, batch_tokens, min_length_bucket=8,
+                          length_bucket_step=1.1):
+  """Packs sorted inputs into batches of at most batch_tokens tokens.
+
+  The inputs are grouped into the length buckets of
+  data_reader._bucket_boundaries, and every batch of a bucket holds as many
+  inputs as fit in batch_tokens once padded to the longest input of the bucket.
+  An input longer than batch_tokens is batched alone.
+
+  Args:
+    lengths: int array of the input lengths, sorted in ascending order.
+    batch_tokens: int, maximum number of tokens of a batch, padding included.
+    min_length_bucket: int, length of the first bucket boundary.
+    length_bucket_step: float, ratio of successive bucket boundaries.
+
+  Returns:
+    a list of (start, end) ranges of lengths.
+  """
+  if not len(lengths):
+    return []
+  boundaries = data_reader._bucket_boundaries(  # pylint: disable=protected-access
+      lengths[-1] + 1, min_length_bucket, length_bucket_step)
+  bucket_ends = np.searchsorted(lengths, boundaries, side="left")
+  bucket_ends = np.unique(np.append(bucket_ends, len(lengths)))
+  batches = []
+  start = 0
+  for end in bucket_ends:
+    if end == start:
+      continue
+    batch_size = max(1, batch_tokens // lengths[end - 1])
+    for batch_start in range(start, end, batch_size):
+      batches.append((batch_start, min(batch_start + batch_size, end)))
+    start = end
+  return batches
+
+
+def _pad_ragged_inputs(values, offsets, max_input_size):
+  """Builds a padded [batch, length] int32 batch from ragged input ids.
+
+  Each row holds the ids of one input, truncated to max_input_size - 1 ids if
+  max_input_size > 0, followed by EOS_ID and zero padding.
+
+  Args:
+    values: the ragged values returned by TextEncoder.encode_batch.
+    offsets: the ragged offsets returned by TextEncoder.encode_batch.
+    max_input_size: int, maximum length of an input including EOS_ID, or <= 0
+      for no limit.
+
+  Returns:
+    an int32 numpy array.
+  """
+  lengths = np.diff(offsets)
+  if max_input_size > 0:
+    # Subtract 1 for the EOS_ID.
+    lengths = np.minimum(lengths, max_input_size - 1)
+  batch_length = lengths.max() + 1 if len(lengths) else 1
+  positions = np.arange(batch_length)
+  mask = positions < lengths[:, None]
+  batch_inputs = np.zeros([len(lengths), batch_length], np.int32)
+  batch_inputs[mask] = values[(offsets[:-1, None] + positions)[mask]]
+  batch_inputs[np.arange(len(lengths)), lengths] = text_encoder.EOS_ID
+  return batch_inputs
+
+
 def _interactive_input_fn(hparams):
   """Generator that reads from the terminal and yields "interactive inputs".
 
@@ -476,39 +708,71 @@ def show_and_save_image(img, save_path):
   plt.savefig(save_path)
 
 
-def _get_sorted_inputs(filename, num_shards=1, delimiter="\n"):
-  """Returning inputs sorted according to length.
+def _read_input_windows(filename, delimiter="\n", window_size=0, offset=0,
+                        chunk_size=2**20):
+  """Reads the inputs of a file in windows, without reading it all at once.
 
   Args:
     filename: path to file with inputs, 1 per line.
-    num_shards: number of input shards. If > 1, will read from file filename.XX,
-      where XX is FLAGS.worker_id.
-    delimiter: str, delimits records in the file.
+    delimiter: str, delimits records in the file. A delimiter at the end of
+      the file does not start another record.
+    window_size: int, number of inputs per window. If <= 0, all the inputs are
+      in one window.
+    offset: int, byte offset in the file of the first input to read.
+    chunk_size: int, number of bytes read at a time.
 
-  Returns:
-    a sorted list of inputs
+  Yields:
+    (inputs, end_offset) tuples, where inputs is a list of stripped str and
+    end_offset is the byte offset in the file after the last of them.
+  """
+  delimiter = tf.compat.as_bytes(delimiter)
+  inputs = []
+  pending = b""
+  with tf.gfile.Open(filename, "rb") as f:
+    f.seek(offset)
+    while True:
+      chunk = f.read(chunk_size)
+      if not chunk:
+        break
+      records = (pending + chunk).split(delimiter)
+      pending = records.pop()
+      for record in records:
+        inputs.append(tf.compat.as_str(record).strip())
+        offset += len(record) + len(delimiter)
+        if len(inputs) == window_size:
+          yield inputs, offset
+          inputs = []
+  if pending:
+    inputs.append(tf.compat.as_str(pending).strip())
+    offset += len(pending)
+  if inputs:
+    yield inputs, offset
+
+
+def _sort_inputs(inputs, vocabulary):
+  """Returning the ids of the inputs, sorted according to length.
+
+  Args:
+    inputs: list of str.
+    vocabulary: TextEncoder for the inputs.
 
+  Returns:
+    values: ragged ids of the inputs, sorted by their number of ids.
+    offsets: ragged offsets of the sorted inputs, see TextEncoder.encode_batch.
+    sorted_order: int array, sorted_order[i] is the index in inputs of the
+      i-th sorted input.
   """
-  tf.logging.info("Getting sorted inputs")
-  # read file and sort inputs according them according to input length.
-  if num_shards > 1:
-    decode_filename = filename + ("%.2d" % FLAGS.worker_id)
-  else:
-    decode_filename = filename
-  
-  with tf.gfile.Open(decode_filename) as f:
-    text = f.read()
-    records = text.split(delimiter)
-    inputs = [record.strip() for record in records]
-  input_lens = [(i, len(line.split())) for i, line in enumerate(inputs)]
-  sorted_input_lens = sorted(input_lens, key=operator.itemgetter(1))
-  # We'll need the keys to rearrange the inputs back into their original order
-  sorted_keys = {}
-  sorted_inputs = []
-  for i, (index, _) in enumerate(sorted_input_lens):
-    sorted_inputs.append(inputs[index])
-    sorted_keys[index] = i
-  return sorted_inputs, sorted_keys
+  values, offsets = vocabulary.encode_batch(inputs)
+  lengths = np.diff(offsets)
+  sorted_order = np.argsort(lengths, kind="mergesort")
+  sorted_lengths = lengths[sorted_order]
+  sorted_offsets = np.zeros(len(inputs) + 1, dtype=offsets.dtype)
+  np.cumsum(sorted_lengths, out=sorted_offsets[1:])
+  # Gather the ids of every sorted input from its offset in values.
+  sorted_values = values[
+      np.repeat(offsets[sorted_order] - sorted_offsets[:-1], sorted_lengths) +
+      np.arange(sorted_offsets[-1])]
+  return sorted_values, sorted_offsets, sorted_order
 
 
 def _save_until_eos(hyp):
@@ -0,0 +1,97 @@
+# coding=utf-8
+# Copyright 2017 The DLT2T Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for DLT2T.utils.decoding."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+# Dependency imports
+
+import numpy as np
+
+from DLT2T.data_generators import text_encoder
+from DLT2T.utils import decoding
+
+import tensorflow as tf
+
+
+class DecodingTest(tf.test.TestCase):
+
+  def testSortInputs(self):
+    inputs = ["a bb c", "", "dd e", "ffff", "g"]
+    vocab = text_encoder.ByteTextEncoder()
+    values, offsets, sorted_order = decoding._sort_inputs(inputs, vocab)
+
+    self.assertAllEqual([1, 4, 2, 3, 0], sorted_order)
+    self.assertEqual(
+        [vocab.encode(inputs[i]) for i in sorted_order],
+        [list(ids) for ids in text_encoder.ragged_to_ids(values, offsets)])
+
+  def testReadInputWindows(self):
+    filename = os.path.join(self.get_temp_dir(), "decode_inputs")
+    with tf.gfile.Open(filename, "w") as f:
+      f.write("a b\n c \n\nd\ne f\n")
+    windows = list(decoding._read_input_windows(
+        filename, window_size=2, chunk_size=3))
+    self.assertEqual([(["a b", "c"], 8), (["", "d"], 11), (["e f"], 15)],
+                     windows)
+
+    # Resume after the first window, and read everything in one window.
+    windows = list(decoding._read_input_windows(filename, offset=8))
+    self.assertEqual([(["", "d", "e f"], 15)], windows)
+    self.assertEqual([], list(decoding._read_input_windows(filename,
+                                                           offset=15)))
+
+  def testOrderedDecodesText(self):
+    # Sorted inputs 0-2 are at window positions 2, 0 and 1, and the batch of
+    # sorted input 2 was decoded first.
+    text = decoding._ordered_decodes_text(
+        ["b", "c", "a"], np.array([2, 0, 1]), [(2, 3), (0, 2)], "\n")
+    self.assertEqual(b"a\nb\nc\n", text)
+
+  def testTruncateFile(self):
+    filename = os.path.join(self.get_temp_dir(), "decodes")
+    with tf.gfile.Open(filename, "w") as f:
+      f.write("first\nsecond\npartial")
+    decoding._truncate_file(filename, 13, chunk_size=4)
+    with tf.gfile.Open(filename) as f:
+      self.assertEqual("first\nsecond\n", f.read())
+
+  def testTokenBudgetBatches(self):
+    lengths = np.array([2, 3, 3, 8, 9, 9, 10, 30, 40])
+    batches = decoding._token_budget_batches(
+        lengths, batch_tokens=20, min_length_bucket=8, length_bucket_step=2.0)
+
+    # Buckets are [0, 8), [8, 16), [16, 32) and [32, 64).
+    self.assertEqual([(0, 3), (3, 5), (5, 7), (7, 8), (8, 9)], batches)
+    for start, end in batches:
+      self.assertTrue(end - start == 1 or
+                      (end - start) * lengths[end - 1] <= 20)
+
+  def testDecodeBatchInputFn(self):
+    values, offsets = text_encoder.ids_to_ragged([[5, 6], [7], [8, 9, 10]])
+    examples = list(decoding._decode_batch_input_fn(
+        0, [(1, 3), (0, 1)], values, offsets, max_input_size=-1))
+
+    self.assertAllEqual([[7, 1, 0, 0], [8, 9, 10, 1]], examples[0]["inputs"])
+    self.assertAllEqual([[5, 6, 1]], examples[1]["inputs"])
+
+
+if __name__ == "__main__":
+  tf.test.main()
@@ -101,6 +101,7 @@ def build_input_fn(mode,
             mode,
             batch_size=batch_size,
             dataset_split=dataset_split,
+            train_mode=train_mode,
             name="problem_%d" % problem_idx)
         problem_batches.append(feature_map)
 
@@ -253,47 +254,52 @@ def features_for_problem(problem_instance,
                          mode,
                          batch_size=None,
                          dataset_split=None,
+                         train_mode=None,
                          name="problem_inputs"):
-  """Feature map for Problem."""
+  """Feature map for Problem.
+
+  Only the features of problem_instance.data_streams(mode, train_mode) are
+  read.
+  """
   with tf.name_scope(name):
     with tf.device("/cpu:0"):  # Input reading on CPU
       capacity = (p_hparams.max_expected_batch_size_per_shard * num_datashards)
-      batching_scheme = data_reader.hparams_to_batching_scheme(
-          hparams,
-          shard_multiplier=num_datashards,
-          drop_long_sequences=(mode == tf.estimator.ModeKeys.TRAIN or
-                               hparams.eval_drop_long_sequences),
-          length_multiplier=(p_hparams.batch_size_multiplier))
-      if batch_size:
-        # If batch_size is fixed, use a single input bucket
-        batching_scheme["batch_sizes"] = [batch_size]
-        batching_scheme["boundaries"] = []
-        # Log new batching scheme if updated
-        tf.logging.info("Updated batching_scheme = %s", batching_scheme)
-      feature_map = data_reader.input_pipeline(
-          problem_instance,
-          data_dir,
-          capacity,
-          mode,
-          hparams,
-          batching_scheme,
-          dataset_split=dataset_split)
+      # Every stream is batched on its own, and the batches of all streams
+      # make up the feature map.
+      feature_map = {}
+      for stream, features, batch_size_multiplier in (
+          problem_instance.data_streams(mode, train_mode)):
+        batching_scheme = data_reader.hparams_to_batching_scheme(
+            hparams,
+            shard_multiplier=num_datashards,
+            drop_long_sequences=(mode == tf.estimator.ModeKeys.TRAIN or
+                                 hparams.eval_drop_long_sequences),
+            length_multiplier=(p_hparams.batch_size_multiplier),
+            batch_size_multiplier=batch_size_multiplier)
+        if batch_size:
+          # If batch_size is fixed, use a single input bucket
+          batching_scheme["batch_sizes"] = [batch_size]
+          batching_scheme["boundaries"] = []
+          # Log new batching scheme if updated
+          tf.logging.info("Updated batching_scheme = %s", batching_scheme)
+        feature_map.update(data_reader.input_pipeline(
+            problem_instance,
+            data_dir,
+            capacity,
+            mode,
+            hparams,
+            batching_scheme,
+            dataset_split=dataset_split,
+            stream=stream,
+            features=features))
 
   # Ensure inputs and targets are proper rank.
   #if problem_instance.has_inputs:
-  while len(feature_map["A"].get_shape()) != 4:
-    feature_map["A"] = tf.expand_dims(feature_map["A"], axis=-1)
-  while len(feature_map["A_m"].get_shape()) != 4:
-    feature_map["A_m"] = tf.expand_dims(feature_map["A_m"], axis=-1)
-  while len(feature_map["A_hat"].get_shape()) != 4:
-    feature_map["A_hat"] = tf.expand_dims(feature_map["A_hat"], axis=-1)
-  
-  while len(feature_map["B"].get_shape()) != 4:
-    feature_map["B"] = tf.expand_dims(feature_map["B"], axis=-1)
-  while len(feature_map["B_m"].get_shape()) != 4:
-    feature_map["B_m"] = tf.expand_dims(feature_map["B_m"], axis=-1)
-  while len(feature_map["B_hat"].get_shape()) != 4:
-    feature_map["B_hat"] = tf.expand_dims(feature_map["B_hat"], axis=-1)
+  for field in ["A", "A_m", "A_hat", "B", "B_m", "B_hat"]:
+    if field not in feature_map:
+      continue
+    while len(feature_map[field].get_shape()) != 4:
+      feature_map[field] = tf.expand_dims(feature_map[field], axis=-1)
 
   #if problem_instance.has_inputs:
   feature_map["A_space_id"] = tf.constant(p_hparams.input_space_id)
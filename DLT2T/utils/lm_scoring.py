@@ -0,0 +1,266 @@
+# coding=utf-8
+# Copyright 2017 The DLT2T Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Language model scores of the dual learning data.
+
+The consistency loss of the dual mode (see model_builder.model_fn) reads the
+language model scores of the parallel sentences from the A_score and B_score
+features. This module computes them with a language model of the repo, e.g.
+attention_lm, and writes them directly into the dual learning TFRecords.
+
+Sentences are scored teacher-forced: the model runs once over each padded
+batch and the log-probabilities of the actual next tokens are gathered from
+its logits. The sentences of a file are sorted by length and packed into
+length-bucketed batches of a token budget, and files are scored in parallel
+by a pool of processes, each holding the language models on its own GPU.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import multiprocessing as mp
+import os
+
+# Dependency imports
+
+import numpy as np
+
+from DLT2T.data_generators import generator_utils
+from DLT2T.data_generators import problem_hparams
+from DLT2T.layers import common_layers
+from DLT2T.utils import decoding
+from DLT2T.utils import registry
+
+import tensorflow as tf
+
+# A language model checkpoint. Its variables are under the variable scope
+# `scope`, e.g. "A2B" for a model trained with train_mode=pretrain_A2B, whose
+# targets are the B sentences.
+LanguageModel = collections.namedtuple(
+    "LanguageModel",
+    ["model", "hparams_set", "hparams", "scope", "checkpoint_path"])
+
+# The score features and the features they score.
+SCORED_FEATURES = collections.OrderedDict([("A_score", "A"),
+                                           ("B_score", "B")])
+
+# Score types. "mean_nll" is the per-token negative log-likelihood, in the
+# units of the per-sentence losses of the consistency loss. "log_prob" is the
+# log-probability of the whole sentence.
+SCORE_TYPES = ("mean_nll", "log_prob")
+
+
+class LMScorer(object):
+  """Scores batches of sentences with a language model checkpoint."""
+
+  def __init__(self, language_model, vocab_size, session_config=None):
+    """Builds the model in its own graph and restores the checkpoint.
+
+    Args:
+      language_model: a LanguageModel.
+      vocab_size: size of the vocabulary of the sentences.
+      session_config: an optional tf.ConfigProto of the session.
+    """
+    hparams = registry.hparams(language_model.hparams_set)()
+    if language_model.hparams:
+      hparams = hparams.parse(language_model.hparams)
+    p_hparams = problem_hparams.test_problem_hparams(vocab_size, vocab_size)
+    # A language model only reads the targets.
+    p_hparams.input_modality = {}
+    hparams.problems = [p_hparams]
+
+    self._graph = tf.Graph()
+    with self._graph.as_default():
+      self._targets = tf.placeholder(tf.int32, [None, None], name="targets")
+      model = registry.model(language_model.model)(
+          hparams, tf.estimator.ModeKeys.EVAL, p_hparams)
+      with tf.variable_scope(language_model.scope or tf.get_variable_scope()):
+        sharded_logits, _ = model.model_fn({
+            "targets": tf.expand_dims(tf.expand_dims(self._targets, 2), 3)
+        })
+      logits = tf.squeeze(tf.concat(sharded_logits, 0), [2, 3])
+      token_log_probs = -tf.nn.sparse_softmax_cross_entropy_with_logits(
+          labels=self._targets, logits=logits)
+      weights = common_layers.weights_nonzero(self._targets)
+      self._log_probs = tf.reduce_sum(token_log_probs * weights, 1)
+      self._num_tokens = tf.reduce_sum(weights, 1)
+
+      checkpoint_path = language_model.checkpoint_path
+      if tf.gfile.IsDirectory(checkpoint_path):
+        checkpoint_path = tf.train.latest_checkpoint(checkpoint_path)
+      self._session = tf.Session(config=session_config)
+      tf.train.Saver().restore(self._session, checkpoint_path)
+    tf.logging.info("Loaded language model %s." % checkpoint_path)
+
+  def score(self, targets):
+    """Returns the log-probabilities and token counts of a padded batch.
+
+    Args:
+      targets: int32 array [batch, length] of ids, padded with 0s.
+
+    Returns:
+      log_probs: float array [batch], the log-probability of every sentence.
+      num_tokens: float array [batch], the number of non-padding ids.
+    """
+    return self._session.run([self._log_probs, self._num_tokens],
+                             {self._targets: targets})
+
+  def close(self):
+    self._session.close()
+
+
+def score_ids(scorer, ids, batch_tokens, score_type="mean_nll"):
+  """Scores sentences in length-bucketed batches of batch_tokens tokens.
+
+  Args:
+    scorer: an LMScorer.
+    ids: list of sequences of ids, each ending with EOS_ID.
+    batch_tokens: int, maximum number of tokens of a batch, padding included.
+    score_type: one of SCORE_TYPES.
+
+  Returns:
+    a float32 array of the scores of ids, in order.
+  """
+  if score_type not in SCORE_TYPES:
+    raise ValueError("Unknown score type %s, expected one of %s." %
+                     (score_type, SCORE_TYPES))
+  # Empty sequences are scored in a batch of length 1 of padding.
+  lengths = np.maximum(np.array([len(x) for x in ids], dtype=np.int64), 1)
+  sorted_order = np.argsort(lengths, kind="mergesort")
+  scores = np.zeros(len(ids), dtype=np.float32)
+  for start, end in decoding._token_budget_batches(  # pylint: disable=protected-access
+      lengths[sorted_order], batch_tokens):
+    rows = sorted_order[start:end]
+    batch = np.zeros([len(rows), lengths[rows[-1]]], dtype=np.int32)
+    for i, row in enumerate(rows):
+      batch[i, :len(ids[row])] = ids[row]
+    log_probs, num_tokens = scorer.score(batch)
+    if score_type == "mean_nll":
+      scores[rows] = -log_probs / np.maximum(num_tokens, 1.0)
+    else:
+      scores[rows] = log_probs
+  return scores
+
+
+def score_file(filename, scorers, batch_tokens, score_type="mean_nll"):
+  """Writes the scores of the examples of a TFRecord file into the file.
+
+  The file is rewritten with its score features replaced, or added if it had
+  none, and its examples in their order.
+
+  Args:
+    filename: path of a TFRecord file of tf.Examples.
+    scorers: dict of a score feature of SCORED_FEATURES to its LMScorer.
+    batch_tokens: int, maximum number of tokens of a batch, padding included.
+    score_type: one of SCORE_TYPES.
+
+  Returns:
+    the number of scored examples.
+  """
+  examples = [tf.train.Example.FromString(record)
+              for record in generator_utils.read_records(filename)]
+  for score_feature, scorer in sorted(scorers.items()):
+    feature = SCORED_FEATURES[score_feature]
+    scores = score_ids(
+        scorer,
+        [example.features.feature[feature].int64_list.value
+         for example in examples],
+        batch_tokens, score_type)
+    for example, score in zip(examples, scores.tolist()):
+      example.features.feature[score_feature].float_list.value[:] = [score]
+
+  tmp_filename = filename + ".scoring"
+  generator_utils.write_records(
+      [example.SerializeToString() for example in examples], tmp_filename)
+  tf.gfile.Rename(tmp_filename, filename, overwrite=True)
+  return len(examples)
+
+
+def score_files(filenames,
+                language_models,
+                vocab_size,
+                batch_tokens=4096,
+                score_type="mean_nll",
+                num_workers=1,
+                gpus=None):
+  """Writes language model scores into dual learning TFRecord files.
+
+  With num_workers > 1, files are scored by a pool of processes, each of which
+  loads every language model once. The processes are spread round-robin over
+  gpus.
+
+  Args:
+    filenames: list of paths of TFRecord files of tf.Examples.
+    language_models: dict of a score feature of SCORED_FEATURES to the
+      LanguageModel scoring it.
+    vocab_size: size of the vocabulary of the examples.
+    batch_tokens: int, maximum number of tokens of a batch, padding included.
+    score_type: one of SCORE_TYPES.
+    num_workers: number of scoring processes.
+    gpus: optional list of GPU ids; every process sees one of them.
+  """
+  init_args = (language_models, vocab_size, batch_tokens, score_type)
+  counter = 0
+  if num_workers <= 1:
+    _init_score_worker(*init_args)
+    for filename in filenames:
+      counter += _score_file(filename)
+    tf.logging.info("Scored %d examples." % counter)
+    return
+
+  gpu_queue = mp.Queue()
+  for worker_id in range(num_workers):
+    gpu_queue.put(gpus[worker_id % len(gpus)] if gpus else None)
+  pool = mp.Pool(num_workers, initializer=_init_score_worker,
+                 initargs=init_args + (gpu_queue,))
+  try:
+    for num_examples in pool.imap_unordered(_score_file, filenames):
+      counter += num_examples
+    pool.close()
+  except:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+  tf.logging.info("Scored %d examples." % counter)
+
+
+# Per-process state of the score_files workers.
+_worker_state = {}
+
+
+def _init_score_worker(language_models, vocab_size, batch_tokens, score_type,
+                       gpu_queue=None):
+  if gpu_queue is not None:
+    gpu = gpu_queue.get()
+    if gpu is not None:
+      # Set before the first session of the process initializes CUDA.
+      os.environ["CUDA_VISIBLE_DEVICES"] = str(gpu)
+  _worker_state["scorers"] = {
+      score_feature: LMScorer(language_model, vocab_size)
+      for score_feature, language_model in language_models.items()
+  }
+  _worker_state["batch_tokens"] = batch_tokens
+  _worker_state["score_type"] = score_type
+
+
+def _score_file(filename):
+  num_examples = score_file(filename, _worker_state["scorers"],
+                            _worker_state["batch_tokens"],
+                            _worker_state["score_type"])
+  tf.logging.info("Scored %d examples of %s." % (num_examples, filename))
+  return num_examples
@@ -0,0 +1,116 @@
+# coding=utf-8
+# Copyright 2017 The DLT2T Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for DLT2T.utils.lm_scoring."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+# Dependency imports
+
+import numpy as np
+
+from DLT2T.data_generators import generator_utils
+from DLT2T.data_generators import problem_hparams
+from DLT2T.models import attention_lm  # pylint: disable=unused-import
+from DLT2T.utils import lm_scoring
+from DLT2T.utils import registry
+
+import tensorflow as tf
+
+
+class SumScorer(object):
+  """Scores a sentence with minus the sum of its ids, and records batches."""
+
+  def __init__(self):
+    self.batches = []
+
+  def score(self, targets):
+    self.batches.append(targets)
+    return -targets.sum(1).astype(np.float32), (targets != 0).sum(1)
+
+
+class LMScoringTest(tf.test.TestCase):
+
+  def testScoreIds(self):
+    ids = [[3, 4, 1], [2, 1], [5, 6, 7, 8, 1], [1]]
+    scorer = SumScorer()
+    scores = lm_scoring.score_ids(scorer, ids, batch_tokens=6,
+                                  score_type="log_prob")
+    self.assertAllClose([-8.0, -3.0, -27.0, -1.0], scores)
+    for batch in scorer.batches:
+      self.assertLessEqual(batch.size, 6)
+
+    scores = lm_scoring.score_ids(SumScorer(), ids, batch_tokens=6)
+    self.assertAllClose([8.0 / 3, 1.5, 27.0 / 5, 1.0], scores)
+
+  def testScoreFile(self):
+    filename = os.path.join(self.get_temp_dir(), "dual-train-00000-of-00001")
+    generator_utils.generate_files(
+        iter([{"A": [2, 1], "B": [3, 4, 1], "A_score": [-9.0]},
+              {"A": [5, 6, 1], "B": [7, 1]}]), [filename])
+    num_examples = lm_scoring.score_file(
+        filename, {"A_score": SumScorer(), "B_score": SumScorer()},
+        batch_tokens=16, score_type="log_prob")
+
+    self.assertEqual(2, num_examples)
+    examples = [tf.train.Example.FromString(record)
+                for record in generator_utils.read_records(filename)]
+    self.assertEqual(
+        [([-3.0], [-8.0], [2, 1]), ([-12.0], [-8.0], [5, 6, 1])],
+        [(list(example.features.feature["A_score"].float_list.value),
+          list(example.features.feature["B_score"].float_list.value),
+          list(example.features.feature["A"].int64_list.value))
+         for example in examples])
+
+  def testLMScorerIgnoresPadding(self):
+    vocab_size = 10
+    hparams_overrides = "hidden_size=8,filter_size=16,num_hidden_layers=1"
+    language_model = lm_scoring.LanguageModel(
+        "attention_lm", "attention_lm_base", hparams_overrides, "A2B",
+        os.path.join(self.get_temp_dir(), "lm"))
+    # Save a randomly initialized model.
+    with tf.Graph().as_default():
+      hparams = registry.hparams("attention_lm_base")()
+      hparams = hparams.parse(hparams_overrides)
+      p_hparams = problem_hparams.test_problem_hparams(vocab_size, vocab_size)
+      p_hparams.input_modality = {}
+      hparams.problems = [p_hparams]
+      model = registry.model("attention_lm")(
+          hparams, tf.estimator.ModeKeys.EVAL, p_hparams)
+      with tf.variable_scope("A2B"):
+        model.model_fn({"targets": tf.zeros([1, 1, 1, 1], dtype=tf.int32)})
+      with tf.Session() as session:
+        session.run(tf.global_variables_initializer())
+        tf.train.Saver().save(session, language_model.checkpoint_path)
+
+    scorer = lm_scoring.LMScorer(language_model, vocab_size)
+    alone_log_probs, alone_num_tokens = scorer.score(
+        np.array([[3, 4, 1]], dtype=np.int32))
+    log_probs, num_tokens = scorer.score(
+        np.array([[3, 4, 1, 0, 0], [5, 6, 7, 8, 1]], dtype=np.int32))
+    scorer.close()
+
+    self.assertAllClose([3.0, 5.0], num_tokens)
+    self.assertAllClose(alone_num_tokens, num_tokens[:1])
+    self.assertAllClose(alone_log_probs, log_probs[:1], atol=1e-5)
+    self.assertTrue(np.all(log_probs < 0.0))
+
+
+if __name__ == "__main__":
+  tf.test.main()
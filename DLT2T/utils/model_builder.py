@@ -35,6 +35,7 @@ from DLT2T.utils import devices
 from DLT2T.utils import input_fn_builder
 from DLT2T.utils import metrics
 from DLT2T.utils import registry
+from DLT2T.utils import shortlist
 from DLT2T.utils import yellowfin
 from DLT2T.data_generators import problem
 
@@ -132,6 +133,9 @@ def model_fn(model,
           features["inputs"] = features.get("A", features["inputs"])
           features["input_space_id"] = features.get("A_space_id", features["input_space_id"])
           features["target_space_id"] = features.get("B_space_id", features["target_space_id"])
+          if decode_hp.shortlist_file:
+            features["shortlist"] = _shortlist(features["inputs"], decode_hp,
+                                               "A2B")
           return model_class.infer(
               features,
               beam_size=decode_hp.beam_size,
@@ -144,6 +148,9 @@ def model_fn(model,
           features["inputs"] = features.get("B", features["inputs"])
           features["input_space_id"] = features.get("B_space_id", features["target_space_id"])
           features["target_space_id"] = features.get("A_space_id", features["input_space_id"])
+          if decode_hp.shortlist_file:
+            features["shortlist"] = _shortlist(features["inputs"], decode_hp,
+                                               "B2A")
           return model_class.infer(
               features,
               beam_size=decode_hp.beam_size,
@@ -372,8 +379,17 @@ def model_fn(model,
     else: #train_mode == "dual"
       assert train_mode == "dual", "train mode is unknown"
       total_loss = total_loss_A2B + total_loss_B2A
-      lm_scores_A = tf.squeeze(features["A_score"])
-      lm_scores_B = tf.squeeze(features["B_score"])
+      # Data without scores would parse as empty scores, and an empty
+      # consistency loss.
+      score_checks = [
+          tf.assert_positive(
+              tf.size(features[score_feature]),
+              message="No %s in the dual-mode data, score it with "
+              "dual-t2t-lm-score." % score_feature)
+          for score_feature in ["A_score", "B_score"]]
+      with tf.control_dependencies(score_checks):
+        lm_scores_A = tf.squeeze(features["A_score"])
+        lm_scores_B = tf.squeeze(features["B_score"])
       lm_decay = tf.constant(0.3)
       trade_off = tf.constant(0.01)
       consistence_loss = (lm_decay * lm_scores_A + A2B_loss_value - lm_decay * lm_scores_B - B2A_loss_value) ** 2
@@ -743,6 +759,15 @@ def _get_variable_initializer(hparams):
     raise ValueError("Unrecognized initializer: %s" % hparams.initializer)
 
 
+def _shortlist(inputs, decode_hp, direction):
+  """The shortlist ids of a batch of inputs translated in direction."""
+  lexicon, frequent = shortlist.load_shortlist_table(
+      decode_hp.shortlist_file, direction,
+      num_translations=decode_hp.shortlist_translations,
+      num_frequent=decode_hp.shortlist_frequent)
+  return shortlist.shortlist_ids(inputs, lexicon, frequent)
+
+
 def learning_rate_decay(hparams, num_worker_replicas=1, num_train_steps=1):
   """Inverse-decay learning rate until warmup_steps, then decay."""
   warmup_steps = tf.to_float(
@@ -55,16 +55,15 @@ def _len_lcs(x, y):
   Returns
     integer: Length of LCS between x and y
   """
-  table = _lcs(x, y)
-  n, m = len(x), len(y)
-  return table[n, m]
+  return int(_len_lcs_batch([x], [y])[0])
 
 
 def _lcs(x, y):
   """Computes the length of the LCS between two seqs.
 
   The implementation below uses a DP programming algorithm and runs
-  in O(nm) time where n = len(x) and m = len(y).
+  in O(nm) time where n = len(x) and m = len(y). Each row is computed with
+  NumPy from the previous one, see _next_lcs_row.
   Source: http://www.algorithmist.com/index.php/Longest_Common_Subsequence
 
   Args:
@@ -72,21 +71,94 @@ def _lcs(x, y):
     y: collection of words
 
   Returns:
-    Table of dictionary of coord and len lcs
+    An int array of shape [n + 1, m + 1]; entry [i, j] is the length of the
+    LCS of x[:i] and y[:j].
   """
-  n, m = len(x), len(y)
-  table = dict()
-  for i in range(n + 1):
-    for j in range(m + 1):
-      if i == 0 or j == 0:
-        table[i, j] = 0
-      elif x[i - 1] == y[j - 1]:
-        table[i, j] = table[i - 1, j - 1] + 1
-      else:
-        table[i, j] = max(table[i - 1, j], table[i, j - 1])
+  x_ids, y_ids = _to_padded_ids([x], [y])
+  table = np.zeros((len(x) + 1, len(y) + 1), dtype=np.int64)
+  for i in range(len(x)):
+    table[i + 1] = _next_lcs_row(table[i:i + 1], x_ids[:, i:i + 1], y_ids)
   return table
 
 
+def _len_lcs_batch(xs, ys):
+  """Returns the LCS lengths of pairs of sequences.
+
+  Keeps a single DP row per pair, of shape [batch, max_len_y + 1], and
+  updates the rows of all pairs together for each position of x.
+
+  Args:
+    xs: list of sequences of words
+    ys: list of sequences of words, of the same length as xs
+
+  Returns:
+    An int array with the length of the LCS of each (x, y) pair.
+  """
+  x_ids, y_ids = _to_padded_ids(xs, ys)
+  row = np.zeros((len(xs), y_ids.shape[1] + 1), dtype=np.int64)
+  for i in range(x_ids.shape[1]):
+    row = _next_lcs_row(row, x_ids[:, i:i + 1], y_ids)
+  return row[:, -1]
+
+
+def _next_lcs_row(row, x_tokens, y_ids):
+  """Computes row i + 1 of the LCS tables from row i.
+
+  With t[j] = max(row[j], row[j - 1] + (x[i] == y[j - 1])), the recurrence
+  next[j] = max(t[j], next[j - 1]) makes next the running maximum of t.
+
+  Args:
+    row: int array [batch, m + 1], row i of the tables.
+    x_tokens: int array [batch, 1], the ids of x[i].
+    y_ids: int array [batch, m].
+
+  Returns:
+    An int array [batch, m + 1], row i + 1 of the tables.
+  """
+  next_row = np.empty_like(row)
+  next_row[:, 0] = 0
+  np.maximum(row[:, 1:], row[:, :-1] + (x_tokens == y_ids),
+             out=next_row[:, 1:])
+  return np.maximum.accumulate(next_row, axis=1)
+
+
+def _to_padded_ids(xs, ys):
+  """Maps the words of xs and ys to int ids in two padded arrays.
+
+  The padding of xs and ys uses different negative ids, so padding never
+  matches.
+
+  Args:
+    xs: list of sequences of words
+    ys: list of sequences of words
+
+  Returns:
+    Two int arrays of shapes [len(xs), max_len_x] and [len(ys), max_len_y].
+  """
+  seqs = list(xs) + list(ys)
+  lengths = np.array([len(seq) for seq in seqs], dtype=np.int64)
+  if lengths.sum():
+    words = np.concatenate([np.asarray(seq).ravel() for seq in seqs
+                            if len(seq)])
+    if (np.issubdtype(words.dtype, np.integer) and words.min() >= 0 and
+        words.max() < 2**31):
+      ids = words.astype(np.int64)
+    else:
+      _, ids = np.unique(words, return_inverse=True)
+  else:
+    ids = np.zeros([0], dtype=np.int64)
+  ids = np.split(ids.ravel(), np.cumsum(lengths)[:-1])
+
+  def pad(id_seqs, pad_id):
+    padded = np.full((len(id_seqs), max([len(s) for s in id_seqs] + [0])),
+                     pad_id, dtype=np.int64)
+    for k, id_seq in enumerate(id_seqs):
+      padded[k, :len(id_seq)] = id_seq
+    return padded
+
+  return pad(ids[:len(xs)], -1), pad(ids[len(xs):], -2)
+
+
 def _f_lcs(llcs, m, n):
   """Computes the LCS-based F-measure score.
 
@@ -135,12 +207,13 @@ def rouge_l_sentence_level(eval_sentences, ref_sentences):
     A float: F_lcs
   """
 
-  f1_scores = []
-  for eval_sentence, ref_sentence in zip(eval_sentences, ref_sentences):
-    m = len(ref_sentence)
-    n = len(eval_sentence)
-    lcs = _len_lcs(eval_sentence, ref_sentence)
-    f1_scores.append(_f_lcs(lcs, m, n))
+  num_pairs = min(len(eval_sentences), len(ref_sentences))
+  eval_sentences = eval_sentences[:num_pairs]
+  ref_sentences = ref_sentences[:num_pairs]
+  m = np.array([len(ref_sentence) for ref_sentence in ref_sentences])
+  n = np.array([len(eval_sentence) for eval_sentence in eval_sentences])
+  lcs = _len_lcs_batch(eval_sentences, ref_sentences)
+  f1_scores = _f_lcs(lcs, m, n)
   return np.mean(f1_scores, dtype=np.float32)
 
 
@@ -199,32 +272,81 @@ def rouge_n(eval_sentences, ref_sentences, n=2):
     f1 score for ROUGE-N
   """
 
-  f1_scores = []
-  for eval_sentence, ref_sentence in zip(eval_sentences, ref_sentences):
-    eval_ngrams = _get_ngrams(n, eval_sentence)
-    ref_ngrams = _get_ngrams(n, ref_sentence)
-    ref_count = len(ref_ngrams)
-    eval_count = len(eval_ngrams)
+  num_pairs = min(len(eval_sentences), len(ref_sentences))
+  eval_counts, ref_counts, overlapping_counts = _ngram_set_counts(
+      eval_sentences[:num_pairs], ref_sentences[:num_pairs], n)
 
-    # Gets the overlapping ngrams between evaluated and reference
-    overlapping_ngrams = eval_ngrams.intersection(ref_ngrams)
-    overlapping_count = len(overlapping_ngrams)
+  # Handle edge case. This isn't mathematically correct, but it's good enough
+  precision = overlapping_counts / np.maximum(eval_counts, 1)
+  recall = overlapping_counts / np.maximum(ref_counts, 1)
+  f1_scores = 2.0 * ((precision * recall) / (precision + recall + 1e-8))
 
-    # Handle edge case. This isn't mathematically correct, but it's good enough
-    if eval_count == 0:
-      precision = 0.0
-    else:
-      precision = overlapping_count / eval_count
+  # return overlapping_count / reference_count
+  return np.mean(f1_scores, dtype=np.float32)
 
-    if ref_count == 0:
-      recall = 0.0
-    else:
-      recall = overlapping_count / ref_count
 
-    f1_scores.append(2.0 * ((precision * recall) / (precision + recall + 1e-8)))
+def _ngram_set_counts(eval_sentences, ref_sentences, n):
+  """Counts the distinct n-grams of pairs of sentences and their overlap.
 
-  # return overlapping_count / reference_count
-  return np.mean(f1_scores, dtype=np.float32)
+  Equivalent to comparing the _get_ngrams sets of every pair. The n-grams are
+  encoded as int64 codes with sliding windows over the padded sentences, and
+  combined with the index of their pair, so that the sets and intersections
+  of the whole batch become np.unique and np.intersect1d.
+
+  Args:
+    eval_sentences: list of sequences of words
+    ref_sentences: list of sequences of words, of the same length
+    n: Size of ngram.
+
+  Returns:
+    Three int arrays with, for each pair, the number of distinct n-grams of the
+    evaluated and reference sentences, and the number of n-grams in both.
+  """
+  num_pairs = len(eval_sentences)
+  if not num_pairs:
+    return tuple(np.zeros([0], dtype=np.int64) for _ in range(3))
+  padded_ids = _to_padded_ids(eval_sentences, ref_sentences)
+  vocab_size = max([ids.max(initial=0) for ids in padded_ids]) + 1
+  int64_max = np.iinfo(np.int64).max
+
+  # The code and validity of the n-gram starting at each position.
+  codes, valid = [], []
+  for ids in padded_ids:
+    width = max(ids.shape[1] - n + 1, 0)
+    codes.append(np.maximum(ids[:, :width], 0))
+    valid.append(ids[:, :width] >= 0)
+  code_bound = vocab_size
+  for k in range(1, n + 1):
+    if k == n or code_bound > int64_max // vocab_size:
+      # Renumber the codes densely so that they cannot overflow.
+      unique_codes, inverse = np.unique(
+          np.concatenate([c.ravel() for c in codes]), return_inverse=True)
+      inverse = inverse.ravel()
+      codes = [inverse[:codes[0].size].reshape(codes[0].shape),
+               inverse[codes[0].size:].reshape(codes[1].shape)]
+      code_bound = max(len(unique_codes), 1)
+    if k == n:
+      break
+    for side, ids in enumerate(padded_ids):
+      window = ids[:, k:k + codes[side].shape[1]]
+      codes[side] = codes[side] * vocab_size + np.maximum(window, 0)
+      valid[side] &= window >= 0
+    code_bound *= vocab_size
+
+  pair_index = np.arange(num_pairs, dtype=np.int64)[:, None]
+  eval_keys, ref_keys = [_sorted_unique((pair_index * code_bound + c)[v])
+                         for c, v in zip(codes, valid)]
+  overlapping_keys = np.intersect1d(eval_keys, ref_keys, assume_unique=True)
+  return tuple(np.bincount(keys // code_bound, minlength=num_pairs)
+               for keys in (eval_keys, ref_keys, overlapping_keys))
+
+
+def _sorted_unique(values):
+  """Like np.unique, always sorting."""
+  values = np.sort(values)
+  if values.size:
+    values = values[np.concatenate([[True], values[1:] != values[:-1]])]
+  return values
 
 
 def rouge_2_fscore(predictions, labels, **unused_kwargs):
@@ -52,6 +52,21 @@ class TestRouge2Metric(tf.test.TestCase):
     self.assertAllClose(rouge.rouge_n(hypotheses, references), 0.53, atol=1e-03)
 
 
+  def testRouge2MatchesNgramSets(self):
+    hypotheses = [[1, 2, 1, 2, 3], [4, 5], [6]]
+    references = [[1, 2, 3, 1, 2], [5, 4, 5, 4], [6, 7]]
+    f1_scores = []
+    for hypothesis, reference in zip(hypotheses, references):
+      hypothesis_ngrams = rouge._get_ngrams(2, hypothesis)
+      reference_ngrams = rouge._get_ngrams(2, reference)
+      overlap = len(hypothesis_ngrams & reference_ngrams)
+      precision = overlap / max(len(hypothesis_ngrams), 1)
+      recall = overlap / max(len(reference_ngrams), 1)
+      f1_scores.append(2.0 * precision * recall / (precision + recall + 1e-8))
+    self.assertAllClose(rouge.rouge_n(hypotheses, references),
+                        np.mean(f1_scores), atol=1e-06)
+
+
 class TestRougeLMetric(tf.test.TestCase):
   """Tests the rouge-l metric."""
 
@@ -79,6 +94,20 @@ class TestRougeLMetric(tf.test.TestCase):
         rouge.rouge_l_sentence_level(hypotheses, references), 0.837, atol=1e-03)
 
 
+  def testLcsTable(self):
+    table = rouge._lcs([1, 2, 3, 2], [2, 1, 2])
+    self.assertAllEqual([[0, 0, 0, 0],
+                         [0, 0, 1, 1],
+                         [0, 1, 1, 2],
+                         [0, 1, 1, 2],
+                         [0, 1, 1, 2]], table.tolist())
+
+  def testLenLcsBatch(self):
+    xs = [[1, 2, 3, 4], ["a", "b"], [5]]
+    ys = [[2, 4, 1, 3], ["b", "a", "b"], [6, 7]]
+    self.assertAllEqual([2, 2, 0], rouge._len_lcs_batch(xs, ys))
+
+
 class TestRougeMetricsE2E(tf.test.TestCase):
   """Tests the rouge metrics end-to-end."""
 
@@ -0,0 +1,223 @@
+# coding=utf-8
+# Copyright 2017 The DLT2T Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Vocabulary shortlists of fast decoding.
+
+A shortlist is the set of target ids a batch may decode: the reserved ids,
+the ids of its sources, their most likely translations in a lexical table and
+the most frequent target ids. With decode_hparams.shortlist_file, fast
+decoding only computes the logits of the shortlist rows of the softmax
+weights (see SymbolModality.top), instead of the whole vocabulary.
+
+The reserved ids come first, in order, so that the positions of the padding
+and EOS ids in a shortlist are their ids.
+
+A shortlist file holds the tables of both directions of the dual learning
+problem, see build_lexical_table and save_shortlist_tables.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import io
+
+# Dependency imports
+
+import numpy as np
+import six
+from six.moves import xrange  # pylint: disable=redefined-builtin
+
+from DLT2T.data_generators import text_encoder
+
+import tensorflow as tf
+
+DIRECTIONS = ("A2B", "B2A")
+
+
+def build_lexical_table(sentence_pairs, vocab_size, num_translations=50,
+                        num_frequent=5000, chunk_size=100000):
+  """Builds the lexical table of a direction from parallel sentences.
+
+  Source and target ids are scored by the Dice coefficient of the sentence
+  pairs they occur in, and every source id keeps its num_translations best
+  target ids. Reserved ids are left out, every shortlist has them.
+
+  Args:
+    sentence_pairs: iterable of (source ids, target ids) pairs.
+    vocab_size: size of the vocabulary.
+    num_translations: number of translations kept per source id.
+    num_frequent: number of most frequent target ids kept.
+    chunk_size: number of sentence pairs whose co-occurrences are counted
+      at a time.
+
+  Returns:
+    lexicon: int32 array [vocab_size, num_translations], the translations of
+      every source id, best first, padded with 0s.
+    frequent: int32 array of at most num_frequent target ids, most frequent
+      first.
+  """
+  source_counts = np.zeros(vocab_size, dtype=np.int64)
+  target_counts = np.zeros(vocab_size, dtype=np.int64)
+  token_counts = np.zeros(vocab_size, dtype=np.int64)
+  pair_keys = np.zeros(0, dtype=np.int64)
+  pair_counts = np.zeros(0, dtype=np.int64)
+  chunk = []
+
+  def merge(pair_keys, pair_counts):
+    keys = np.concatenate(chunk + [pair_keys])
+    counts = np.concatenate([np.ones(len(keys) - len(pair_keys), np.int64),
+                             pair_counts])
+    pair_keys, inverse = np.unique(keys, return_inverse=True)
+    pair_counts = np.bincount(inverse, weights=counts).astype(np.int64)
+    del chunk[:]
+    return pair_keys, pair_counts
+
+  for source, target in sentence_pairs:
+    target = np.asarray(target, dtype=np.int64)
+    np.add.at(token_counts, target, 1)
+    source = np.unique(source).astype(np.int64)
+    target = np.unique(target)
+    source = source[source >= text_encoder.NUM_RESERVED_TOKENS]
+    target = target[target >= text_encoder.NUM_RESERVED_TOKENS]
+    source_counts[source] += 1
+    target_counts[target] += 1
+    chunk.append((source[:, None] * vocab_size + target[None, :]).ravel())
+    if len(chunk) == chunk_size:
+      pair_keys, pair_counts = merge(pair_keys, pair_counts)
+  if chunk:
+    pair_keys, pair_counts = merge(pair_keys, pair_counts)
+
+  sources, targets = pair_keys // vocab_size, pair_keys % vocab_size
+  dice = 2.0 * pair_counts / (source_counts[sources] + target_counts[targets])
+  order = np.lexsort((-dice, sources))
+  sources, targets = sources[order], targets[order]
+  group_starts = np.searchsorted(sources, sources)
+  ranks = np.arange(len(sources)) - group_starts
+  kept = ranks < num_translations
+  lexicon = np.zeros([vocab_size, num_translations], dtype=np.int32)
+  lexicon[sources[kept], ranks[kept]] = targets[kept]
+
+  token_counts[:text_encoder.NUM_RESERVED_TOKENS] = 0
+  frequent = np.argsort(-token_counts, kind="mergesort")[:num_frequent]
+  frequent = frequent[token_counts[frequent] > 0].astype(np.int32)
+  return lexicon, frequent
+
+
+def save_shortlist_tables(filename, tables):
+  """Writes the lexical tables of some directions to filename.
+
+  Args:
+    filename: path of the shortlist file.
+    tables: dict of a direction of DIRECTIONS to its (lexicon, frequent), as
+      returned by build_lexical_table.
+  """
+  arrays = {}
+  for direction, (lexicon, frequent) in six.iteritems(tables):
+    arrays[direction + "_lexicon"] = lexicon
+    arrays[direction + "_frequent"] = frequent
+  # np.savez seeks in its output, which a write-only GFile does not allow.
+  buf = io.BytesIO()
+  np.savez(buf, **arrays)
+  with tf.gfile.Open(filename, "wb") as f:
+    f.write(buf.getvalue())
+
+
+def load_shortlist_table(filename, direction, num_translations=None,
+                         num_frequent=None):
+  """Reads the lexical table of a direction from a shortlist file.
+
+  Args:
+    filename: path of the shortlist file.
+    direction: one of DIRECTIONS.
+    num_translations: optional number of translations per source id to keep,
+      at most the number stored.
+    num_frequent: optional number of most frequent target ids to keep.
+
+  Returns:
+    lexicon: int32 array [vocab_size, num_translations].
+    frequent: int32 array of at most num_frequent ids.
+  """
+  with tf.gfile.Open(filename, "rb") as f:
+    arrays = np.load(f)
+    lexicon = arrays[direction + "_lexicon"][:, :num_translations]
+    frequent = arrays[direction + "_frequent"][:num_frequent]
+  return lexicon, frequent
+
+
+def shortlist_ids(inputs, lexicon, frequent):
+  """The shortlist of a batch of inputs.
+
+  Args:
+    inputs: int Tensor of source ids, of any shape, padded with 0s.
+    lexicon: int32 array [vocab_size, num_translations].
+    frequent: int32 array of target ids.
+
+  Returns:
+    an int32 Tensor [shortlist size] of distinct ids, starting with the
+    reserved ids.
+  """
+  source = tf.reshape(tf.to_int32(inputs), [-1])
+  candidates = tf.concat([
+      tf.range(text_encoder.NUM_RESERVED_TOKENS),
+      tf.constant(frequent, dtype=tf.int32),
+      source,
+      tf.reshape(tf.gather(tf.constant(lexicon, dtype=tf.int32), source), [-1]),
+  ], 0)
+  ids, _ = tf.unique(candidates)
+  return ids
+
+
+def batch_shortlist(sources, lexicon, frequent):
+  """The shortlist of a batch of source id lists, as shortlist_ids.
+
+  Returns:
+    an int32 array [shortlist size] of distinct ids, starting with the
+    reserved ids.
+  """
+  source = np.concatenate([np.zeros(0, dtype=np.int32)] +
+                          [np.asarray(s, dtype=np.int32) for s in sources])
+  candidates = np.concatenate([
+      np.arange(text_encoder.NUM_RESERVED_TOKENS, dtype=np.int32), frequent,
+      source, lexicon[source].ravel()])
+  _, first = np.unique(candidates, return_index=True)
+  return candidates[np.sort(first)]
+
+
+def shortlist_coverage(sentence_pairs, lexicon, frequent, batch_size=32):
+  """Measures how well the shortlists of batches cover their targets.
+
+  A target id outside of the shortlist of its batch can not be decoded, so
+  the coverage of the references bounds the quality loss of shortlists.
+
+  Args:
+    sentence_pairs: list of (source ids, target ids) pairs, batched in order.
+    lexicon: int32 array [vocab_size, num_translations].
+    frequent: int32 array of target ids.
+    batch_size: number of sentences of a batch.
+
+  Returns:
+    coverage: fraction of the target ids in the shortlist of their batch.
+    mean_size: mean size of the shortlists.
+  """
+  num_covered, num_targets, sizes = 0, 0, []
+  for start in xrange(0, len(sentence_pairs), batch_size):
+    batch = sentence_pairs[start:start + batch_size]
+    ids = batch_shortlist([source for source, _ in batch], lexicon, frequent)
+    sizes.append(len(ids))
+    for _, target in batch:
+      num_covered += np.isin(target, ids).sum()
+      num_targets += len(target)
+  return num_covered / max(num_targets, 1), float(np.mean(sizes or [0]))
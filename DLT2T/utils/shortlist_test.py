@@ -0,0 +1,85 @@
+# coding=utf-8
+# Copyright 2017 The DLT2T Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for utils.shortlist."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+# Dependency imports
+
+import numpy as np
+
+from DLT2T.utils import shortlist
+
+import tensorflow as tf
+
+# Source id 2 translates to 5, 3 to 6 and 4 to 7; 5 is the most frequent.
+_PAIRS = [([2, 3, 1], [5, 6, 5, 1]),
+          ([2, 4, 1], [5, 7, 1]),
+          ([3, 4, 1], [6, 7, 1]),
+          ([2, 1], [5, 1])]
+
+
+class ShortlistTest(tf.test.TestCase):
+
+  def testBuildLexicalTable(self):
+    lexicon, frequent = shortlist.build_lexical_table(
+        _PAIRS, vocab_size=8, num_translations=1, num_frequent=2,
+        chunk_size=3)
+    self.assertEqual((8, 1), lexicon.shape)
+    self.assertEqual([0, 0, 5, 6, 7, 0, 0, 0], lexicon[:, 0].tolist())
+    self.assertEqual([5, 6], frequent.tolist())
+
+  def testBatchShortlist(self):
+    lexicon, frequent = shortlist.build_lexical_table(
+        _PAIRS, vocab_size=8, num_translations=1, num_frequent=1)
+    self.assertEqual([0, 1, 5, 4, 7],
+                     shortlist.batch_shortlist([[4, 1]], lexicon,
+                                               frequent).tolist())
+    coverage, mean_size = shortlist.shortlist_coverage(
+        [([4, 1], [7, 1]), ([3, 1], [2, 1])], lexicon, frequent, batch_size=1)
+    self.assertEqual(0.75, coverage)
+    self.assertEqual(5.0, mean_size)
+
+  def testShortlistIdsMatchesBatchShortlist(self):
+    lexicon, frequent = shortlist.build_lexical_table(
+        _PAIRS, vocab_size=8, num_translations=2, num_frequent=1)
+    inputs = np.array([[2, 3, 1], [4, 1, 0]], dtype=np.int32)
+    with self.test_session() as session:
+      ids = session.run(shortlist.shortlist_ids(
+          tf.constant(inputs), lexicon, frequent))
+    self.assertEqual(
+        shortlist.batch_shortlist(inputs.tolist(), lexicon, frequent).tolist(),
+        ids.tolist())
+
+  def testSaveAndLoadShortlistTables(self):
+    filename = os.path.join(self.get_temp_dir(), "shortlist.npz")
+    tables = {direction: shortlist.build_lexical_table(
+        [(a, b) if direction == "A2B" else (b, a) for a, b in _PAIRS],
+        vocab_size=8, num_translations=2, num_frequent=3)
+              for direction in shortlist.DIRECTIONS}
+    shortlist.save_shortlist_tables(filename, tables)
+    lexicon, frequent = shortlist.load_shortlist_table(
+        filename, "B2A", num_translations=1, num_frequent=2)
+    self.assertAllEqual(tables["B2A"][0][:, :1], lexicon)
+    self.assertAllEqual(tables["B2A"][1][:2], frequent)
+
+
+if __name__ == "__main__":
+  tf.test.main()
@@ -22,7 +22,10 @@ setup(
     scripts=[
         'DLT2T/bin/dual-t2t-trainer',
         'DLT2T/bin/dual-t2t-datagen',
+        'DLT2T/bin/dual-t2t-backtranslate',
         'DLT2T/bin/dual-t2t-decoder',
+        'DLT2T/bin/dual-t2t-lm-score',
+        'DLT2T/bin/dual-t2t-shortlist',
         'DLT2T/bin/dual-t2t-make-tf-configs',
     ],
     install_requires=[